@@ -0,0 +1,20 @@
+import numpy as np
+from typing import List
+
+def synthetic_floors(n_rooms: int, rooms_per_floor: int = 200, zones_per_floor: int = 4,
+                     common_share: float = 0.2, seed: int = 0) -> List[dict]:
+    """floors.json-shaped building with `n_rooms` rooms of random size, for benchmarks."""
+    rng = np.random.default_rng(seed)
+    floors = []
+    for f0 in range(0, n_rooms, rooms_per_floor):
+        n = min(rooms_per_floor, n_rooms - f0)
+        fid = f"F{f0 // rooms_per_floor + 1}"
+        rooms = []
+        for j in range(n):
+            common = bool(rng.random() < common_share)
+            cap = int(rng.integers(20, 120) if common else rng.integers(2, 16))
+            rooms.append({"room_id": f"{fid}-R{j}", "area_m2": float(cap * rng.uniform(2.0, 4.0)),
+                          "capacity": cap, "zone": f"Z{j % zones_per_floor + 1}", "is_common": common,
+                          "x": j % 20, "y": j // 20, "w": 1, "h": 1})
+        floors.append({"floor_id": fid, "name": fid, "rooms": rooms})
+    return floors
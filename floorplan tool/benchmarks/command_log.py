@@ -0,0 +1,50 @@
+import os, json, time, shutil, tempfile, argparse
+import pandas as pd
+from src.iot import CommandLog
+
+def _msg(i: int) -> dict:
+    return {"ts": time.time(), "floor_id": f"F{i % 3 + 1}", "room_id": f"R{i % 100}", "device": "hvac",
+            "command": "eco", "payload": {"reason": "vacant"}}
+
+def open_per_message(path: str, n: int):
+    """The previous IoTSink.send: open, append one line, close."""
+    for i in range(n):
+        with open(path, "a") as f:
+            f.write(json.dumps(_msg(i)) + "\n")
+
+def group_commit(path: str, n: int, **options):
+    log = CommandLog(path, **options)
+    for i in range(n):
+        log.write(_msg(i))
+    log.close()
+
+def bench(n: int, tmp: str) -> list:
+    cases = [("open_per_message", open_per_message, {}),
+             ("group_commit fsync=never", group_commit, {"fsync": "never"}),
+             ("group_commit fsync=interval", group_commit, {"fsync": "interval"}),
+             ("group_commit fsync=always", group_commit, {"fsync": "always"}),
+             ("group_commit fsync=always flush_every=32", group_commit, {"fsync": "always", "flush_every": 32}),
+             ("group_commit rotate 1MB + gzip", group_commit, {"rotate_bytes": 1 << 20})]
+    rows = []
+    for name, fn, options in cases:
+        d = tempfile.mkdtemp(dir=tmp)
+        t0 = time.perf_counter()
+        fn(os.path.join(d, "commands.log"), n, **options)
+        dt = time.perf_counter() - t0
+        rows.append({"writer": name, "messages": n, "seconds": round(dt, 3), "msgs_per_s": int(n / dt)})
+        shutil.rmtree(d)
+    return rows
+
+def main():
+    ap = argparse.ArgumentParser(description="Command log throughput: open-per-message vs group commit")
+    ap.add_argument("--messages", type=int, default=100000)
+    ap.add_argument("--dir", default=None, help="where to write (default: a temp dir); use the disk the controller logs to")
+    args = ap.parse_args()
+    tmp = tempfile.mkdtemp(dir=args.dir)
+    try:
+        print(pd.DataFrame(bench(args.messages, tmp)).to_string(index=False))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import time, argparse
+import numpy as np
+import pandas as pd
+from src.floors import room_table
+from src.livebus import simulate_tick, tick_frames
+from src.energy_model import RoomEnergyModel
+from ._floors import synthetic_floors
+
+def bench(n_rooms: int, ticks: int) -> dict:
+    tbl = room_table(synthetic_floors(n_rooms))
+    model = RoomEnergyModel(tbl)
+    rng = np.random.default_rng(0)
+    prev = np.zeros(n_rooms)
+    now = pd.Timestamp("2025-09-18T11:00:00", tz="UTC")
+
+    t0 = time.perf_counter()
+    for k in range(ticks):
+        prev = simulate_tick(tbl, prev, 11.0, rng, model)["count"]
+    sim_s = (time.perf_counter() - t0) / ticks
+
+    t0 = time.perf_counter()
+    for k in range(ticks):
+        sim = simulate_tick(tbl, prev, 11.0, rng, model)
+        prev = sim["count"]
+        tick_frames(tbl, now, sim)
+    frame_s = (time.perf_counter() - t0) / ticks
+    return {"rooms": n_rooms, "sim_ticks_per_s": 1 / sim_s, "with_frames_ticks_per_s": 1 / frame_s}
+
+def main():
+    ap = argparse.ArgumentParser(description="Live tick throughput against building size")
+    ap.add_argument("--rooms", type=int, nargs="+", default=[30, 300, 1000, 5000, 10000])
+    ap.add_argument("--ticks", type=int, default=50)
+    args = ap.parse_args()
+    print(pd.DataFrame([bench(n, args.ticks) for n in args.rooms]).to_string(index=False, float_format="%.1f"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import time, argparse
+import numpy as np
+import pandas as pd
+from src.merge_policy import suggest_merges_to_common
+from ._floors import synthetic_floors
+
+def scarce_counts(floors_list, rng, common_fill: float = 0.85, occupied_share: float = 0.6) -> dict:
+    """Counts with common rooms mostly full, so not every occupied room can be merged."""
+    out = {}
+    for F in floors_list:
+        out[F["floor_id"]] = {
+            r["room_id"]: int(r["capacity"] * common_fill) if r["is_common"]
+            else int(rng.integers(1, r["capacity"] + 1)) * int(rng.random() < occupied_share)
+            for r in F["rooms"]}
+    return out
+
+def bench(rooms_per_zone: int, zones: int, reps: int, budget: float) -> dict:
+    floors_list = synthetic_floors(rooms_per_zone * zones, rooms_per_floor=rooms_per_zone * zones, zones_per_floor=zones)
+    rng = np.random.default_rng(0)
+    row = {"rooms_per_zone": rooms_per_zone, "zones": zones}
+    greedy_area = optimal_area = greedy_s = optimal_s = 0.0
+    fallbacks = 0
+    for _ in range(reps):
+        counts = scarce_counts(floors_list, rng)
+        t0 = time.perf_counter()
+        greedy_area += suggest_merges_to_common(floors_list, counts)["saved_area_m2"]
+        greedy_s += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        res = suggest_merges_to_common(floors_list, counts, solver="optimal", time_budget_s=budget)
+        optimal_s += time.perf_counter() - t0
+        optimal_area += res["saved_area_m2"]
+        fallbacks += res["solver"]["greedy_fallbacks"]
+    row.update({"greedy_saved_m2": greedy_area / reps, "optimal_saved_m2": optimal_area / reps,
+                "gain_pct": 100 * (optimal_area / greedy_area - 1) if greedy_area else 0.0,
+                "greedy_ms": 1000 * greedy_s / reps, "optimal_ms": 1000 * optimal_s / reps,
+                "fallback_zones": fallbacks})
+    return row
+
+def main():
+    ap = argparse.ArgumentParser(description="Knapsack merge solver against the greedy fill")
+    ap.add_argument("--rooms_per_zone", type=int, nargs="+", default=[50, 200, 500])
+    ap.add_argument("--zones", type=int, default=4)
+    ap.add_argument("--reps", type=int, default=5)
+    ap.add_argument("--budget", type=float, default=0.5, help="solver time budget per call (s)")
+    args = ap.parse_args()
+    rows = [bench(n, args.zones, args.reps, args.budget) for n in args.rooms_per_zone]
+    print(pd.DataFrame(rows).to_string(index=False, float_format="%.1f"))
+
+if __name__ == "__main__":
+    main()
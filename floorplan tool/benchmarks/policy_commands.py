@@ -0,0 +1,76 @@
+import time, argparse
+import numpy as np
+import pandas as pd
+from src.floors import room_table
+from src.merge_policy import suggest_merges_to_common
+from src.policy import derive_commands, derive_command_codes, policy_inputs, materialize_commands
+from ._floors import synthetic_floors
+
+def dict_walk(floors_list, counts, assignments, sensors):
+    """policy.derive_commands as it was before the array engine: nested dict lookups, dicts per room."""
+    cmds = []
+    for F in floors_list:
+        fid = F["floor_id"]
+        for r in F["rooms"]:
+            rid = r["room_id"]
+            c = counts.get(fid, {}).get(rid, 0)
+            sens = (sensors or {}).get(fid, {}).get(rid, {})
+            co2 = sens.get("co2", 450.0); lux = sens.get("lux", 200.0); door = sens.get("door", 0)
+            active = assignments.get(fid, {}).get(rid, {}).get("active", True)
+            if c == 0:
+                for dev in ("lights", "fan", "hvac"):
+                    cmds.append({"floor_id": fid, "room_id": rid, "device": dev, "command": "off", "payload": {"reason": "vacant"}})
+                continue
+            cmds.append({"floor_id": fid, "room_id": rid, "device": "lights", "command": "on",
+                         "payload": {"level": "dim"} if lux >= 600 else {}})
+            cmds.append({"floor_id": fid, "room_id": rid, "device": "fan", "command": "on", "payload": {}})
+            if door == 1:
+                cmds.append({"floor_id": fid, "room_id": rid, "device": "hvac", "command": "eco", "payload": {"warning": "door_open"}})
+                cmds.append({"floor_id": fid, "room_id": rid, "device": "advice", "command": "note",
+                             "payload": {"msg": "Close door to maintain efficiency"}})
+            elif active is False:
+                cmds.append({"floor_id": fid, "room_id": rid, "device": "hvac", "command": "eco", "payload": {"note": "merge-suggested"}})
+            else:
+                cmds.append({"floor_id": fid, "room_id": rid, "device": "hvac", "command": "comfort",
+                             "payload": {"vent_boost": True} if co2 >= 1200 else {}})
+    return cmds
+
+def _timed(fn, reps):
+    t0 = time.perf_counter()
+    for _ in range(reps):
+        out = fn()
+    return (time.perf_counter() - t0) / reps * 1000, out
+
+def bench(n_rooms: int, reps: int) -> dict:
+    floors_list = synthetic_floors(n_rooms)
+    tbl = room_table(floors_list)
+    rng = np.random.default_rng(0)
+    counts = dict(zip(tbl["room_id"], rng.integers(0, 4, n_rooms).tolist()))
+    by_floor = {}
+    for fid, rid in zip(tbl["floor_id"], tbl["room_id"]):
+        by_floor.setdefault(fid, {})[rid] = counts[rid]
+    sensors = {}
+    for fid, rid in zip(tbl["floor_id"], tbl["room_id"]):
+        sensors.setdefault(fid, {})[rid] = {"co2": float(rng.uniform(400, 1500)), "lux": float(rng.uniform(100, 800)),
+                                             "door": int(rng.random() < 0.1)}
+    assignments = suggest_merges_to_common(floors_list, by_floor)["assignments"]
+    arrays = policy_inputs(tbl, by_floor, assignments, sensors)
+
+    legacy_ms, legacy = _timed(lambda: dict_walk(floors_list, by_floor, assignments, sensors), reps)
+    wrapper_ms, wrapped = _timed(lambda: derive_commands(floors_list, by_floor, assignments, sensors), reps)
+    codes_ms, codes = _timed(lambda: derive_command_codes(**arrays), reps)
+    egress_ms, _ = _timed(lambda: materialize_commands(tbl, codes), reps)
+    assert wrapped == legacy
+    return {"rooms": n_rooms, "commands": len(codes["room"]), "dict_walk_ms": legacy_ms,
+            "derive_commands_ms": wrapper_ms, "codes_ms": codes_ms, "materialize_ms": egress_ms,
+            "codes_speedup": legacy_ms / codes_ms}
+
+def main():
+    ap = argparse.ArgumentParser(description="Array command engine against the dict-walking policy")
+    ap.add_argument("--rooms", type=int, nargs="+", default=[100, 10000, 100000])
+    ap.add_argument("--reps", type=int, default=5)
+    args = ap.parse_args()
+    print(pd.DataFrame([bench(n, args.reps) for n in args.rooms]).to_string(index=False, float_format="%.2f"))
+
+if __name__ == "__main__":
+    main()
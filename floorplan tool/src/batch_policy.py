@@ -0,0 +1,179 @@
+import os, json, hashlib, shutil, tempfile, argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+from .floors import load_floors, room_table, floors_hash
+from .merge_policy import MergePlanner
+from .policy import derive_command_codes, load_rules, DEFAULT_RULES
+from .storage import ColumnarStore, detect_store, read_json, write_json_atomic
+from .replay import iter_ticks
+
+TABLES = ("merges", "commands", "rooms")
+CACHE_DIR = "_policy_eval"
+
+def _fingerprint(dataset_dir: str, table: str) -> list:
+    """Sizes and mtimes of a table's files; any rewrite or append changes it."""
+    store = detect_store(dataset_dir, table)
+    if store.kind == "columnar":
+        paths = [os.path.join(pdir, "timestamp.bin") for _, pdir in store.partitions(table)]
+    else:
+        paths = [store.path(table)]
+    return [[os.path.basename(os.path.dirname(p)), os.path.getsize(p), os.stat(p).st_mtime_ns]
+            for p in paths if os.path.exists(p)]
+
+def cache_key(dataset_dir: str, floors_json: str, solver: str, rules_path: str = DEFAULT_RULES) -> str:
+    meta = {"floors": floors_hash(floors_json), "rules": hashlib.sha256(open(rules_path, "rb").read()).hexdigest(), "solver": solver,
+            "occupancy": _fingerprint(dataset_dir, "occupancy"), "sensors": _fingerprint(dataset_dir, "sensors")}
+    return hashlib.sha256(json.dumps(meta, sort_keys=True).encode()).hexdigest()[:16]
+
+def _evaluate_chunk(job: dict) -> Dict[str, pd.DataFrame]:
+    """Merge and control policies for every tick in [start_ns, end_ns), one MergePlanner across the chunk."""
+    _, floors_list = load_floors(job["floors_json"])
+    tbl = room_table(floors_list)
+    planner = MergePlanner(floors_list, solver=job["solver"])
+    rules = load_rules(job["rules_path"])
+    devices, commands, hvac_dev = rules.devices, rules.commands, rules.devices.index("hvac")
+    keys = list(zip(tbl["floor_id"].tolist(), tbl["room_id"].tolist()))
+    n_dev_cmd = len(devices) * len(commands)
+    stamps, saved, n_sugg, vacant, hvac, active_rows, dev_cmd = [], [], [], [], [], [], []
+    for ts, a in iter_ticks(job["dataset_dir"], tbl, start=job["start_ns"], end=job["end_ns"]):
+        counts_by_floor = {fid: {} for fid in tbl["floors"]}
+        for (fid, rid), c in zip(keys, a["count"].tolist()):
+            counts_by_floor[fid][rid] = c
+        plan = planner.plan(counts_by_floor)
+        active = np.array([plan["assignments"][fid][rid]["active"] for fid, rid in keys], dtype=bool)
+        codes = derive_command_codes(a["count"], a["co2"], a["lux"], a["door"], active, rules)
+        stamps.append(ts)
+        saved.append(plan["saved_area_m2"])
+        n_sugg.append(len(plan["suggestions"]))
+        vacant.append(int((a["count"] == 0).sum()))
+        active_rows.append(active)
+        # hvac mode per room in room order; -1 where no rule set one
+        mode = np.full(len(keys), -1, dtype=np.int64)
+        is_hvac = codes["device"] == hvac_dev
+        mode[codes["room"][is_hvac]] = codes["command"][is_hvac]
+        hvac.append(mode)
+        dev_cmd.append(np.bincount(codes["device"].astype(np.int64) * len(commands) + codes["command"],
+                                   minlength=n_dev_cmd))
+    if not stamps:
+        return {}
+    T, R = len(stamps), len(keys)
+    stamps = pd.DatetimeIndex(stamps)
+    active_m = np.vstack(active_rows)
+    merges = pd.DataFrame({"timestamp": stamps, "saved_area_m2": saved, "merged_rooms": n_sugg,
+                           "vacant_rooms": vacant})
+    dc = np.vstack(dev_cmd)
+    t_idx, k_idx = np.nonzero(dc)
+    per_device = pd.DataFrame({"timestamp": stamps[t_idx],
+                               "device": np.array(devices, dtype=object)[k_idx // len(commands)],
+                               "command": np.array(commands, dtype=object)[k_idx % len(commands)],
+                               "n": dc[t_idx, k_idx]})
+    rooms = pd.DataFrame({"timestamp": np.repeat(stamps, R), "floor_id": np.tile(tbl["floor_id"], T),
+                          "room_id": np.tile(tbl["room_id"], T), "active": active_m.ravel().astype(np.int64),
+                          "hvac": np.array(commands + ("none",), dtype=object)[np.concatenate(hvac)]})
+    return {"merges": merges, "commands": per_device, "rooms": rooms}
+
+def _split(dataset_dir: str, parts: int) -> List[tuple]:
+    """
+    Contiguous [start_ns, end_ns) ranges holding about the same number of timestamps each. Every range
+    is one iter_ticks call, which parses whole CSV tables, so serial callers should ask for one.
+    """
+    occ = detect_store(dataset_dir, "occupancy").read("occupancy", ["timestamp"])
+    if occ is None or not len(occ): return []
+    ts = np.unique(occ["timestamp"].to_numpy(dtype="datetime64[ns]").view(np.int64))
+    bounds = [int(b[0]) for b in np.array_split(ts, min(parts, len(ts)))] + [int(ts[-1]) + 1]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def evaluate_timeline(dataset_dir: str, floors_json: str = "data/floors.json", solver: str = "greedy",
+                      workers: int = 1, use_cache: bool = True, rules_path: str = DEFAULT_RULES) -> Dict[str, pd.DataFrame]:
+    """
+    Runs the merge and control policies at every timestamp of a batch dataset and returns tidy tables:
+      merges    timestamp, saved_area_m2, merged_rooms, vacant_rooms
+      commands  timestamp, device, command, n
+      rooms     timestamp, floor_id, room_id, active, hvac
+    With workers > 1 the timeline is split into contiguous chunks across that many processes. Results are cached in
+    <dataset_dir>/_policy_eval/<key>/ (columnar), keyed on floors.json, the rule file, the solver and the sizes and
+    mtimes of the occupancy and sensors tables, so regenerating the dataset invalidates them.
+    """
+    key = cache_key(dataset_dir, floors_json, solver, rules_path)
+    cdir = os.path.join(dataset_dir, CACHE_DIR, key)
+    if use_cache and read_json(os.path.join(cdir, "_complete.json")) is not None:
+        cache = ColumnarStore(cdir)
+        return {t: cache.read(t) for t in TABLES}
+
+    jobs = [{"dataset_dir": dataset_dir, "floors_json": floors_json, "solver": solver, "rules_path": rules_path,
+             "start_ns": lo, "end_ns": hi}
+            for lo, hi in _split(dataset_dir, workers * 4 if workers > 1 else 1)]
+    if workers <= 1:
+        parts = [_evaluate_chunk(j) for j in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_evaluate_chunk, jobs))
+    out = {t: pd.concat([p[t] for p in parts if p], ignore_index=True) if any(parts) else pd.DataFrame()
+           for t in TABLES}
+
+    if use_cache and len(out["merges"]):
+        _publish(dataset_dir, key, out, {"key": key, "solver": solver, "ticks": len(out["merges"])})
+    return out
+
+def _publish(dataset_dir: str, key: str, tables: Dict[str, pd.DataFrame], meta: dict):
+    """
+    Writes the cache into a private temp dir and renames it to <key>, so concurrent callers (e.g.
+    dashboard sessions) only ever see no cache or a complete one. If another writer got there
+    first its copy is kept. Other keys belong to previous versions of the dataset and are removed.
+    """
+    root = os.path.join(dataset_dir, CACHE_DIR)
+    os.makedirs(root, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=root, prefix=f".{key}.")
+    store = ColumnarStore(tmp)
+    for t in TABLES:
+        store.append(t, tables[t])
+    write_json_atomic(meta, os.path.join(tmp, "_complete.json"))
+    try:
+        os.replace(tmp, os.path.join(root, key))
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+    for name in os.listdir(root):
+        if name != key and not name.startswith(f".{key}."):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+def day_kpis(tables: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """
+    saved_by_hour     mean saved m² and merged rooms per hour
+    commands          total commands per device and command over the timeline
+    eco_hours         hours each room's HVAC spent in eco, longest first
+    """
+    merges, rooms = tables["merges"], tables["rooms"]
+    if merges is None or not len(merges):
+        return {}
+    stamps = merges["timestamp"].sort_values()
+    step_h = stamps.diff().median().total_seconds() / 3600 if len(stamps) > 1 else 0.0
+    hourly = merges.assign(hour=merges["timestamp"].dt.floor("1h"))
+    saved_by_hour = hourly.groupby("hour", as_index=False).agg(saved_area_m2=("saved_area_m2", "mean"),
+                                                               merged_rooms=("merged_rooms", "mean"))
+    commands = (tables["commands"].astype({"device": str, "command": str})
+                .groupby(["device", "command"], as_index=False)["n"].sum())
+    eco = rooms[rooms["hvac"].astype(str) == "eco"].astype({"floor_id": str, "room_id": str})
+    eco_hours = (eco.groupby(["floor_id", "room_id"], as_index=False).size()
+                 .rename(columns={"size": "eco_hours"}))
+    eco_hours["eco_hours"] = eco_hours["eco_hours"] * step_h
+    return {"saved_by_hour": saved_by_hour, "commands": commands,
+            "eco_hours": eco_hours.sort_values("eco_hours", ascending=False).reset_index(drop=True)}
+
+def main():
+    ap = argparse.ArgumentParser(description="Evaluate the merge and control policies over a whole batch dataset")
+    ap.add_argument("--dataset", default="outputs/synth")
+    ap.add_argument("--floors_json", default="data/floors.json")
+    ap.add_argument("--solver", choices=["greedy", "optimal"], default="greedy")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--rules", default=DEFAULT_RULES)
+    ap.add_argument("--no_cache", action="store_true")
+    args = ap.parse_args()
+    tables = evaluate_timeline(args.dataset, args.floors_json, args.solver, args.workers, not args.no_cache, args.rules)
+    for name, df in day_kpis(tables).items():
+        print(f"== {name}")
+        print(df.head(20).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
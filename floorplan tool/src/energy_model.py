@@ -0,0 +1,75 @@
+import numpy as np
+from typing import Dict, List
+from .floors import load_floors, room_table
+
+class RoomEnergyModel:
+    """
+    Per-room electrical load (kW) used by the batch and live generators:
+      ambient    ambient_kw_per_m2 * area
+      people     per_person_watts * count / 1000
+      cooling    max(T_out - setpoint, 0) * hvac_kw_per_degC_per_m2 * area (vacant rooms at vacant_cooling_share)
+      lighting   lighting_kw_per_m2 * area, times dim_factor when occupied and lux >= dim_lux
+      door       door_penalty_kw when occupied with the door open
+    Coefficients are precomputed per room (floors.room_table order); inputs are arrays whose last
+    axis is the room axis, e.g. (time x room) matrices with a (time,) outdoor temperature.
+    Controlled rooms (what-if runs) pass `lighting_share` / `cooling_share` arrays, which replace the
+    dimming and vacancy factors above (0 = off, 1 = full).
+    """
+
+    def __init__(self, tbl: Dict[str, np.ndarray],
+                 ambient_kw_per_m2: float = 0.02,
+                 per_person_watts: float = 120.0,
+                 hvac_kw_per_degC_per_m2: float = 0.01,
+                 setpoint_cool_c: float = 24.0,
+                 lighting_kw_per_m2: float = 0.008,
+                 dim_lux: float = 600.0,
+                 dim_factor: float = 0.5,
+                 vacant_cooling_share: float = 0.3,
+                 door_penalty_kw: float = 0.1):
+        self.tbl = tbl
+        area = tbl["area_m2"]
+        self.ambient_kw = ambient_kw_per_m2 * area
+        self.kw_per_person = per_person_watts / 1000.0
+        self.cooling_kw_per_degC = hvac_kw_per_degC_per_m2 * area
+        self.lighting_kw = lighting_kw_per_m2 * area
+        self.setpoint_cool_c = setpoint_cool_c
+        self.dim_lux = dim_lux
+        self.dim_factor = dim_factor
+        self.vacant_cooling_share = vacant_cooling_share
+        self.door_penalty_kw = door_penalty_kw
+        n_floors = len(tbl["floors"])
+        self.floor_matrix = np.zeros((len(area), n_floors))
+        self.floor_matrix[np.arange(len(area)), tbl["floor_idx"]] = 1.0
+
+    @classmethod
+    def from_floors(cls, floors_list: List[dict], **params) -> "RoomEnergyModel":
+        return cls(room_table(floors_list), **params)
+
+    @classmethod
+    def from_json(cls, floors_json: str, **params) -> "RoomEnergyModel":
+        return cls.from_floors(load_floors(floors_json)[1], **params)
+
+    def room_kw(self, count, lux, door, t_out, lighting_share=None, cooling_share=None) -> np.ndarray:
+        count = np.asarray(count)
+        t_out = np.asarray(t_out, dtype=float)
+        occupied = count > 0
+        over = np.maximum(t_out - self.setpoint_cool_c, 0.0)
+        if over.ndim:
+            over = over[..., None]
+        if cooling_share is None:
+            cooling_share = np.where(occupied, 1.0, self.vacant_cooling_share)
+        if lighting_share is None:
+            lighting_share = np.where((np.asarray(lux) >= self.dim_lux) & occupied, self.dim_factor, 1.0)
+        cooling = over * self.cooling_kw_per_degC * cooling_share
+        lighting = self.lighting_kw * lighting_share
+        door_kw = np.where((np.asarray(door) == 1) & occupied, self.door_penalty_kw, 0.0)
+        return self.ambient_kw + self.kw_per_person * count + cooling + lighting + door_kw
+
+    def rollup(self, kw: np.ndarray):
+        """(floor kW in room_table floor order, building kW) for a (..., room) kW array."""
+        return kw @ self.floor_matrix, kw.sum(axis=-1)
+
+    def evaluate(self, count, lux, door, t_out) -> Dict[str, np.ndarray]:
+        kw = self.room_kw(count, lux, door, t_out)
+        floor_kw, building_kw = self.rollup(kw)
+        return {"kw": kw, "floor_kw": floor_kw, "building_kw": building_kw}
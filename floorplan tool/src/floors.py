@@ -1,4 +1,5 @@
-import json
+import json, hashlib
+import numpy as np
 from typing import Dict, List, Tuple
 
 def load_floors(path: str = "data/floors.json") -> Tuple[Dict[tuple, dict], List[dict]]:
@@ -12,8 +13,35 @@ def load_floors(path: str = "data/floors.json") -> Tuple[Dict[tuple, dict], List
             idx[(fid, r["room_id"])] = r2
     return idx, floors_list
 
+def floors_hash(path: str = "data/floors.json") -> str:
+    """Content hash of floors.json; changes whenever the plan inputs do."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
 def rooms_by_floor(floors_list: List[dict], floor_id: str) -> List[dict]:
     for f in floors_list:
         if f["floor_id"] == floor_id:
             return f["rooms"]
     return []
+
+def room_table(floors_list: List[dict]) -> Dict[str, np.ndarray]:
+    """
+    Flat per-room attribute arrays in floors.json order (floor-major), for vectorized code.
+    Column j of any (time x room) matrix refers to room j of this table.
+    """
+    fids, rids, zones, caps, areas, common, fidx = [], [], [], [], [], [], []
+    for i, F in enumerate(floors_list):
+        for r in F["rooms"]:
+            fids.append(F["floor_id"]); rids.append(r["room_id"]); zones.append(r.get("zone", ""))
+            caps.append(int(r["capacity"])); areas.append(float(r["area_m2"]))
+            common.append(bool(r.get("is_common", False))); fidx.append(i)
+    return {
+        "floors": np.array([F["floor_id"] for F in floors_list], dtype=object),
+        "floor_id": np.array(fids, dtype=object),
+        "room_id": np.array(rids, dtype=object),
+        "zone": np.array(zones, dtype=object),
+        "capacity": np.array(caps, dtype=np.int64),
+        "area_m2": np.array(areas, dtype=float),
+        "is_common": np.array(common, dtype=bool),
+        "floor_idx": np.array(fidx, dtype=np.int64),
+    }
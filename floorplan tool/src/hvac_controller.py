@@ -1,26 +1,94 @@
-import os, glob, time, json, argparse
+import os, io, glob, time, argparse
+import numpy as np
 import pandas as pd
-from typing import Dict, Any
-from .merge_policy import load_rooms, suggest_merges_to_common
+from typing import Dict, Any, List, Optional
+from .floors import load_floors, floors_hash, room_table
+from .merge_policy import MergePlanner, ZonePlanCache
 from .iot import IoTSink
+from .policy import RuleSet, CommandStabilizer, load_rules, default_rules, materialize_commands, DEFAULT_RULES
+from .snapbus import SnapshotSubscriber
+from .stateapi import StatePublisher
 
-def latest_counts_from_glob(csv_glob: str) -> Dict[str, int]:
-    files = glob.glob(csv_glob)
-    if not files: return {}
-    dfs = []
-    for f in files:
+class CountsTail:
+    """
+    Latest count per room from append-only *_counts.csv files (timestamp, room_id, count). Each poll
+    reads only the bytes appended since the last one: per file it keeps the inode and byte offset,
+    starts over from the top when the path is rotated (new inode) or truncated (shorter than the
+    offset, or rewritten to the same size), and leaves an unterminated last line for the next poll. Rooms keep their last count
+    when their file rotates or disappears.
+    """
+
+    def __init__(self, csv_glob: str):
+        self.csv_glob = csv_glob
+        self.files: Dict[str, dict] = {}          # path -> {"ino", "offset", "mtime", "header"}
+        self.latest: Dict[str, tuple] = {}        # room_id -> (timestamp ns, count)
+        self.bytes_read = self.rows = self.rotations = self.truncations = 0
+
+    def poll(self) -> Dict[str, int]:
+        for path in sorted(glob.glob(self.csv_glob)):
+            try:
+                self._read(path)
+            except OSError:
+                pass
+        return {rid: c for rid, (_, c) in self.latest.items()}
+
+    def stats(self) -> dict:
+        return {"files": len(self.files), "rooms": len(self.latest), "bytes_read": self.bytes_read,
+                "rows": self.rows, "rotations": self.rotations, "truncations": self.truncations}
+
+    def _read(self, path: str):
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            state = self.files.get(path)
+            if state is None or state["ino"] != (st.st_dev, st.st_ino):
+                if state is not None:
+                    self.rotations += 1
+                state = self.files[path] = {"ino": (st.st_dev, st.st_ino), "offset": 0, "header": None}
+            elif st.st_size < state["offset"] or (st.st_size == state["offset"] and st.st_mtime_ns != state["mtime"]):
+                self.truncations += 1
+                state.update(offset=0, header=None)
+            state["mtime"] = st.st_mtime_ns
+            if st.st_size == state["offset"]:
+                return
+            f.seek(state["offset"])
+            data = f.read(st.st_size - state["offset"])
+        end = data.rfind(b"\n") + 1
+        if not end:
+            return
+        state["offset"] += end
+        self.bytes_read += end
+        data = data[:end]
+        if state["header"] is None:
+            head, _, data = data.partition(b"\n")
+            state["header"] = head.decode().strip().split(",")
+        if data.strip():
+            self._apply(state["header"], data)
+
+    def _apply(self, header: List[str], data: bytes):
         try:
-            df = pd.read_csv(f)
-            dfs.append(df)
+            df = pd.read_csv(io.BytesIO(data), header=None, names=header)
         except Exception:
-            pass
-    if not dfs: return {}
-    all_df = pd.concat(dfs, ignore_index=True)
-    if "timestamp" not in all_df.columns: return {}
-    all_df["timestamp"] = pd.to_datetime(all_df["timestamp"], utc=True, errors="coerce")
-    all_df = all_df.dropna(subset=["timestamp"]).sort_values("timestamp")
-    latest = all_df.groupby("room_id").tail(1)
-    return {r.room_id: int(r["count"]) for _, r in latest.iterrows()}
+            return
+        if not {"timestamp", "room_id", "count"} <= set(df.columns): return
+        # ISO8601: counters write timestamps with and without fractional seconds
+        ts = pd.to_datetime(df["timestamp"], utc=True, errors="coerce", format="ISO8601")
+        ok = ts.notna().to_numpy()
+        self.rows += int(ok.sum())
+        ts_ns = ts[ok].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        rids, counts = df["room_id"].to_numpy()[ok], df["count"].to_numpy()[ok]
+        # newest row per room within the chunk, then against what earlier polls saw
+        order = np.argsort(ts_ns, kind="stable")
+        newest = {}
+        for k in order.tolist():
+            newest[rids[k]] = k
+        for rid, k in newest.items():
+            prev = self.latest.get(rid)
+            if prev is None or ts_ns[k] >= prev[0]:
+                self.latest[rid] = (int(ts_ns[k]), int(counts[k]))
+
+def latest_counts_from_glob(csv_glob: str) -> Dict[str, int]:
+    """One-shot read of every file; run_loop keeps a CountsTail instead so each tick reads only new rows."""
+    return CountsTail(csv_glob).poll()
 
 def latest_sensors(sensors_csv: str) -> Dict[str, Any]:
     if not os.path.exists(sensors_csv): return {}
@@ -34,78 +102,229 @@ def latest_sensors(sensors_csv: str) -> Dict[str, Any]:
         }
     return out
 
-def derive_commands(rooms, counts, merge_plan, sensors):
+def latest_from_bus(sub: SnapshotSubscriber, timeout: Optional[float] = None):
+    """(counts, sensors) by room_id and the timestamp (epoch s) of the newest livebus snapshot."""
+    snap = sub.latest(timeout)
+    rids = [rid for _, rid in sub.rooms]
+    counts = dict(zip(rids, snap["count"].tolist()))
+    cols = {c: snap[c].tolist() for c in ("co2", "lux", "noise", "motion", "door", "rh")}
+    sensors = {rid: {c: cols[c][i] for c in cols} for i, rid in enumerate(rids)}
+    return counts, sensors, snap["timestamp_ns"] / 1e9
+
+def load_rooms(floors_json: str):
+    """floors list plus a flat room_id -> room (with floor_id) index; room ids are unique per building."""
+    idx, floors_list = load_floors(floors_json)
+    return floors_list, {rid: meta for (fid, rid), meta in idx.items()}
+
+def by_floor(rooms: Dict[str, dict], values: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    out = {}
+    for rid, v in values.items():
+        if rid in rooms:
+            out.setdefault(rooms[rid]["floor_id"], {})[rid] = v
+    return out
+
+def command_arrays(tbl, counts, merge_plan, sensors, rules: Optional[RuleSet] = None,
+                   stabilizer: Optional[CommandStabilizer] = None, now: Optional[float] = None):
     """
-    Smarter policy:
-      - If count == 0 → lights:off, fan:off, hvac:off
-      - If occupied:
-          - lights:on (dim if lux>600)
-          - hvac:comfort; if merge suggests inactive → eco
-          - if CO2>1200 → hvac:vent_boost
-          - if door open → hvac:eco + advice
+    The shared control rules (policy.RuleSet, data/control_rules.json by default) for the controller's
+    room_id-keyed inputs, passed through `stabilizer` (hysteresis and dwell) when given; returns
+    (rooms x devices) command and flag matrices aligned with `tbl` (-1 = no command).
     """
     assignments = merge_plan["assignments"]
-    cmds = []
-    for rid, meta in rooms.items():
-        c = counts.get(rid, 0)
-        sens = sensors.get(rid, {})
-        inactive_suggested = (assignments.get(rid, {}).get("active", True) is False)
-        co2 = sens.get("co2", 450.0); lux = sens.get("lux", 200.0)
-        door = sens.get("door", 0)
-
-        if c == 0:
-            cmds += [
-                (rid, "lights", "off", {"reason": "vacant"}),
-                (rid, "fan", "off", {"reason": "vacant"}),
-                (rid, "hvac", "off", {"reason": "vacant"})
-            ]
-        else:
-            light_payload = {"level": "dim"} if lux >= 600 else {}
-            cmds.append((rid, "lights", "on", light_payload))
-            cmds.append((rid, "fan", "on", {}))
-            if door == 1:
-                cmds.append((rid, "hvac", "eco", {"warning": "door_open"}))
-                cmds.append((rid, "advice", "note", {"msg": "Close door to maintain cooling efficiency"}))
-            else:
-                if inactive_suggested:
-                    cmds.append((rid, "hvac", "eco", {"note": "merge-suggested"}))
-                else:
-                    payload = {}
-                    if co2 >= 1200:
-                        payload["vent_boost"] = True
-                    cmds.append((rid, "hvac", "comfort", payload))
-    return cmds
-
-def run_loop(rooms_json, occ_glob, sensors_csv, state_path, merges_out, commands_log, interval=5):
-    rooms = load_rooms(rooms_json)
-    sink = IoTSink(commands_log)
-    os.makedirs(os.path.dirname(state_path), exist_ok=True)
-    os.makedirs(os.path.dirname(merges_out), exist_ok=True)
+    rids = tbl["room_id"].tolist()
+    sens = [sensors.get(rid, {}) for rid in rids]
+    inputs = {
+        "count": np.array([counts.get(rid, 0) for rid in rids], dtype=np.int64),
+        "co2": np.array([s.get("co2", 450.0) for s in sens], dtype=float),
+        "lux": np.array([s.get("lux", 200.0) for s in sens], dtype=float),
+        "door": np.array([s.get("door", 0) for s in sens], dtype=np.int64),
+        "active": np.array([assignments.get(fid, {}).get(rid, {}).get("active", True) is not False
+                            for fid, rid in zip(tbl["floor_id"], rids)]),
+    }
+    rules = stabilizer.rules if stabilizer is not None else rules or default_rules()
+    if stabilizer is not None:
+        return stabilizer.update(time.time() if now is None else now, **inputs)
+    return rules.decide(rules.condition_values(inputs))
+
+def _tuples(tbl, codes, rules: RuleSet) -> List[tuple]:
+    return [(c["floor_id"], c["room_id"], c["device"], c["command"], c["payload"])
+            for c in materialize_commands(tbl, codes, rules)]
+
+def derive_commands(tbl, counts, merge_plan, sensors, rules: Optional[RuleSet] = None,
+                    stabilizer: Optional[CommandStabilizer] = None, now: Optional[float] = None):
+    """command_arrays() as (floor_id, room_id, device, command, payload) tuples, one per command."""
+    rules = stabilizer.rules if stabilizer is not None else rules or default_rules()
+    cmd, flags = command_arrays(tbl, counts, merge_plan, sensors, rules, stabilizer, now)
+    return _tuples(tbl, RuleSet.codes(cmd, flags), rules)
+
+class CommandCache:
+    """
+    Last command sent per (floor, room, device), as (rooms x devices) command and flag matrices
+    aligned with the room table. `changes` returns the codes of the commands that differ from it,
+    except every `resync_every` seconds (and on the first call) when everything is re-sent so devices
+    that missed a message converge. resync_every=None disables resyncs after the first. A device
+    that gets no command on a tick is forgotten, so the same command coming back is sent again.
+    Unchanged ticks cost two array comparisons; only the returned rows are turned into dicts.
+    """
+
+    def __init__(self, resync_every: Optional[float] = 300.0):
+        self.resync_every = resync_every
+        self.cmd = self.flags = None
+        self.last_resync = None
+        self.evaluated = 0
+        self.sent = 0
+        self.resyncs = 0
+
+    def forget(self):
+        """Drops the cached state (the room table changed); the next call sends every command."""
+        self.cmd = self.flags = None
+
+    def changes(self, cmd: np.ndarray, flags: np.ndarray, now: Optional[float] = None) -> Dict[str, np.ndarray]:
+        now = time.monotonic() if now is None else now
+        full = self.last_resync is None or (self.resync_every is not None and now - self.last_resync >= self.resync_every)
+        if full:
+            self.last_resync = now
+            self.resyncs += 1
+        send = cmd >= 0
+        if not full and self.cmd is not None and self.cmd.shape == cmd.shape:
+            send &= (cmd != self.cmd) | (flags != self.flags)
+        self.cmd, self.flags = cmd.copy(), flags.copy()
+        n = int(send.sum())
+        self.evaluated += int((cmd >= 0).sum())
+        self.sent += n
+        return RuleSet.codes(np.where(send, cmd, -1), flags)
+
+    def metrics(self) -> dict:
+        suppressed = self.evaluated - self.sent
+        return {"evaluated": self.evaluated, "sent": self.sent, "suppressed": suppressed,
+                "suppression_ratio": suppressed / self.evaluated if self.evaluated else 0.0,
+                "resyncs": self.resyncs, "devices": int((self.cmd >= 0).sum()) if self.cmd is not None else 0}
+
+class Controller:
+    """
+    Everything between fresh inputs and the commands to send: the merge planner (reloaded when
+    floors.json changes), the rules, the stabilizer and the delta cache. Shared by run_loop and the
+    asyncio runtime (src/hvac_runtime.py).
+    """
+
+    def __init__(self, floors_json, resync_every=300.0, merge_solver="greedy", plan_cache_size=4096,
+                 count_buckets=None, rules_path=DEFAULT_RULES, stabilize=True):
+        self.floors_json = floors_json
+        self.merge_solver = merge_solver
+        self.stabilize = stabilize
+        self.rules = load_rules(rules_path)
+        self.cache = CommandCache(resync_every)
+        self.plan_cache = ZonePlanCache(plan_cache_size, count_buckets) if plan_cache_size else None
+        self._load_layout()
+
+    def _load_layout(self):
+        self.floors_list, self.rooms = load_rooms(self.floors_json)
+        self.tbl = room_table(self.floors_list)
+        self.stabilizer = CommandStabilizer(self.rules, len(self.tbl["room_id"])) if self.stabilize else None
+        self.cache.forget()   # its rows follow the old room table
+        self.planner = MergePlanner.from_json(self.floors_json, self.merge_solver, cache=self.plan_cache)
+
+    def decide(self, counts: Dict[str, int], sensors: Dict[str, Any], now: Optional[float] = None):
+        """(merge_plan, commands that changed since they were last sent)."""
+        if floors_hash(self.floors_json) != self.planner.floors_hash:
+            # floors.json was edited: new room index, and the plan cache drops plans for the old layout
+            self._load_layout()
+        merge_plan = self.planner.plan(by_floor(self.rooms, counts))
+        cmd, flags = command_arrays(self.tbl, counts, merge_plan, sensors, self.rules, self.stabilizer, now)
+        return merge_plan, _tuples(self.tbl, self.cache.changes(cmd, flags), self.rules)
+
+    def metrics(self) -> dict:
+        return {"command_metrics": self.cache.metrics(),
+                "plan_cache": self.plan_cache.stats() if self.plan_cache else None,
+                "stabilizer": self.stabilizer.stats() if self.stabilizer else None}
+
+# state.json keys that change every tick without anything happening in the building
+STATE_COUNTERS = ("command_metrics", "plan_cache", "stabilizer", "ingest", "persist", "runtime", "command_log", "mqtt")
+
+def run_loop(floors_json, occ_glob, sensors_csv, state_path, merges_out, commands_log, interval=5, bus_path=None,
+             resync_every=300.0, merge_solver="greedy", plan_cache_size=4096, count_buckets=None,
+             rules_path=DEFAULT_RULES, stabilize=True, pretty=False, http_port=None, stats_every=30.0,
+             log_options=None):
+    ctl = Controller(floors_json, resync_every, merge_solver, plan_cache_size, count_buckets, rules_path, stabilize)
+    sink = IoTSink(commands_log, log_options)
+    sub = SnapshotSubscriber(bus_path, name="hvac_controller") if bus_path else None
+    counts_tail = CountsTail(occ_glob)
+    # files are rewritten only when their content changes; counters alone refresh every stats_every s
+    publisher = StatePublisher({"state": state_path, "merges": merges_out}, pretty, http_port, refresh_s=stats_every)
+    if publisher.url:
+        print(f"[hvac] serving state at {publisher.url}/state")
 
     while True:
-        counts = latest_counts_from_glob(occ_glob)
-        sensors = latest_sensors(sensors_csv)
-        merge_plan = suggest_merges_to_common(rooms, counts)
-        with open(merges_out, "w") as f:
-            json.dump(merge_plan, f, indent=2)
-        cmds = derive_commands(rooms, counts, merge_plan, sensors)
-        last_cmds = [sink.send(r, d, c, p) for (r, d, c, p) in cmds]
-        state = {"counts": counts, "merge_plan": merge_plan, "sensors": sensors, "last_commands": last_cmds}
-        with open(state_path, "w") as f:
-            json.dump(state, f, indent=2)
-        time.sleep(interval)
+        if sub is not None:
+            # each livebus tick arrives once over the socket; no CSV reads. `now` is the data clock,
+            # so dwell holds under replay speed-up
+            try:
+                counts, sensors, now = latest_from_bus(sub, max(interval, 1.0))
+            except TimeoutError:
+                continue   # quiet bus: keep waiting
+        else:
+            counts = counts_tail.poll()
+            sensors = latest_sensors(sensors_csv)
+            now = time.time()
+        merge_plan, changes = ctl.decide(counts, sensors, now)
+        publisher.update("merges", merge_plan)
+        last_cmds = [sink.send(fid, r, d, c, p) for (fid, r, d, c, p) in changes]
+        state = {"counts": counts, "merge_plan": merge_plan, "sensors": sensors, "last_commands": last_cmds,
+                 **ctl.metrics(), "ingest": counts_tail.stats() if sub is None else None, "persist": publisher.stats(),
+                 "command_log": sink.log.stats(), "mqtt": sink.mqtt.metrics() if sink.mqtt else None}
+        publisher.update("state", state, volatile=STATE_COUNTERS)
+        if sub is None:
+            time.sleep(interval)
+        else:
+            sub.ack()   # lets the publisher (livebus/replay) measure our lag
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--rooms_json", default="data/rooms.json")
+    ap.add_argument("--floors_json", default="data/floors.json")
     ap.add_argument("--occ_glob", default="outputs/occupancy/*_counts.csv")
     ap.add_argument("--sensors_csv", default="outputs/sensors/sensors_latest.csv")
     ap.add_argument("--state_path", default="outputs/hvac/state.json")
     ap.add_argument("--merges_out", default="outputs/hvac/merges.json")
     ap.add_argument("--commands_log", default="outputs/hvac/commands.log")
     ap.add_argument("--interval", type=int, default=3)
+    ap.add_argument("--bus", default=None, help="livebus snapshot socket; replaces the CSV inputs and the sleep")
+    ap.add_argument("--resync_every", type=float, default=300.0,
+                    help="seconds between full re-sends of every command; in between only changes are sent (0 = never)")
+    ap.add_argument("--merge_solver", choices=["greedy", "optimal"], default="greedy")
+    ap.add_argument("--plan_cache_size", type=int, default=4096, help="zone plans kept in the LRU (0 = no cache)")
+    ap.add_argument("--count_buckets", type=int, nargs="*", default=None,
+                    help="bucket upper edges for plan cache keys, e.g. 0 2 5 10 20 (default: exact counts)")
+    ap.add_argument("--rules", default=DEFAULT_RULES, help="control rule file (JSON, or YAML with PyYAML)")
+    ap.add_argument("--no_stabilize", action="store_true", help="skip hysteresis/min-dwell; send the raw rule output")
+    ap.add_argument("--pretty", action="store_true", help="indent state.json/merges.json (debugging)")
+    ap.add_argument("--http_port", type=int, default=None,
+                    help="serve state and merges read-only on http://127.0.0.1:<port>/state and /merges")
+    ap.add_argument("--stats_every", type=float, default=30.0,
+                    help="seconds between state.json rewrites when only counters changed")
+    ap.add_argument("--runtime", choices=["loop", "async"], default="loop",
+                    help="async: separate ingest/decide/dispatch tasks, decisions triggered by input changes")
+    ap.add_argument("--occ_every", type=float, default=1.0, help="async: seconds between count file polls")
+    ap.add_argument("--sensor_every", type=float, default=2.0, help="async: seconds between sensor file checks")
+    ap.add_argument("--heartbeat", type=float, default=5.0, help="async: decide at least this often (dwell/resync timers)")
+    ap.add_argument("--queue_size", type=int, default=8, help="async: dispatch queue bound (inputs keep one latest slot per source)")
+    ap.add_argument("--log_fsync", choices=["always", "interval", "never"], default="interval",
+                    help="commands.log durability: fsync every group commit, about once a second, or never")
+    ap.add_argument("--log_flush_ms", type=float, default=50.0, help="max time a command waits in the log buffer")
+    ap.add_argument("--log_rotate_mb", type=float, default=64.0, help="rotate commands.log at this size (0 = never)")
     args = ap.parse_args()
-    run_loop(args.rooms_json, args.occ_glob, args.sensors_csv, args.state_path, args.merges_out, args.commands_log, args.interval)
+    common = (args.floors_json, args.occ_glob, args.sensors_csv, args.state_path, args.merges_out, args.commands_log)
+    options = dict(bus_path=args.bus, resync_every=args.resync_every or None, merge_solver=args.merge_solver,
+                   plan_cache_size=args.plan_cache_size, count_buckets=args.count_buckets, rules_path=args.rules,
+                   stabilize=not args.no_stabilize, pretty=args.pretty, http_port=args.http_port,
+                   stats_every=args.stats_every,
+                   log_options={"fsync": args.log_fsync, "flush_ms": args.log_flush_ms,
+                                "rotate_bytes": int(args.log_rotate_mb * (1 << 20)) or None})
+    if args.runtime == "async":
+        from .hvac_runtime import run_async
+        run_async(*common, occ_every=args.occ_every, sensor_every=args.sensor_every, heartbeat=args.heartbeat,
+                  queue_size=args.queue_size, **options)
+    else:
+        run_loop(*common, interval=args.interval, **options)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,216 @@
+import os, time, asyncio
+from collections import deque
+import numpy as np
+from typing import Dict, Optional
+from .hvac_controller import Controller, CountsTail, latest_sensors, latest_from_bus, STATE_COUNTERS
+from .iot import IoTSink
+from .policy import DEFAULT_RULES
+from .snapbus import SnapshotSubscriber
+from .stateapi import StatePublisher
+
+class LatencyStats:
+    """Rolling input-arrival -> dispatch latencies (seconds) over the last `window` decisions."""
+
+    def __init__(self, window: int = 2048):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def stats(self) -> dict:
+        if not self.samples:
+            return {"n": 0}
+        ms = 1000 * np.asarray(self.samples)
+        return {"n": self.count, "p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+                "p99_ms": float(np.percentile(ms, 99)), "max_ms": float(ms.max())}
+
+class InputSlots:
+    """
+    Pending inputs for the decider, one latest-wins slot per kind ("counts", "sensors", "bus"): when the
+    decider is behind, a new input replaces the pending one of its own kind, never another kind's, so a
+    sensors update is not lost to a burst of count updates.
+    """
+
+    def __init__(self):
+        self.pending: Dict[str, tuple] = {}
+        self._ready = asyncio.Event()
+
+    def qsize(self) -> int:
+        return len(self.pending)
+
+    def offer(self, item: tuple, stats: dict):
+        if item[0] in self.pending:
+            stats["coalesced"] += 1
+        self.pending[item[0]] = item
+        self._ready.set()
+
+    async def take(self, timeout: Optional[float]) -> list:
+        """Everything pending, waiting up to `timeout` s for the first input ([] on timeout)."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return []
+        self._ready.clear()
+        batch, self.pending = list(self.pending.values()), {}
+        return batch
+
+class ControllerRuntime:
+    """
+    Asyncio runtime for the controller. Separate tasks, each on its own cadence:
+      occupancy   polls CountsTail every `occ_every` s        ┐ one pending-input slot per source
+      sensors     re-reads the sensors CSV when it changes    ┘ (latest wins, see InputSlots)
+      bus         (instead of both, with bus_path) one snapshot per livebus tick
+      decide      wakes on new input (or every `heartbeat` s for dwell and resync timers), coalesces
+                  everything pending, plans and derives commands in a worker thread
+      dispatch    sends each decision's changed commands and persists state; its queue is bounded,
+                  so a slow sink blocks decide instead of piling up decisions
+    Latency is measured from the arrival of the oldest input a decision used to the end of its dispatch.
+    """
+
+    def __init__(self, floors_json, occ_glob, sensors_csv, state_path, merges_out, commands_log, bus_path=None,
+                 resync_every=300.0, merge_solver="greedy", plan_cache_size=4096, count_buckets=None,
+                 rules_path=DEFAULT_RULES, stabilize=True, pretty=False, http_port=None, stats_every=30.0,
+                 occ_every=1.0, sensor_every=2.0, heartbeat=5.0, queue_size=8, log_options=None, sink=None):
+        self.ctl = Controller(floors_json, resync_every, merge_solver, plan_cache_size, count_buckets, rules_path, stabilize)
+        self.sink = sink or IoTSink(commands_log, log_options)
+        self.bus_path = bus_path
+        self.sensors_csv = sensors_csv
+        self.counts_tail = CountsTail(occ_glob)
+        self.publisher = StatePublisher({"state": state_path, "merges": merges_out}, pretty, http_port,
+                                        refresh_s=stats_every)
+        self.occ_every, self.sensor_every, self.heartbeat = occ_every, sensor_every, heartbeat
+        self.inputs: Optional[InputSlots] = None
+        self.decisions: Optional[asyncio.Queue] = None
+        self.queue_size = queue_size
+        self.latency = LatencyStats()
+        self.counters = {"inputs": 0, "coalesced": 0, "decisions": 0, "heartbeats": 0, "dispatched": 0}
+        self.stage_s = {"ingest": 0.0, "decide": 0.0, "dispatch": 0.0}
+
+    def metrics(self) -> dict:
+        return {**self.counters, "latency": self.latency.stats(),
+                "stage_ms": {k: 1000 * v for k, v in self.stage_s.items()},
+                "input_queue": self.inputs.qsize() if self.inputs else 0,
+                "dispatch_queue": self.decisions.qsize() if self.decisions else 0}
+
+    # ---------------------------------------------------------------- ingest
+    async def _occupancy(self):
+        last = None
+        while True:
+            t0 = time.monotonic()
+            counts = await asyncio.to_thread(self.counts_tail.poll)
+            self.stage_s["ingest"] += time.monotonic() - t0
+            if counts != last:
+                last = counts
+                self.counters["inputs"] += 1
+                self.inputs.offer(("counts", counts, None, time.monotonic()), self.counters)
+            await asyncio.sleep(self.occ_every)
+
+    async def _sensors(self):
+        sig = None
+        while True:
+            try:
+                st = os.stat(self.sensors_csv)
+                new_sig = (st.st_ino, st.st_size, st.st_mtime_ns)
+            except OSError:
+                new_sig = None
+            if new_sig != sig:
+                sig = new_sig
+                t0 = time.monotonic()
+                sensors = await asyncio.to_thread(latest_sensors, self.sensors_csv)
+                self.stage_s["ingest"] += time.monotonic() - t0
+                self.counters["inputs"] += 1
+                self.inputs.offer(("sensors", sensors, None, time.monotonic()), self.counters)
+            await asyncio.sleep(self.sensor_every)
+
+    async def _bus(self):
+        sub = await asyncio.to_thread(SnapshotSubscriber, self.bus_path, 5.0, "hvac_controller")
+        self._sub = sub
+        try:
+            while True:
+                try:
+                    counts, sensors, ts = await asyncio.to_thread(latest_from_bus, sub, 1.0)
+                except TimeoutError:
+                    continue
+                self.counters["inputs"] += 1
+                self.inputs.offer(("bus", (counts, sensors), (ts, sub.last_seq), time.monotonic()), self.counters)
+        finally:
+            sub.close()
+
+    # ---------------------------------------------------------------- decide
+    async def _decide(self):
+        counts, sensors, data_clock, seq = {}, {}, None, None
+        while True:
+            batch = await self.inputs.take(self.heartbeat)
+            if not batch:
+                self.counters["heartbeats"] += 1
+            arrived = min((item[3] for item in batch), default=time.monotonic())
+            for kind, value, extra, _ in batch:
+                if kind == "counts":
+                    counts = value
+                elif kind == "sensors":
+                    sensors = value
+                else:
+                    (counts, sensors), (data_clock, seq) = value, extra
+            if self.bus_path is None:
+                now = time.time()
+            else:
+                if data_clock is None: continue
+                now = data_clock   # dwell on the snapshot clock, as in run_loop
+            t0 = time.monotonic()
+            merge_plan, changes = await asyncio.to_thread(self.ctl.decide, counts, sensors, now)
+            self.stage_s["decide"] += time.monotonic() - t0
+            self.counters["decisions"] += 1
+            # blocks while dispatch is `queue_size` decisions behind
+            await self.decisions.put((arrived, counts, sensors, merge_plan, changes, seq))
+
+    # ---------------------------------------------------------------- dispatch
+    def _send(self, merge_plan, changes) -> list:
+        sent = [self.sink.send(fid, r, d, c, p) for (fid, r, d, c, p) in changes]
+        self.publisher.update("merges", merge_plan)
+        return sent
+
+    async def _dispatch(self):
+        while True:
+            arrived, counts, sensors, merge_plan, changes, seq = await self.decisions.get()
+            t0 = time.monotonic()
+            sent = await asyncio.to_thread(self._send, merge_plan, changes)
+            done = time.monotonic()
+            self.stage_s["dispatch"] += done - t0
+            self.latency.add(done - arrived)
+            self.counters["dispatched"] += len(sent)
+            if seq is not None:
+                self._sub.ack(seq)   # lets the publisher (livebus/replay) measure our lag
+            state = {"counts": counts, "merge_plan": merge_plan, "sensors": sensors, "last_commands": sent,
+                     **self.ctl.metrics(), "ingest": self.counts_tail.stats() if self.bus_path is None else None,
+                     "persist": self.publisher.stats(), "runtime": self.metrics(),
+                     "command_log": self.sink.log.stats() if hasattr(self.sink, "log") else None,
+                     "mqtt": self.sink.mqtt.metrics() if getattr(self.sink, "mqtt", None) else None}
+            await asyncio.to_thread(self.publisher.update, "state", state, STATE_COUNTERS)
+
+    async def run(self, duration: Optional[float] = None):
+        """Runs until cancelled, or for `duration` seconds; returns metrics()."""
+        self.inputs = InputSlots()
+        self.decisions = asyncio.Queue(self.queue_size)
+        sources = [self._bus()] if self.bus_path else [self._occupancy(), self._sensors()]
+        tasks = [asyncio.create_task(c) for c in sources + [self._decide(), self._dispatch()]]
+        try:
+            if duration is None:
+                await asyncio.gather(*tasks)
+            else:
+                done, _ = await asyncio.wait(tasks, timeout=duration, return_when=asyncio.FIRST_EXCEPTION)
+                for t in done:
+                    t.result()   # surface a crashed stage
+        finally:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.publisher.close()
+            if hasattr(self.sink, "close"):
+                self.sink.close()
+        return self.metrics()
+
+def run_async(*args, duration: Optional[float] = None, **kwargs) -> Dict:
+    """ControllerRuntime(*args, **kwargs).run(duration) on a fresh event loop."""
+    return asyncio.run(ControllerRuntime(*args, **kwargs).run(duration))
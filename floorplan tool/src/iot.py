@@ -1,26 +1,220 @@
-import os, json, time
+import os, json, time, glob, gzip, shutil, atexit, threading
 from typing import Dict, Any, Optional
+from .mqtt_egress import MqttPublisher, paho_client
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+class CommandLog:
+    """
+    Append-only JSON-lines log with group commit. Lines are buffered and written in one write() every
+    `flush_every` messages or `flush_ms` milliseconds, whichever comes first; a background thread
+    flushes an idle buffer. fsync policy: "always" after every group commit, "interval" within
+    `fsync_ms` of any unsynced write (also when no further commands arrive), "never" (OS decides).
+    The live file rotates to <path>.<UTC time> before a line would take it past `rotate_bytes`
+    (a single larger line gets a segment of its own), or once it is `rotate_s` old; rotated segments are gzipped in the background and only the
+    newest `keep` are kept. Opening after a crash drops a torn last line and finishes any compression
+    that was interrupted.
+    """
+
+    def __init__(self, path: str, flush_every: int = 256, flush_ms: float = 50.0, fsync: str = "interval",
+                 fsync_ms: float = 1000.0, rotate_bytes: Optional[int] = 64 << 20, rotate_s: Optional[float] = None,
+                 compress: bool = True, keep: Optional[int] = None):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}")
+        self.path = path
+        self.flush_every, self.flush_s = flush_every, flush_ms / 1000
+        self.fsync, self.fsync_s = fsync, fsync_ms / 1000
+        self.rotate_bytes, self.rotate_s = rotate_bytes, rotate_s
+        self.compress, self.keep = compress, keep
+        self.messages = self.flushes = self.fsyncs = self.rotations = self.bytes = 0
+        self._buf: list = []
+        self._buf_bytes = 0
+        self._first_at = None
+        self._dirty = False          # written but not yet fsynced (interval policy)
+        self._last_fsync = time.monotonic()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.recovered_bytes = self._recover()
+        self._open()
+        self._compressor = None
+        self._compress_pending()
+        self._thread = threading.Thread(target=self._flusher, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _recover(self) -> int:
+        """Truncates a partially written last line left by a crash; returns the bytes dropped."""
+        if not os.path.exists(self.path): return 0
+        with open(self.path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            if not size: return 0
+            back = min(size, 1 << 20)
+            f.seek(size - back)
+            tail = f.read(back)
+            if tail.endswith(b"\n"): return 0
+            cut = tail.rfind(b"\n")
+            keep = size - back + cut + 1 if cut >= 0 else (0 if back == size else size)
+            f.truncate(keep)
+            return size - keep
+
+    def _open(self):
+        self._f = open(self.path, "ab")
+        self._size = self._f.tell()
+        self._opened_at = time.time()
+        if self._size:
+            # a reopened segment keeps its age (first message's ts), so time rotation survives restarts
+            with open(self.path, "rb") as f:
+                try:
+                    self._opened_at = float(json.loads(f.readline()).get("ts", self._opened_at))
+                except (ValueError, AttributeError):
+                    pass
+
+    def write(self, msg: dict):
+        line = (json.dumps(msg) + "\n").encode()
+        with self._lock:
+            if self._closed:
+                raise ValueError("write to closed CommandLog")
+            if self.rotate_bytes and self._size + self._buf_bytes + len(line) > self.rotate_bytes:
+                self._flush_locked()
+                if self._size:
+                    self._rotate_locked()
+            self._buf.append(line)
+            self._buf_bytes += len(line)
+            self.messages += 1
+            if self._first_at is None:
+                self._first_at = time.monotonic()
+                self._wake.set()
+            if len(self._buf) >= self.flush_every:
+                self._flush_locked()
+
+    def flush(self, fsync: bool = False):
+        with self._lock:
+            self._flush_locked(force_fsync=fsync)
+
+    def _flush_locked(self, force_fsync: bool = False):
+        if self._buf:
+            data = b"".join(self._buf)
+            self._buf, self._buf_bytes, self._first_at = [], 0, None
+            self._f.write(data)
+            self._f.flush()
+            self._size += len(data)
+            self.bytes += len(data)
+            self.flushes += 1
+            if self.fsync == "interval" and not self._dirty:
+                self._dirty = True
+                self._wake.set()   # the flusher owns the fsync deadline from here
+            if force_fsync or self.fsync == "always" or \
+                    (self.fsync == "interval" and time.monotonic() - self._last_fsync >= self.fsync_s):
+                self._fsync_locked()
+        elif force_fsync:
+            self._fsync_locked()
+        if (self.rotate_bytes and self._size >= self.rotate_bytes) or \
+                (self.rotate_s and self._size and time.time() - self._opened_at >= self.rotate_s):
+            self._rotate_locked()
+
+    def _fsync_locked(self):
+        os.fsync(self._f.fileno())
+        self._last_fsync = time.monotonic()
+        self._dirty = False
+        self.fsyncs += 1
+
+    def _rotate_locked(self):
+        os.fsync(self._f.fileno())
+        self._dirty = False
+        self._f.close()
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        dst, n = f"{self.path}.{stamp}", 1
+        while os.path.exists(dst) or os.path.exists(dst + ".gz"):
+            dst, n = f"{self.path}.{stamp}.{n}", n + 1
+        os.replace(self.path, dst)
+        self.rotations += 1
+        self._open()
+        self._compress_pending()
+
+    def _segments(self) -> list:
+        """Rotated segments, oldest first (<path>.<stamp>[.<n>][.gz])."""
+        def age(p):
+            stamp, _, n = p[len(self.path) + 1:].removesuffix(".gz").partition(".")
+            return stamp, int(n or 0)
+        return sorted((p for p in glob.glob(self.path + ".*") if not p.endswith(".tmp")), key=age)
+
+    def _compress_pending(self):
+        if not self.compress and self.keep is None: return
+        if self._compressor is not None and self._compressor.is_alive(): return
+        self._compressor = threading.Thread(target=self._compress_segments, daemon=True)
+        self._compressor.start()
+
+    def _compress_segments(self):
+        for tmp in glob.glob(self.path + ".*.gz.tmp"):
+            os.remove(tmp)   # interrupted compression: the plain segment is still there
+        if self.compress:
+            for seg in self._segments():
+                if seg.endswith(".gz"): continue
+                with open(seg, "rb") as src, gzip.open(seg + ".gz.tmp", "wb") as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+                os.replace(seg + ".gz.tmp", seg + ".gz")
+                os.remove(seg)
+        if self.keep is not None:
+            segs = self._segments()
+            for seg in segs[:max(len(segs) - self.keep, 0)]:
+                os.remove(seg)
+
+    def _flusher(self):
+        while True:
+            with self._lock:
+                if self._closed: return
+                now = time.monotonic()
+                if self._first_at is None or now - self._first_at >= self.flush_s:
+                    self._flush_locked()   # the due batch, or an idle check of time-based rotation
+                if self._dirty and now - self._last_fsync >= self.fsync_s:
+                    self._fsync_locked()
+                deadlines = [self._first_at + self.flush_s] if self._first_at is not None else []
+                if self._dirty:
+                    deadlines.append(self._last_fsync + self.fsync_s)
+                wait = max(min(deadlines) - now, 0.0) if deadlines else self.rotate_s
+            self._wake.wait(timeout=wait)
+            self._wake.clear()
+
+    def stats(self) -> dict:
+        return {"messages": self.messages, "flushes": self.flushes, "fsyncs": self.fsyncs, "bytes": self.bytes,
+                "rotations": self.rotations, "buffered": len(self._buf), "recovered_bytes": self.recovered_bytes}
+
+    def close(self):
+        with self._lock:
+            if self._closed: return
+            self._flush_locked(force_fsync=self.fsync != "never")
+            self._closed = True
+            self._f.close()
+        self._wake.set()
+        self._thread.join(timeout=2)
+        if self._compressor is not None:
+            self._compressor.join(timeout=30)
+            self._compress_segments()   # segments rotated while the last pass was running
 
 class IoTSink:
-    def __init__(self, log_path: str = "outputs/iot/commands.log"):
+    def __init__(self, log_path: str = "outputs/iot/commands.log", log_options: Optional[dict] = None,
+                 mqtt: Optional[MqttPublisher] = None):
+        """
+        `log_options` go to CommandLog (flush_every, flush_ms, fsync, rotate_bytes, ...). MQTT egress is
+        `mqtt`, or an MqttPublisher for MQTT_BROKER when that is set; publishing never blocks send().
+        """
         self.log_path = log_path
-        self.mqtt = None
-        self.topic_prefix = None
+        self.mqtt = mqtt
+        self.topic_prefix = os.getenv("MQTT_TOPIC_PREFIX", "building/iot")
         broker = os.getenv("MQTT_BROKER")
-        if broker:
+        if self.mqtt is None and broker:
             try:
-                import paho.mqtt.client as mqtt
-                self.mqtt = mqtt.Client()
-                port = int(os.getenv("MQTT_PORT", "1883"))
-                user = os.getenv("MQTT_USERNAME")
-                pwd = os.getenv("MQTT_PASSWORD")
-                if user and pwd:
-                    self.mqtt.username_pw_set(user, pwd)
-                self.mqtt.connect(broker, port, keepalive=30)
-                self.topic_prefix = os.getenv("MQTT_TOPIC_PREFIX", "building/iot")
-            except Exception:
+                user, pwd = os.getenv("MQTT_USERNAME"), os.getenv("MQTT_PASSWORD")
+                self.mqtt = MqttPublisher(broker, int(os.getenv("MQTT_PORT", "1883")),
+                                          qos=int(os.getenv("MQTT_QOS", "1")),
+                                          max_queue=int(os.getenv("MQTT_MAX_QUEUE", "10000")),
+                                          max_inflight=int(os.getenv("MQTT_MAX_INFLIGHT", "100")),
+                                          client_factory=lambda: paho_client(username=user, password=pwd))
+            except ImportError:
                 self.mqtt = None
-        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        self.log = CommandLog(log_path, **(log_options or {}))
 
     def send(self, floor_id: str, room_id: str, device: str, command: str, payload: Optional[Dict[str, Any]] = None) -> dict:
         msg = {
@@ -31,12 +225,15 @@ class IoTSink:
             "command": command,
             "payload": payload or {}
         }
-        with open(self.log_path, "a") as f:
-            f.write(json.dumps(msg) + "\n")
+        self.log.write(msg)
         if self.mqtt:
-            topic = f"{self.topic_prefix}/{floor_id}/{room_id}/{device}"
-            try:
-                self.mqtt.publish(topic, json.dumps(msg), qos=0, retain=False)
-            except Exception:
-                pass
+            self.mqtt.publish(f"{self.topic_prefix}/{floor_id}/{room_id}/{device}", json.dumps(msg))
         return msg
+
+    def flush(self):
+        self.log.flush()
+
+    def close(self):
+        if self.mqtt:
+            self.mqtt.close()
+        self.log.close()
@@ -1,16 +1,14 @@
-import os, json, time, math, tempfile, shutil
-from typing import Dict, Tuple
+import os, time, math, tempfile, shutil
+from typing import Dict, Optional
 import numpy as np
 import pandas as pd
 from datetime import datetime, timezone
-from .floors import load_floors
-
-def _diurnal_prob(hour: float, is_common: bool) -> float:
-    peak1 = math.exp(-((hour - 11.0) ** 2) / (2 * 2.2 ** 2))
-    peak2 = math.exp(-((hour - 15.0) ** 2) / (2 * 2.5 ** 2))
-    base = 0.02 if not is_common else 0.05
-    scale = 0.55 if is_common else 0.45
-    return max(0.0, min(0.98, base + scale * (0.55 * peak1 + 0.45 * peak2)))
+from .floors import load_floors, room_table
+from .synth import diurnal_prob_array, timeline_frames
+from .storage import open_store
+from .ringbuf import RingBuffer
+from .snapbus import SnapshotPublisher
+from .energy_model import RoomEnergyModel
 
 def _safe_write_csv(df: pd.DataFrame, path: str):
     os.makedirs(os.path.dirname(path), exist_ok=True)
@@ -19,13 +17,84 @@ def _safe_write_csv(df: pd.DataFrame, path: str):
         tmp_path = tmp.name
     shutil.move(tmp_path, path)
 
+# record layouts of the ring-buffer history (history_ticks); "room"/"floor" index floors.json order
+HISTORY_DTYPES = {
+    "occupancy_log": [("timestamp", "<i8"), ("room", "<i4"), ("count", "<i4")],
+    "sensors_log": [("timestamp", "<i8"), ("room", "<i4"), ("co2", "<f4"), ("lux", "<f4"), ("noise", "<f4"),
+                    ("motion", "i1"), ("door", "i1"), ("rh", "<f4")],
+    "energy_room_log": [("timestamp", "<i8"), ("room", "<i4"), ("kw", "<f4")],
+    "energy_floor_log": [("timestamp", "<i8"), ("floor", "<i4"), ("meter_kw", "<f4")],
+    "energy_building_log": [("timestamp", "<i8"), ("meter_kw", "<f4")],
+}
+
+def open_history_rings(out_dir: str, floors_list: list, retention_ticks: int) -> Dict[str, RingBuffer]:
+    room_keys = [[F["floor_id"], r["room_id"]] for F in floors_list for r in F["rooms"]]
+    floor_keys = [[F["floor_id"]] for F in floors_list]
+    layouts = {
+        "occupancy_log": {"index_field": "room", "index_columns": ["floor_id", "room_id"], "keys": room_keys},
+        "sensors_log": {"index_field": "room", "index_columns": ["floor_id", "room_id"], "keys": room_keys},
+        "energy_room_log": {"index_field": "room", "index_columns": ["floor_id", "room_id"], "keys": room_keys},
+        "energy_floor_log": {"index_field": "floor", "index_columns": ["floor_id"], "keys": floor_keys},
+        "energy_building_log": {"keys": []},
+    }
+    rings = {}
+    for name, meta in layouts.items():
+        per_tick = max(len(meta["keys"]), 1)
+        meta = {**meta, "records_per_tick": per_tick}
+        rings[name] = RingBuffer.create(os.path.join(out_dir, f"{name}.ring"), HISTORY_DTYPES[name],
+                                        retention_ticks * per_tick, meta)
+    return rings
+
+def _history_records(name: str, df: pd.DataFrame, ts_ns: int) -> np.ndarray:
+    recs = np.zeros(len(df), dtype=HISTORY_DTYPES[name])
+    recs["timestamp"] = ts_ns
+    for field in recs.dtype.names:
+        if field == "room" or field == "floor":
+            recs[field] = np.arange(len(df))
+        elif field != "timestamp":
+            recs[field] = df[field].to_numpy()
+    return recs
+
+def simulate_tick(tbl: dict, prev_counts: np.ndarray, hour_local: float, rng: np.random.Generator,
+                  model: Optional[RoomEnergyModel] = None) -> dict:
+    """One live tick for every room of `tbl` (see floors.room_table) as whole-building array draws."""
+    R = len(tbl["room_id"])
+    # synthetic outdoor temperature diurnal
+    T_out = 28.0 + 6.0 * math.sin((hour_local - 6) / 24 * 2 * math.pi) + rng.normal(0, 0.4)
+
+    p = diurnal_prob_array(np.array([hour_local]), tbl["is_common"])[0]
+    draw = rng.binomial(tbl["capacity"], p)
+    count = np.rint(0.6 * prev_counts + 0.4 * draw).astype(np.int64)
+    occupied = count > 0
+
+    # sensors
+    daytime = 7 <= int(hour_local) <= 18
+    co2 = np.clip(rng.normal(450 + 35 * count, 40), 400, 2000)
+    lux = np.clip(rng.normal(700 if daytime else 120, 80, size=R), 0, 1500)
+    noise = np.clip(35 + 3 * np.sqrt(count) + rng.normal(0, 2, size=R), 30, 85)
+    motion = occupied.astype(np.int64)
+    door = (rng.random(R) < np.where(occupied, 0.1, 0.02)).astype(np.int64)
+    rh = np.clip(rng.normal(50, 6, size=R), 30, 70)
+
+    energy = (model or RoomEnergyModel(tbl)).evaluate(count, lux, door, T_out)
+    return {"count": count, "co2": co2, "lux": lux, "noise": noise, "motion": motion,
+            "door": door, "rh": rh, "t_out": T_out, **energy}
+
+def tick_frames(tbl: dict, now, sim: dict) -> Dict[str, pd.DataFrame]:
+    """A simulate_tick result as one-timestamp frames in the *_live.csv schemas."""
+    return timeline_frames(tbl, pd.DatetimeIndex([now]), {k: np.asarray(v)[None] for k, v in sim.items()})
+
 def run_live(out_dir: str = "outputs/live", floors_json: str = "data/floors.json",
              tick_seconds: int = 3,
              seed: int = 1337,
              ambient_kw_per_m2: float = 0.02,
              per_person_watts: float = 120.0,
              hvac_kw_per_degC_per_m2: float = 0.01,
-             setpoint_cool_c: float = 24.0):
+             setpoint_cool_c: float = 24.0,
+             store: str = "csv",
+             history_ticks: Optional[int] = None,
+             bus_path: Optional[str] = None,
+             csv_snapshots: bool = True):
     """
     Live loop producing stable snapshot CSVs, rewritten atomically each tick:
       - occupancy_live.csv
@@ -35,90 +104,56 @@ def run_live(out_dir: str = "outputs/live", floors_json: str = "data/floors.json
       - energy_building_live.csv
     Also appends to rolling history files for plots:
       - occupancy_log.csv, sensors_log.csv, energy_room_log.csv, energy_floor_log.csv, energy_building_log.csv
+    With store="columnar" the history goes to typed day-partitioned tables of the same names instead.
+    With history_ticks=N it goes to fixed-size memory-mapped ring buffers (<name>.ring, see ringbuf)
+    holding the last N ticks, so disk use stays constant.
+    With bus_path, every tick is also published as a binary snapshot on that Unix socket
+    (see snapbus); csv_snapshots=False then skips the *_live.csv rewrites entirely.
     """
-    np.random.seed(seed)
+    rng = np.random.default_rng(seed)
     idx, floors_list = load_floors(floors_json)
+    tbl = room_table(floors_list)
+    model = RoomEnergyModel(tbl, ambient_kw_per_m2=ambient_kw_per_m2, per_person_watts=per_person_watts,
+                            hvac_kw_per_degC_per_m2=hvac_kw_per_degC_per_m2, setpoint_cool_c=setpoint_cool_c)
     os.makedirs(out_dir, exist_ok=True)
+    history = open_store(store, out_dir)
+    rings = open_history_rings(out_dir, floors_list, history_ticks) if history_ticks else None
+    bus = SnapshotPublisher(bus_path, floors_list) if bus_path else None
 
     # inertia state
-    prev_counts = {k: 0 for k in idx.keys()}
-
-    # synthetic outdoor temperature diurnal
-    def outdoor_temp(now_local_hour: float, mean=28.0, swing=6.0) -> float:
-        return mean + swing * math.sin((now_local_hour - 6) / 24 * 2 * math.pi) + np.random.normal(0, 0.4)
+    prev_counts = np.zeros(len(tbl["room_id"]))
 
     while True:
         now = datetime.now(timezone.utc)
         now_local = now.astimezone()
         hour_local = now_local.hour + now_local.minute / 60.0
 
-        occ_rows = []
-        sen_rows = []
-        energy_room_rows = []
-
-        T_out = outdoor_temp(hour_local)
-
-        for F in floors_list:
-            fid = F["floor_id"]
-            for r in F["rooms"]:
-                rid = r["room_id"]
-                cap = int(r["capacity"])
-                p = _diurnal_prob(hour_local, r.get("is_common", False))
-                draw = np.random.binomial(cap, p)
-                count = int(round(0.6 * prev_counts[(fid, rid)] + 0.4 * draw))
-                prev_counts[(fid, rid)] = count
-
-                # sensors
-                co2 = float(np.clip(np.random.normal(450 + 35*count, 40), 400, 2000))
-                daytime = 7 <= now_local.hour <= 18
-                lux = float(np.clip(np.random.normal(700 if daytime else 120, 80), 0, 1500))
-                noise = float(np.clip(35 + 3 * (max(count,0) ** 0.5) + np.random.normal(0, 2), 30, 85))
-                motion = int(count > 0)
-                door = int(np.random.rand() < (0.1 if count > 0 else 0.02))
-                rh = float(np.clip(np.random.normal(50, 6), 30, 70))
-
-                occ_rows.append({"timestamp": now.isoformat(), "floor_id": fid, "room_id": rid, "count": count})
-                sen_rows.append({"timestamp": now.isoformat(), "floor_id": fid, "room_id": rid,
-                                 "co2": co2, "lux": lux, "noise": noise, "motion": motion, "door": door, "rh": rh})
-
-                # per-room power model (kW)
-                area = r["area_m2"]
-                ambient_kw = ambient_kw_per_m2 * area
-                ppl_kw = (per_person_watts * count) / 1000.0
-                cooling_kw = max(T_out - setpoint_cool_c, 0.0) * hvac_kw_per_degC_per_m2 * area * (1.0 if count > 0 else 0.3)
-                # daylight dimming reduces lighting share when lux high and occupied
-                lighting_kw = 0.008 * area * (0.5 if (lux >= 600 and count > 0) else 1.0)
-                # door open penalty
-                door_penalty_kw = 0.1 if (door == 1 and count > 0) else 0.0
-
-                room_kw = ambient_kw + ppl_kw + cooling_kw + lighting_kw + door_penalty_kw
-                energy_room_rows.append({"timestamp": now.isoformat(), "floor_id": fid, "room_id": rid, "kw": room_kw})
-
-        # aggregate per floor and building
-        occ_df = pd.DataFrame(occ_rows)
-        sen_df = pd.DataFrame(sen_rows)
-        er_df = pd.DataFrame(energy_room_rows)
-
-        ef_df = er_df.groupby(["timestamp","floor_id"], as_index=False)["kw"].sum().rename(columns={"kw":"meter_kw"})
-        eb_df = er_df.groupby(["timestamp"], as_index=False)["kw"].sum().rename(columns={"kw":"meter_kw"})
+        sim = simulate_tick(tbl, prev_counts, hour_local, rng, model)
+        prev_counts = sim["count"]
+
+        # per-tick frames; floor and building rollups come from the energy model, not a groupby
+        frames = tick_frames(tbl, now, sim)
+        occ_df, sen_df, er_df = frames["occupancy"], frames["sensors"], frames["energy_room"]
+        ef_df, eb_df = frames["energy_floor"], frames["energy_building"]
+
+        if bus is not None:
+            bus.publish(int(pd.Timestamp(now).value), sim, sim["floor_kw"])
 
         # atomically write current snapshots
-        _safe_write_csv(occ_df, os.path.join(out_dir, "occupancy_live.csv"))
-        _safe_write_csv(sen_df, os.path.join(out_dir, "sensors_live.csv"))
-        _safe_write_csv(er_df,  os.path.join(out_dir, "energy_room_live.csv"))
-        _safe_write_csv(ef_df,  os.path.join(out_dir, "energy_floor_live.csv"))
-        _safe_write_csv(eb_df,  os.path.join(out_dir, "energy_building_live.csv"))
+        if csv_snapshots:
+            _safe_write_csv(occ_df, os.path.join(out_dir, "occupancy_live.csv"))
+            _safe_write_csv(sen_df, os.path.join(out_dir, "sensors_live.csv"))
+            _safe_write_csv(er_df,  os.path.join(out_dir, "energy_room_live.csv"))
+            _safe_write_csv(ef_df,  os.path.join(out_dir, "energy_floor_live.csv"))
+            _safe_write_csv(eb_df,  os.path.join(out_dir, "energy_building_live.csv"))
 
         # append to logs
-        def append(df, path):
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            mode = "a" if os.path.exists(path) else "w"
-            header = not os.path.exists(path)
-            df.to_csv(path, mode=mode, header=header, index=False)
-        append(occ_df, os.path.join(out_dir, "occupancy_log.csv"))
-        append(sen_df, os.path.join(out_dir, "sensors_log.csv"))
-        append(er_df,  os.path.join(out_dir, "energy_room_log.csv"))
-        append(ef_df,  os.path.join(out_dir, "energy_floor_log.csv"))
-        append(eb_df,  os.path.join(out_dir, "energy_building_log.csv"))
+        logs = {"occupancy_log": occ_df, "sensors_log": sen_df, "energy_room_log": er_df,
+                "energy_floor_log": ef_df, "energy_building_log": eb_df}
+        for name, df in logs.items():
+            if rings is not None:
+                rings[name].append(_history_records(name, df, int(pd.Timestamp(now).value)))
+            else:
+                history.append(name, df)
 
         time.sleep(tick_seconds)
@@ -1,62 +1,312 @@
-from typing import Dict, List
-
-def suggest_merges_to_common(floors_list: list, counts_by_floor: Dict[str, Dict[str, int]]) -> dict:
-    all_assignments = {}
-    all_suggestions: List[dict] = []
-    saved_area = 0.0
-
-    for F in floors_list:
-        fid = F["floor_id"]
-        # zone groups
-        by_zone = {}
-        for r in F["rooms"]:
-            by_zone.setdefault(r["zone"], []).append(r)
-
-        assignments = {r["room_id"]: {"assigned": counts_by_floor.get(fid, {}).get(r["room_id"], 0),
-                                      "active": counts_by_floor.get(fid, {}).get(r["room_id"], 0) > 0}
-                       for r in F["rooms"]}
-
-        for zone, rooms in by_zone.items():
-            targets = [r for r in rooms if r.get("is_common", False)]
-            targets.sort(key=lambda x: x["capacity"])
-            sources = [r for r in rooms if not r.get("is_common", False)]
-            sources.sort(key=lambda x: counts_by_floor.get(fid, {}).get(x["room_id"], 0))
-
-            for src in sources:
-                c = counts_by_floor.get(fid, {}).get(src["room_id"], 0)
-                if c == 0:
+import time, threading
+from collections import OrderedDict
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+from .floors import load_floors, floors_hash
+
+def _greedy_zone(fid: str, zone: str, targets: List[dict], sources: List[dict], counts: Dict[str, int],
+                 assignments: Dict[str, dict]) -> List[dict]:
+    """Fill the smallest common rooms first, least-occupied sources first."""
+    suggestions = []
+    for src in sources:
+        c = counts.get(src["room_id"], 0)
+        if c == 0:
+            continue
+        remaining = c
+        moves = []
+        for tgt in targets:
+            cap = tgt["capacity"]
+            cur = assignments[tgt["room_id"]]["assigned"]
+            free = max(cap - cur, 0)
+            if free <= 0:
+                continue
+            move = min(remaining, free)
+            if move > 0:
+                assignments[tgt["room_id"]]["assigned"] = cur + move
+                remaining -= move
+                moves.append({"to": tgt["room_id"], "count": move})
+            if remaining == 0:
+                break
+        if remaining == 0:
+            assignments[src["room_id"]]["assigned"] = 0
+            assignments[src["room_id"]]["active"] = False
+            suggestions.append({"floor_id": fid, "action": "merge_to_common", "from": src["room_id"],
+                                "moves": moves, "zone": zone})
+    return suggestions
+
+def _knapsack(weights: np.ndarray, values: np.ndarray, capacity: int, deadline: Optional[float]) -> Optional[List[int]]:
+    """Indices maximizing sum(values) with sum(weights) <= capacity (0/1 DP); None past the deadline."""
+    best = np.zeros(capacity + 1)
+    take = np.zeros((len(weights), capacity + 1), dtype=bool)
+    for i, (w, v) in enumerate(zip(weights.tolist(), values.tolist())):
+        if deadline is not None and time.perf_counter() > deadline:
+            return None
+        if w > capacity:
+            continue
+        cand = best[:capacity + 1 - w] + v
+        better = cand > best[w:]
+        take[i, w:] = better
+        best[w:] = np.where(better, cand, best[w:])
+    chosen, j = [], capacity
+    for i in range(len(weights) - 1, -1, -1):
+        if take[i, j]:
+            chosen.append(i)
+            j -= int(weights[i])
+    return chosen[::-1]
+
+def _optimal_zone(fid: str, zone: str, targets: List[dict], sources: List[dict], counts: Dict[str, int],
+                  assignments: Dict[str, dict], deadline: Optional[float]) -> Optional[List[dict]]:
+    """
+    Deactivates the set of occupied sources with the largest total area whose headcount fits the zone's
+    free common capacity (people may split across common rooms, so only the total matters).
+    None when the time budget ran out; assignments are untouched in that case.
+    """
+    occupied = [s for s in sources if counts.get(s["room_id"], 0) > 0]
+    free = {t["room_id"]: max(t["capacity"] - assignments[t["room_id"]]["assigned"], 0) for t in targets}
+    weights = np.array([counts[s["room_id"]] for s in occupied], dtype=np.int64)
+    capacity = int(min(sum(free.values()), weights.sum()))
+    chosen = _knapsack(weights, np.array([s["area_m2"] for s in occupied], dtype=float), capacity, deadline)
+    if chosen is None:
+        return None
+    suggestions = []
+    for i in sorted(chosen, key=lambda i: weights[i]):
+        src, remaining, moves = occupied[i], int(weights[i]), []
+        for tgt in targets:
+            move = min(remaining, free[tgt["room_id"]])
+            if move > 0:
+                free[tgt["room_id"]] -= move
+                assignments[tgt["room_id"]]["assigned"] += move
+                remaining -= move
+                moves.append({"to": tgt["room_id"], "count": move})
+            if remaining == 0:
+                break
+        assignments[src["room_id"]]["assigned"] = 0
+        assignments[src["room_id"]]["active"] = False
+        suggestions.append({"floor_id": fid, "action": "merge_to_common", "from": src["room_id"],
+                            "moves": moves, "zone": zone})
+    return suggestions
+
+def _plan_zone(fid: str, zone: str, rooms: List[dict], targets: List[dict], counts: Dict[str, int],
+               solver: str = "greedy", deadline: Optional[float] = None):
+    """
+    One zone's share of the plan: (assignments for its rooms in room order, suggestions, saved area,
+    solver used). `targets` are the zone's common rooms sorted by capacity.
+    """
+    assignments = {r["room_id"]: {"assigned": counts.get(r["room_id"], 0), "active": counts.get(r["room_id"], 0) > 0}
+                   for r in rooms}
+    sources = [r for r in rooms if not r.get("is_common", False)]
+    sources.sort(key=lambda x: counts.get(x["room_id"], 0))
+    suggestions, used = None, "greedy"
+    if solver == "optimal":
+        suggestions = _optimal_zone(fid, zone, targets, sources, counts, assignments, deadline)
+        used = "optimal" if suggestions is not None else "greedy_fallback"
+    if suggestions is None:
+        suggestions = _greedy_zone(fid, zone, targets, sources, counts, assignments)
+    saved = 0.0
+    for r in rooms:
+        if counts.get(r["room_id"], 0) > 0 and assignments[r["room_id"]]["active"] is False:
+            saved += r["area_m2"]
+    return assignments, suggestions, saved, used
+
+def _rebase_zone(fid: str, zone: str, rooms: List[dict], targets: List[dict], counts: Dict[str, int], plan: tuple):
+    """
+    A zone plan made for bucketed (rounded-up) counts, restated for the actual counts: the same sources
+    are merged, in the same order, but moves and `assigned` carry the real headcounts. Every actual count
+    is at most its bucket ceiling, so the moves still fit.
+    """
+    assignments = {r["room_id"]: {"assigned": counts.get(r["room_id"], 0), "active": counts.get(r["room_id"], 0) > 0}
+                   for r in rooms}
+    suggestions = []
+    for s in plan[1]:
+        remaining, moves = counts.get(s["from"], 0), []
+        for tgt in targets:
+            move = min(remaining, max(tgt["capacity"] - assignments[tgt["room_id"]]["assigned"], 0))
+            if move > 0:
+                assignments[tgt["room_id"]]["assigned"] += move
+                remaining -= move
+                moves.append({"to": tgt["room_id"], "count": move})
+            if remaining == 0:
+                break
+        assignments[s["from"]]["assigned"] = 0
+        assignments[s["from"]]["active"] = False
+        suggestions.append({**s, "moves": moves})
+    saved = 0.0
+    for r in rooms:
+        if counts.get(r["room_id"], 0) > 0 and assignments[r["room_id"]]["active"] is False:
+            saved += r["area_m2"]
+    return assignments, suggestions, saved, plan[3]
+
+class ZonePlanCache:
+    """
+    Bounded LRU of zone plans keyed on (solver, floor, zone, room counts). With `buckets` (ascending
+    upper edges, e.g. [0, 2, 5, 10, 20]) counts are rounded up to the next edge before planning, so nearby
+    occupancy patterns share a plan; such plans are conservative (the merges are chosen for the bucket
+    ceiling's headcount) rather than exact, and MergePlanner restates them for the actual counts. Empty
+    rooms stay 0 whatever the edges, and counts above the last edge stay exact. `validate` clears everything when the
+    floors.json content hash differs from the one the cached plans were built for. Safe to share
+    between threads (e.g. dashboard sessions); cached plans are only read, never modified.
+    """
+
+    def __init__(self, maxsize: int = 4096, buckets: Optional[Sequence[int]] = None):
+        self.maxsize = maxsize
+        self.buckets = np.asarray(sorted(buckets), dtype=np.int64) if buckets else None
+        self.floors_hash = None
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def quantize(self, counts: Sequence[int]) -> tuple:
+        if self.buckets is None:
+            return tuple(counts)
+        c = np.asarray(counts, dtype=np.int64)
+        i = np.searchsorted(self.buckets, c)
+        q = np.where(i < len(self.buckets), self.buckets[np.minimum(i, len(self.buckets) - 1)], c)
+        return tuple(np.where(c > 0, q, c).tolist())   # a vacant room never becomes occupied
+
+    def validate(self, floors_hash: Optional[str]):
+        with self._lock:
+            if floors_hash != self.floors_hash:
+                if self._plans:
+                    self.invalidations += 1
+                self._plans.clear()
+                self.floors_hash = floors_hash
+
+    def get(self, key):
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is None:
+                self.misses += 1
+                return None
+            self._plans.move_to_end(key)
+            self.hits += 1
+            return plan
+
+    def put(self, key, plan):
+        with self._lock:
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            looked_up = self.hits + self.misses
+            return {"size": len(self._plans), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "invalidations": self.invalidations,
+                    "hit_ratio": self.hits / looked_up if looked_up else 0.0}
+
+class MergePlanner:
+    """
+    Stateful merge planning: the zone index (rooms, capacity-sorted common rooms) is built once from
+    the floors list, and each call re-plans only the zones whose room counts changed. Output is the same
+    as suggest_merges_to_common on the same counts; saved_area_m2 is summed from per-zone partials in
+    a fixed order so it matches bit for bit. `recomputed` holds the zones re-planned by the last call.
+    With a ZonePlanCache, changed zones are looked up there before being planned; pass the floors.json
+    content hash (from_json does) so the cache drops plans built for a different building.
+    """
+
+    def __init__(self, floors_list: list, solver: str = "greedy", time_budget_s: Optional[float] = 0.5,
+                 cache: Optional[ZonePlanCache] = None, floors_hash: Optional[str] = None):
+        if solver not in ("greedy", "optimal"):
+            raise ValueError(f"unknown solver: {solver}")
+        self.solver = solver
+        self.time_budget_s = time_budget_s
+        self.cache = cache
+        self.floors_hash = floors_hash
+        if cache is not None:
+            cache.validate(floors_hash)
+        self.floor_rooms = {F["floor_id"]: [r["room_id"] for r in F["rooms"]] for F in floors_list}
+        self.zones = []
+        self.zone_of = {}
+        for F in floors_list:
+            by_zone = {}
+            for r in F["rooms"]:
+                by_zone.setdefault(r["zone"], []).append(r)
+            for zone, rooms in by_zone.items():
+                for r in rooms:
+                    self.zone_of[(F["floor_id"], r["room_id"])] = len(self.zones)
+                self.zones.append({"floor_id": F["floor_id"], "zone": zone, "rooms": rooms,
+                                   "targets": sorted((r for r in rooms if r.get("is_common", False)),
+                                                     key=lambda x: x["capacity"])})
+        self.counts = {fid: {} for fid in self.floor_rooms}
+        self._plans = [None] * len(self.zones)
+        self._dirty = set(range(len(self.zones)))
+        self.recomputed = 0
+
+    @classmethod
+    def from_json(cls, floors_json: str, solver: str = "greedy", time_budget_s: Optional[float] = 0.5,
+                  cache: Optional[ZonePlanCache] = None) -> "MergePlanner":
+        return cls(load_floors(floors_json)[1], solver, time_budget_s, cache, floors_hash(floors_json))
+
+    def plan(self, counts_by_floor: Dict[str, Dict[str, int]]) -> dict:
+        """Plan for a full set of counts; zones whose counts are unchanged since the last call are reused."""
+        changes = {}
+        for fid, rids in self.floor_rooms.items():
+            new, old = counts_by_floor.get(fid, {}), self.counts[fid]
+            diff = {rid: new.get(rid, 0) for rid in rids if new.get(rid, 0) != old.get(rid, 0)}
+            if diff:
+                changes[fid] = diff
+        return self.update(changes)
+
+    def update(self, changes: Dict[str, Dict[str, int]]) -> dict:
+        """Plan after applying count changes {floor_id: {room_id: count}} to the last known counts."""
+        for fid, rooms in changes.items():
+            for rid, c in rooms.items():
+                z = self.zone_of.get((fid, rid))
+                if z is None:
                     continue
-                remaining = c
-                moves = []
-                for tgt in targets:
-                    cap = tgt["capacity"]
-                    cur = assignments[tgt["room_id"]]["assigned"]
-                    free = max(cap - cur, 0)
-                    if free <= 0:
-                        continue
-                    move = min(remaining, free)
-                    if move > 0:
-                        assignments[tgt["room_id"]]["assigned"] = cur + move
-                        remaining -= move
-                        moves.append({"to": tgt["room_id"], "count": move})
-                    if remaining == 0:
-                        break
-                if remaining == 0:
-                    assignments[src["room_id"]]["assigned"] = 0
-                    assignments[src["room_id"]]["active"] = False
-                    all_suggestions.append({
-                        "floor_id": fid,
-                        "action": "merge_to_common",
-                        "from": src["room_id"],
-                        "moves": moves,
-                        "zone": zone
-                    })
-
-        for r in F["rooms"]:
-            rid = r["room_id"]
-            if counts_by_floor.get(fid, {}).get(rid, 0) > 0 and assignments[rid]["active"] is False:
-                saved_area += r["area_m2"]
-
-        all_assignments[fid] = assignments
-
-    return {"assignments": all_assignments, "suggestions": all_suggestions, "saved_area_m2": saved_area}
+                if self.counts[fid].get(rid, 0) != c:
+                    self._dirty.add(z)
+                self.counts[fid][rid] = c
+        deadline = time.perf_counter() + self.time_budget_s if self.time_budget_s is not None else None
+        for z in sorted(self._dirty):
+            Z = self.zones[z]
+            counts = self.counts[Z["floor_id"]]
+            if self.cache is None:
+                self._plans[z] = _plan_zone(Z["floor_id"], Z["zone"], Z["rooms"], Z["targets"], counts,
+                                            self.solver, deadline)
+                continue
+            sig = self.cache.quantize([counts.get(r["room_id"], 0) for r in Z["rooms"]])
+            key = (self.solver, Z["floor_id"], Z["zone"], sig)
+            plan = self.cache.get(key)
+            if plan is None:
+                zone_counts = dict(zip((r["room_id"] for r in Z["rooms"]), sig))
+                plan = _plan_zone(Z["floor_id"], Z["zone"], Z["rooms"], Z["targets"], zone_counts,
+                                  self.solver, deadline)
+                if plan[3] != "greedy_fallback":   # timing-dependent results are not reusable
+                    self.cache.put(key, plan)
+            if self.cache.buckets is not None:
+                plan = _rebase_zone(Z["floor_id"], Z["zone"], Z["rooms"], Z["targets"], counts, plan)
+            self._plans[z] = plan
+        self.recomputed = len(self._dirty)
+        self._dirty = set()
+        return self._output()
+
+    def _output(self) -> dict:
+        zone_assign = {}
+        suggestions: List[dict] = []
+        saved_area = 0.0
+        stats = {"optimal_zones": 0, "greedy_fallbacks": 0}
+        for assignments, zone_suggestions, saved, used in self._plans:
+            zone_assign.update(assignments)
+            suggestions += zone_suggestions
+            saved_area += saved
+            if used != "greedy":
+                stats["optimal_zones" if used == "optimal" else "greedy_fallbacks"] += 1
+        # zones hold their own dicts; the returned plan gets copies so later updates don't mutate it
+        all_assignments = {fid: {rid: dict(zone_assign[rid]) for rid in rids} for fid, rids in self.floor_rooms.items()}
+        out = {"assignments": all_assignments, "suggestions": suggestions, "saved_area_m2": saved_area}
+        if self.solver == "optimal":
+            out["solver"] = stats
+        return out
+
+def suggest_merges_to_common(floors_list: list, counts_by_floor: Dict[str, Dict[str, int]],
+                             solver: str = "greedy", time_budget_s: Optional[float] = 0.5) -> dict:
+    """
+    solver="greedy" is the original fill. solver="optimal" maximizes saved_area_m2 per zone with a 0/1
+    knapsack over source headcounts; zones not solved within `time_budget_s` of the call fall back to
+    greedy, and the result gains "solver": {"optimal_zones", "greedy_fallbacks"}.
+    Long-running callers should keep a MergePlanner instead, which re-plans only changed zones.
+    """
+    return MergePlanner(floors_list, solver, time_budget_s).plan(counts_by_floor)
@@ -0,0 +1,339 @@
+import time, json, random, argparse, threading
+from collections import OrderedDict, deque
+import numpy as np
+from typing import Callable, Dict, List, Optional
+
+# paho-mqtt return codes (paho.mqtt.client.MQTT_ERR_*), repeated so the fake broker needs no paho
+MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN, MQTT_ERR_CONN_LOST = 0, 4, 7
+
+def paho_client(client_id: str = "", username: Optional[str] = None, password: Optional[str] = None):
+    """A paho-mqtt (>= 2.0) client with the callback signatures MqttPublisher expects."""
+    import paho.mqtt.client as mqtt
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, clean_session=True)
+    if username and password:
+        client.username_pw_set(username, password)
+    return client
+
+class MqttPublisher:
+    """
+    Non-blocking MQTT egress. publish() only enqueues; one background thread owns the client: it runs
+    the network loop, keeps at most `max_inflight` unacknowledged messages on the wire and reconnects
+    with exponential backoff (plus jitter) when the connection drops. Messages that were in flight
+    when it dropped are queued again.
+
+    The outbound queue is keyed by topic (one topic per device), so while it is backed up a newer
+    command replaces the pending one for that device in place ("coalesced"); when `max_queue`
+    topics are pending, the oldest is dropped. metrics() reports delivery counts, queue depth,
+    in-flight messages, reconnects and publish -> ack latency.
+
+    `client_factory()` returns a paho-style client (connect/reconnect/loop/publish/disconnect and the
+    on_connect/on_disconnect/on_publish callbacks): paho_client by default, FakeBroker.client in tests.
+    """
+
+    def __init__(self, host: str, port: int = 1883, qos: int = 1, max_queue: int = 10000, max_inflight: int = 100,
+                 keepalive: int = 30, backoff_s: tuple = (0.5, 30.0), loop_s: float = 0.01,
+                 client_factory: Optional[Callable] = None):
+        self.host, self.port, self.qos, self.keepalive = host, port, qos, keepalive
+        self.max_queue, self.max_inflight = max_queue, max_inflight
+        self.backoff_min, self.backoff_max = backoff_s
+        self.loop_s = loop_s
+        self.client = (client_factory or paho_client)()
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+        self._queue: "OrderedDict[str, tuple]" = OrderedDict()   # topic -> (payload, enqueued at)
+        self._inflight: Dict[int, tuple] = {}                      # mid -> (topic, payload, enqueued at)
+        self._lock = threading.Lock()
+        self._connected = False
+        self._ever_connected = False
+        self._backoff = self.backoff_min
+        self._next_attempt = 0.0
+        self._closed = False
+        self._latency = deque(maxlen=2048)
+        self.counters = {"enqueued": 0, "coalesced": 0, "dropped": 0, "published": 0, "delivered": 0,
+                         "requeued": 0, "connects": 0, "disconnects": 0, "connect_failures": 0}
+        self._thread = threading.Thread(target=self._run, name="mqtt-egress", daemon=True)
+        self._thread.start()
+
+    # ---------------------------------------------------------------- producer side
+    def publish(self, topic: str, payload) -> bool:
+        """Enqueues; returns False when the publisher is closed."""
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload)
+        with self._lock:
+            if self._closed: return False
+            self.counters["enqueued"] += 1
+            if topic in self._queue:
+                # keep the slot (no starvation), replace the command
+                self._queue[topic] = (payload, self._queue[topic][1])
+                self.counters["coalesced"] += 1
+            else:
+                if len(self._queue) >= self.max_queue:
+                    self._queue.popitem(last=False)
+                    self.counters["dropped"] += 1
+                self._queue[topic] = (payload, time.monotonic())
+        return True
+
+    def metrics(self) -> dict:
+        with self._lock:
+            out = {**self.counters, "connected": self._connected, "queued": len(self._queue),
+                   "inflight": len(self._inflight)}
+            lat = 1000 * np.asarray(self._latency) if self._latency else None
+        if lat is not None:
+            out.update(ack_p50_ms=float(np.percentile(lat, 50)), ack_p95_ms=float(np.percentile(lat, 95)))
+        return out
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Waits until everything queued has been acknowledged; False on timeout."""
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            with self._lock:
+                if not self._queue and not self._inflight: return True
+            time.sleep(0.005)
+        return False
+
+    def close(self, timeout: float = 2.0):
+        self.flush(timeout)
+        with self._lock:
+            self._closed = True
+        self._thread.join(timeout=timeout + 1)
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+    # ---------------------------------------------------------------- callbacks (network thread)
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        if getattr(reason_code, "value", reason_code) == 0:
+            with self._lock:
+                self._connected = True
+                self._backoff = self.backoff_min
+                self.counters["connects"] += 1
+        else:
+            self._failed()
+
+    def _on_disconnect(self, client, userdata, *args):
+        self._lost()
+
+    def _on_publish(self, client, userdata, mid, *args):
+        with self._lock:
+            sent = self._inflight.pop(mid, None)
+            if sent is not None:
+                self.counters["delivered"] += 1
+                self._latency.append(time.monotonic() - sent[2])
+
+    # ---------------------------------------------------------------- background thread
+    def _failed(self):
+        with self._lock:
+            self.counters["connect_failures"] += 1
+            self._schedule_retry()
+
+    def _schedule_retry(self):
+        self._next_attempt = time.monotonic() + self._backoff * random.uniform(0.8, 1.2)
+        self._backoff = min(self._backoff * 2, self.backoff_max)
+
+    def _lost(self):
+        with self._lock:
+            if not self._connected: return
+            self._connected = False
+            self.counters["disconnects"] += 1
+            # unacked messages go back to the front, unless a newer command for the topic is pending
+            for mid, (topic, payload, t) in sorted(self._inflight.items(), reverse=True):
+                if topic not in self._queue:
+                    self._queue[topic] = (payload, t)
+                    self._queue.move_to_end(topic, last=False)
+                    self.counters["requeued"] += 1
+            self._inflight.clear()
+            self._schedule_retry()
+
+    def _connect(self):
+        try:
+            if self._ever_connected:
+                self.client.reconnect()
+            else:
+                self.client.connect(self.host, self.port, self.keepalive)
+                self._ever_connected = True
+        except (OSError, ValueError):
+            self._failed()
+            return
+        with self._lock:
+            self._next_attempt = time.monotonic() + self._backoff   # CONNACK deadline
+
+    def _pump(self):
+        while True:
+            with self._lock:
+                if not self._connected or not self._queue or len(self._inflight) >= self.max_inflight: return
+                topic, (payload, t) = self._queue.popitem(last=False)
+            info = self.client.publish(topic, payload, qos=self.qos)
+            with self._lock:
+                if info.rc != MQTT_ERR_SUCCESS:
+                    if topic not in self._queue:
+                        self._queue[topic] = (payload, t)
+                        self._queue.move_to_end(topic, last=False)
+                    return
+                self.counters["published"] += 1
+                if self.qos == 0:
+                    self.counters["delivered"] += 1
+                else:
+                    self._inflight[info.mid] = (topic, payload, t)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._closed: return
+                connected, due = self._connected, time.monotonic() >= self._next_attempt
+            if not connected:
+                if due:
+                    self._connect()
+                if not self._ever_connected:
+                    time.sleep(self.loop_s)
+                    continue
+            rc = self.client.loop(timeout=self.loop_s)
+            if rc in (MQTT_ERR_CONN_LOST, MQTT_ERR_NO_CONN):
+                self._lost()
+                if not connected:
+                    time.sleep(self.loop_s)
+            self._pump()
+
+class FakeBroker:
+    """
+    In-process stand-in for an MQTT broker, for exercising MqttPublisher without a network. `client()`
+    returns paho-style clients bound to it. The broker can be taken down and brought back up with
+    down() and up(). Acks come back on the next loop() call, or only when ack() is called if
+    auto_ack=False. `messages` holds every (topic, payload) it accepted, in order.
+    """
+
+    def __init__(self, auto_ack: bool = True):
+        self.auto_ack = auto_ack
+        self.online = True
+        self.messages: List[tuple] = []
+        self.clients: List["FakeClient"] = []
+        self._lock = threading.Lock()
+
+    def client(self) -> "FakeClient":
+        c = FakeClient(self)
+        self.clients.append(c)
+        return c
+
+    def down(self):
+        self.online = False
+
+    def up(self):
+        self.online = True
+
+    def ack(self, n: Optional[int] = None):
+        for c in self.clients:
+            c._release(n)
+
+    def topics(self) -> Dict[str, str]:
+        """Last payload per topic."""
+        return {t: p for t, p in self.messages}
+
+class _Info:
+    def __init__(self, rc: int, mid: int):
+        self.rc, self.mid = rc, mid
+
+class FakeClient:
+    def __init__(self, broker: FakeBroker):
+        self.broker = broker
+        self.on_connect = self.on_disconnect = self.on_publish = None
+        self.connected = False
+        self._mid = 0
+        self._events = deque()      # callbacks to run on the next loop(), like paho's network thread
+        self._held = deque()        # mids waiting for a manual ack
+        self._lock = threading.Lock()
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def connect(self, host, port=1883, keepalive=60):
+        if not self.broker.online:
+            raise ConnectionRefusedError(f"fake broker at {host}:{port} is down")
+        self.connected = True
+        self._events.append(("connect", 0))
+        return MQTT_ERR_SUCCESS
+
+    def reconnect(self):
+        return self.connect("fake")
+
+    def disconnect(self):
+        self.connected = False
+        return MQTT_ERR_SUCCESS
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if not self.connected or not self.broker.online:
+            return _Info(MQTT_ERR_NO_CONN, 0)
+        with self._lock:
+            self._mid += 1
+            mid = self._mid
+            self.broker.messages.append((topic, payload))
+            (self._events if self.broker.auto_ack else self._held).append(("publish", mid))
+        return _Info(MQTT_ERR_SUCCESS, mid)
+
+    def _release(self, n: Optional[int]):
+        with self._lock:
+            for _ in range(len(self._held) if n is None else min(n, len(self._held))):
+                self._events.append(self._held.popleft())
+
+    def loop(self, timeout=1.0):
+        if self.connected and not self.broker.online:
+            self.connected = False
+            self._events.clear()
+            self._held.clear()
+            if self.on_disconnect:
+                self.on_disconnect(self, None, None, MQTT_ERR_CONN_LOST, None)
+            return MQTT_ERR_CONN_LOST
+        if not self.connected:
+            return MQTT_ERR_NO_CONN
+        with self._lock:
+            events, self._events = list(self._events), deque()
+        for kind, arg in events:
+            if kind == "connect" and self.on_connect:
+                self.on_connect(self, None, {}, arg, None)
+            elif kind == "publish" and self.on_publish:
+                self.on_publish(self, None, arg, 0, None)
+        if not events:
+            time.sleep(min(timeout, 0.001))
+        return MQTT_ERR_SUCCESS
+
+def main():
+    """Drives MqttPublisher against FakeBroker: a burst, a stalled broker, an outage, then recovery."""
+    ap = argparse.ArgumentParser(description="MqttPublisher against an in-process fake broker")
+    ap.add_argument("--devices", type=int, default=500)
+    ap.add_argument("--rounds", type=int, default=20)
+    ap.add_argument("--max_inflight", type=int, default=50)
+    args = ap.parse_args()
+    broker = FakeBroker()
+    pub = MqttPublisher("fake", client_factory=broker.client, max_inflight=args.max_inflight, backoff_s=(0.05, 0.5))
+    topics = [f"building/iot/F1/R{i}/hvac" for i in range(args.devices)]
+
+    def burst(tag):
+        for r in range(args.rounds):
+            for t in topics:
+                pub.publish(t, {"command": f"{tag}-{r}"})
+
+    t0 = time.perf_counter()
+    burst("burst")
+    pub.flush(10)
+    print(f"burst: {len(topics) * args.rounds} publishes in {time.perf_counter() - t0:.3f}s", pub.metrics())
+
+    broker.auto_ack = False
+    burst("stalled")
+    time.sleep(0.1)
+    print("stalled acks (in-flight capped, rest coalesced):", pub.metrics())
+    broker.auto_ack = True
+    broker.ack()
+
+    broker.down()
+    burst("outage")
+    time.sleep(0.3)
+    print("broker down:", pub.metrics())
+    broker.up()
+    ok = pub.flush(10)
+    latest = broker.topics()
+    print(f"recovered={ok}, every device got its latest command: "
+          f"{all(json.loads(latest[t])['command'] == f'outage-{args.rounds - 1}' for t in topics)}", pub.metrics())
+    pub.close()
+
+if __name__ == "__main__":
+    main()
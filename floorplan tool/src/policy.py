@@ -1,36 +1,226 @@
-from typing import Dict, Any, List
+import os, json, operator
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from .floors import room_table
+
+DEFAULT_RULES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "control_rules.json")
+_OPS = {"==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+class RuleSet:
+    """
+    Control rules compiled from a rule file (see data/control_rules.json). Each rule names a device,
+    a conjunction of [field, op, value] conditions over the per-room inputs (count, co2, lux, door,
+    active, ...), a command and payload fragments; for every room and device the matching rule with the
+    highest priority wins, and a device with no matching rule gets no command. Values may reference
+    thresholds as "$name". Conditions are deduplicated and evaluated once per call; rule matching is a
+    single (rules x conditions) @ (conditions x rooms) product, so adding rules adds no Python work.
+
+    Commands come out as columnar codes {room, device, command, flags}: devices and commands index
+    `devices`/`commands`, and bit i of flags selects payload fragment i (up to 64 fragments; the
+    flags dtype widens from uint8 as needed).
+
+    The optional "hysteresis" ({threshold: band}) and "dwell" ({device: {min_on_s, min_off_s}}) sections
+    are only used by CommandStabilizer; evaluate() is stateless.
+    """
+
+    def __init__(self, spec: dict, thresholds: Optional[Dict[str, float]] = None):
+        self.devices = tuple(spec["devices"])
+        self.commands = tuple(spec["commands"])
+        self.payloads = list(spec.get("payloads", {}).items())
+        if len(self.payloads) > 64:
+            raise ValueError(f"at most 64 payload fragments are supported, got {len(self.payloads)}")
+        # narrowest unsigned type with one bit per fragment
+        self.flags_dtype = next(np.dtype(t) for t in (np.uint8, np.uint16, np.uint32, np.uint64)
+                                if np.dtype(t).itemsize * 8 >= len(self.payloads))
+        self.thresholds = {**spec.get("thresholds", {}), **(thresholds or {})}
+        bit = {name: 1 << i for i, (name, _) in enumerate(self.payloads)}
+        rules = sorted(spec["rules"], key=lambda r: -r.get("priority", 0))   # stable: file order breaks ties
+        self.names = [r.get("name", f"rule{i}") for i, r in enumerate(rules)]
+        bands = spec.get("hysteresis", {})
+        conds, release = {}, {}
+        rows = []
+        for r in rules:
+            idx = []
+            for field, op, value in r.get("when", []):
+                if op not in _OPS:
+                    raise ValueError(f"rule {r.get('name')}: unknown operator {op}")
+                band = 0.0
+                if isinstance(value, str) and value.startswith("$"):
+                    band = float(bands.get(value[1:], 0.0))
+                    value = self.thresholds[value[1:]]
+                key = (field, op, value)
+                idx.append(conds.setdefault(key, len(conds)))
+                # a latched condition only turns false once the input is `band` past the threshold
+                release[key] = value - band if op in (">", ">=") else value + band if op in ("<", "<=") else value
+            rows.append(idx)
+        self.conditions = list(conds)
+        self.release = [release[k] for k in self.conditions]
+        self.dwell = spec.get("dwell", {})
+        self.match = np.zeros((len(rules), max(len(conds), 1)), dtype=np.float32)
+        for i, idx in enumerate(rows):
+            self.match[i, idx] = 1
+        self.need = self.match.sum(axis=1)   # float32 so the match product runs on BLAS; counts stay exact
+        self.rule_device = np.array([self.devices.index(r["device"]) for r in rules], dtype=np.int8)
+        self.rule_command = np.array([self.commands.index(r["command"]) for r in rules], dtype=np.int8)
+        self.rule_flags = np.array([sum(bit[p] for p in r.get("payload", [])) for r in rules], dtype=self.flags_dtype)
+        self._by_device = [np.flatnonzero(self.rule_device == d) for d in range(len(self.devices))]
+
+    def condition_values(self, inputs: Dict[str, np.ndarray], latch: Optional[np.ndarray] = None) -> np.ndarray:
+        """(conditions x rooms) truth table; with `latch` (the previous table) thresholds get their hysteresis band."""
+        R = len(np.asarray(next(iter(inputs.values()))))
+        cond = np.zeros((self.match.shape[1], R), dtype=np.float32)
+        for k, (field, op, value) in enumerate(self.conditions):
+            x = np.asarray(inputs[field])
+            cond[k] = _OPS[op](x, value)
+            if latch is not None and self.release[k] != value:
+                cond[k] = np.where(latch[k] > 0, _OPS[op](x, self.release[k]), cond[k])
+        return cond
+
+    def decide(self, cond: np.ndarray):
+        """(rooms x devices) command and flag matrices for a condition table; -1 = no command."""
+        R = cond.shape[1]
+        matched = (self.match @ cond) == self.need[:, None]
+        cmd = np.full((R, len(self.devices)), -1, dtype=np.int8)
+        flags = np.zeros((R, len(self.devices)), dtype=self.flags_dtype)
+        for d, rows in enumerate(self._by_device):
+            if not len(rows): continue
+            m = matched[rows]
+            first = rows[m.argmax(axis=0)]   # rules are in priority order
+            hit = m.any(axis=0)
+            cmd[:, d] = np.where(hit, self.rule_command[first], -1)
+            flags[:, d] = np.where(hit, self.rule_flags[first], 0)
+        return cmd, flags
+
+    @staticmethod
+    def codes(cmd: np.ndarray, flags: np.ndarray) -> Dict[str, np.ndarray]:
+        valid = cmd >= 0
+        room, device = np.nonzero(valid)
+        return {"room": room.astype(np.int32), "device": device.astype(np.int8),
+                "command": cmd[valid], "flags": flags[valid]}
+
+    def evaluate(self, **inputs) -> Dict[str, np.ndarray]:
+        """Columnar command codes for aligned per-room input arrays, room-major in device order."""
+        return self.codes(*self.decide(self.condition_values(inputs)))
+
+    def payload(self, flags: int) -> dict:
+        out = {}
+        for i, (_, frag) in enumerate(self.payloads):
+            if flags & (1 << i):
+                out.update(frag)
+        return out
+
+class CommandStabilizer:
+    """
+    Per-room, per-device command state kept across ticks, in (rooms x devices) arrays:
+      hysteresis  threshold conditions (lux >= $dim_lux, co2 >= $vent_co2, ...) latch on at the threshold
+                  and release only `band` past it, so readings hovering at the threshold don't toggle
+      dwell       a device that was switched on stays on for min_on_s, one switched off stays off for
+                  min_off_s; switching between non-off commands is not delayed
+    `stats` counts emitted transitions, changes the hysteresis band absorbed, and (room, device) ticks on
+    which dwell held a wanted change back.
+    """
+
+    def __init__(self, rules: RuleSet, n_rooms: int):
+        self.rules = rules
+        D = len(rules.devices)
+        self.min_on = np.array([rules.dwell.get(d, {}).get("min_on_s", 0.0) for d in rules.devices], dtype=float)
+        self.min_off = np.array([rules.dwell.get(d, {}).get("min_off_s", 0.0) for d in rules.devices], dtype=float)
+        self.off = rules.commands.index("off") if "off" in rules.commands else -2
+        self.latch = None
+        self.cmd = np.full((n_rooms, D), -1, dtype=np.int8)
+        self.flags = np.zeros((n_rooms, D), dtype=rules.flags_dtype)
+        self.changed_at = np.full((n_rooms, D), -np.inf)
+        self.transitions = self.suppressed_hysteresis = self.suppressed_dwell = 0
+
+    def step(self, now: float, **inputs) -> Dict[str, np.ndarray]:
+        """Codes for this tick at time `now` (seconds), after hysteresis and dwell."""
+        return self.rules.codes(*self.update(now, **inputs))
+
+    def update(self, now: float, **inputs) -> Tuple[np.ndarray, np.ndarray]:
+        """step() as (rooms x devices) command and flag matrices (-1 = no command)."""
+        cond = self.rules.condition_values(inputs, self.latch)
+        want_cmd, want_flags = self.rules.decide(cond)
+        if self.latch is not None:
+            raw_cmd, raw_flags = self.rules.decide(self.rules.condition_values(inputs))
+            held = (raw_cmd != want_cmd) | (raw_flags != want_flags)
+            self.suppressed_hysteresis += int((held & (want_cmd == self.cmd) & (want_flags == self.flags)).sum())
+        self.latch = cond
+
+        change = (want_cmd != self.cmd) | (want_flags != self.flags)
+        elapsed = now - self.changed_at
+        was_on = (self.cmd >= 0) & (self.cmd != self.off)
+        blocked = change & ((was_on & (want_cmd == self.off) & (elapsed < self.min_on)) |
+                            ((self.cmd == self.off) & (want_cmd != self.off) & (elapsed < self.min_off)))
+        apply = change & ~blocked
+        self.cmd = np.where(apply, want_cmd, self.cmd)
+        self.flags = np.where(apply, want_flags, self.flags)
+        self.changed_at = np.where(apply, now, self.changed_at)
+        self.transitions += int(apply.sum())
+        self.suppressed_dwell += int(blocked.sum())
+        return self.cmd, self.flags
+
+    def stats(self) -> dict:
+        return {"transitions": self.transitions, "suppressed_hysteresis": self.suppressed_hysteresis,
+                "suppressed_dwell": self.suppressed_dwell}
+
+def load_rules(path: str = DEFAULT_RULES, thresholds: Optional[Dict[str, float]] = None) -> RuleSet:
+    """Compiles a JSON rule file (or YAML, when PyYAML is installed) with optional threshold overrides."""
+    with open(path, "r") as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    return RuleSet(spec, thresholds)
+
+_default = None
+
+def default_rules() -> RuleSet:
+    global _default
+    if _default is None:
+        _default = load_rules()
+    return _default
+
+def derive_command_codes(counts: np.ndarray, co2: np.ndarray, lux: np.ndarray, door: np.ndarray,
+                         active: np.ndarray, rules: Optional[RuleSet] = None) -> Dict[str, np.ndarray]:
+    """Control rules over aligned per-room arrays; columnar codes {room, device, command, flags}."""
+    return (rules or default_rules()).evaluate(count=np.asarray(counts), co2=np.asarray(co2), lux=np.asarray(lux),
+                                               door=np.asarray(door), active=np.asarray(active, dtype=bool))
+
+def policy_inputs(tbl: dict,
+                  counts: Dict[str, Dict[str, int]],
+                  assignments: Dict[str, Dict[str, dict]],
+                  sensors: Dict[str, Dict[str, dict]]) -> Dict[str, np.ndarray]:
+    """Nested per-floor dicts -> arrays aligned with `tbl` (floors.room_table), with the policy defaults."""
+    sensors = sensors or {}
+    keys = list(zip(tbl["floor_id"], tbl["room_id"]))
+    sens = [sensors.get(f, {}).get(r, {}) for f, r in keys]
+    return {
+        "counts": np.array([counts.get(f, {}).get(r, 0) for f, r in keys], dtype=np.int64),
+        "co2": np.array([s.get("co2", 450.0) for s in sens], dtype=float),
+        "lux": np.array([s.get("lux", 200.0) for s in sens], dtype=float),
+        "door": np.array([s.get("door", 0) for s in sens], dtype=np.int64),
+        "active": np.array([assignments.get(f, {}).get(r, {}).get("active", True) is not False for f, r in keys]),
+    }
+
+def materialize_commands(tbl: dict, codes: Dict[str, np.ndarray], rules: Optional[RuleSet] = None) -> List[dict]:
+    """Command dicts for egress (IoT, dashboard tables) from columnar codes."""
+    rules = rules or default_rules()
+    fids = tbl["floor_id"][codes["room"]].tolist()
+    rids = tbl["room_id"][codes["room"]].tolist()
+    # payloads depend only on the flags; each row gets its own copy
+    payloads = {int(fl): rules.payload(int(fl)) for fl in np.unique(codes["flags"])}
+    out = [{"floor_id": f, "room_id": r, "device": rules.devices[d], "command": rules.commands[c],
+            "payload": dict(payloads[fl])}
+           for f, r, d, c, fl in zip(fids, rids, codes["device"].tolist(), codes["command"].tolist(),
+                                     codes["flags"].tolist())]
+    return out
 
 def derive_commands(floors_list: list,
                     counts: Dict[str,Dict[str,int]],
                     assignments: Dict[str,Dict[str,dict]],
-                    sensors: Dict[str,Dict[str,dict]]) -> List[dict]:
-    cmds = []
-    for F in floors_list:
-        fid = F["floor_id"]
-        for r in F["rooms"]:
-            rid = r["room_id"]
-            c = counts.get(fid, {}).get(rid, 0)
-            sens = sensors.get(fid, {}).get(rid, {}) if sensors else {}
-            inactive = (assignments.get(fid, {}).get(rid, {}).get("active", True) is False)
-            co2 = sens.get("co2", 450.0); lux = sens.get("lux", 200.0); door = sens.get("door", 0)
-
-            if c == 0:
-                cmds += [
-                    {"floor_id": fid, "room_id": rid, "device":"lights","command":"off","payload":{"reason":"vacant"}},
-                    {"floor_id": fid, "room_id": rid, "device":"fan","command":"off","payload":{"reason":"vacant"}},
-                    {"floor_id": fid, "room_id": rid, "device":"hvac","command":"off","payload":{"reason":"vacant"}}
-                ]
-            else:
-                light_payload = {"level":"dim"} if lux >= 600 else {}
-                cmds.append({"floor_id": fid,"room_id": rid,"device":"lights","command":"on","payload":light_payload})
-                cmds.append({"floor_id": fid,"room_id": rid,"device":"fan","command":"on","payload":{}})
-                if door == 1:
-                    cmds.append({"floor_id": fid,"room_id": rid,"device":"hvac","command":"eco","payload":{"warning":"door_open"}})
-                    cmds.append({"floor_id": fid,"room_id": rid,"device":"advice","command":"note","payload":{"msg":"Close door to maintain efficiency"}})
-                else:
-                    if inactive:
-                        cmds.append({"floor_id": fid,"room_id": rid,"device":"hvac","command":"eco","payload":{"note":"merge-suggested"}})
-                    else:
-                        payload = {"vent_boost": True} if co2 >= 1200 else {}
-                        cmds.append({"floor_id": fid,"room_id": rid,"device":"hvac","command":"comfort","payload":payload})
-    return cmds
+                    sensors: Dict[str,Dict[str,dict]],
+                    rules: Optional[RuleSet] = None) -> List[dict]:
+    tbl = room_table(floors_list)
+    codes = derive_command_codes(**policy_inputs(tbl, counts, assignments, sensors), rules=rules)
+    return materialize_commands(tbl, codes, rules)
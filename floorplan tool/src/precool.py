@@ -0,0 +1,201 @@
+import time, argparse
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Sequence
+from .floors import load_floors, room_table
+from .energy_model import RoomEnergyModel
+from .synth import diurnal_prob_array
+
+class FloorThermalModel:
+    """
+    First-order (single RC node) model per floor, stepped hourly:
+      T_free = T_in + dt/C * (UA * (T_out - T_in) + gains)
+      q      = clip(C * (T_free - setpoint) / dt, 0, q_max)      thermal kW removed by the HVAC
+      T_in'  = T_free - q * dt / C,   electrical kW = q / COP(T_out)
+    UA is chosen so that holding the setpoint reproduces RoomEnergyModel's cooling kW at the nominal COP;
+    C scales with floor area. COP drops as it gets hotter outside, which is what makes pre-cooling in
+    the cooler hours pay off.
+    """
+
+    def __init__(self, model: RoomEnergyModel, capacitance_kwh_per_degC_per_m2: float = 0.12,
+                 cop_nominal: float = 3.5, cop_per_degC: float = 0.08, cop_min: float = 1.5,
+                 capacity_factor: float = 2.0, design_t_out: float = 38.0, gain_kw_per_person: float = 0.1):
+        tbl = model.tbl
+        fm = model.floor_matrix
+        self.floors = list(tbl["floors"])
+        self.model = model
+        self.cop_nominal, self.cop_per_degC, self.cop_min = cop_nominal, cop_per_degC, cop_min
+        self.ua = (model.cooling_kw_per_degC @ fm) * cop_nominal                  # (F,) kW_th per °C
+        self.c = (tbl["area_m2"] @ fm) * capacitance_kwh_per_degC_per_m2          # (F,) kWh per °C
+        self.base_kw = (model.ambient_kw + model.lighting_kw) @ fm                 # (F,) non-HVAC load
+        self.gain_kw_per_person = gain_kw_per_person
+        self.q_max = capacity_factor * self.ua * max(design_t_out - model.setpoint_cool_c, 1.0)
+
+    def cop(self, t_out: np.ndarray) -> np.ndarray:
+        return np.maximum(self.cop_nominal - self.cop_per_degC * (t_out - 25.0), self.cop_min)
+
+    def simulate(self, setpoints: np.ndarray, t_out: np.ndarray, people: np.ndarray, t0: np.ndarray, dt_h: float = 1.0):
+        """setpoints (..., F, H), t_out (H,), people (F, H), t0 (F,) -> (indoor temp, HVAC kW, total kW), each (..., F, H)."""
+        H = t_out.shape[0]
+        t_in = np.broadcast_to(t0, setpoints.shape[:-1]).astype(float)
+        temps, hvac = np.empty(setpoints.shape), np.empty(setpoints.shape)
+        cop = self.cop(t_out)
+        gains = people * self.gain_kw_per_person
+        for h in range(H):
+            t_free = t_in + dt_h / self.c * (self.ua * (t_out[h] - t_in) + gains[:, h])
+            q = np.clip(self.c * (t_free - setpoints[..., h]) / dt_h, 0.0, self.q_max)
+            t_in = t_free - q * dt_h / self.c
+            temps[..., h] = t_in
+            hvac[..., h] = q / cop[h]
+        return temps, hvac, hvac + self.base_kw[:, None] + self.model.kw_per_person * people
+
+def expected_people(tbl: dict, stamps: pd.DatetimeIndex, history: Optional[pd.DataFrame] = None) -> np.ndarray:
+    """
+    (F, H) expected headcount per floor for each forecast hour: the mean per floor and hour of day in
+    `history` (an occupancy table) when given, else the generators' diurnal profile times capacity.
+    """
+    hours = stamps.hour.to_numpy()
+    F = len(tbl["floors"])
+    if history is not None and len(history):
+        h = history.assign(hour=pd.DatetimeIndex(history["timestamp"]).hour, floor_id=history["floor_id"].astype(str))
+        per_tick = h.groupby(["timestamp", "floor_id", "hour"], observed=True)["count"].sum().reset_index()
+        prof = per_tick.groupby(["floor_id", "hour"])["count"].mean().unstack(fill_value=0.0)
+        prof = prof.reindex(index=list(tbl["floors"]), columns=range(24), fill_value=0.0).to_numpy()
+        return prof[:, hours]
+    p = diurnal_prob_array(hours.astype(float), tbl["is_common"])            # (H, R)
+    fm = np.zeros((len(tbl["room_id"]), F))
+    fm[np.arange(len(tbl["room_id"])), tbl["floor_idx"]] = 1.0
+    return ((p * tbl["capacity"]) @ fm).T
+
+def _lead_window(starts: np.ndarray, lead: int) -> np.ndarray:
+    """Hours within `lead` hours before each True in `starts` (F, H)."""
+    pre = np.zeros_like(starts)
+    for k in range(1, lead + 1):
+        pre[:, :-k] |= starts[:, k:]
+    return pre
+
+def candidate_setpoints(occupied: np.ndarray, hot: np.ndarray, occupied_sp: Sequence[float], leads: Sequence[int],
+                        depths: Sequence[float], float_sp: float, setback: float):
+    """
+    (K, F, H) setpoint schedules: `occupied_sp` while occupied and `setback` otherwise; for `lead` hours
+    before each hot occupied block (or each occupied block, when none is hot) the setpoint drops `depth`
+    below the occupied one; optionally the hot occupied hours float up to `float_sp`.
+    Returns the schedules and their (occupied_sp, lead, depth, float) parameters.
+    """
+    F, H = occupied.shape
+    target = occupied & hot if (occupied & hot).any() else occupied
+    starts = target & ~np.concatenate([np.zeros((F, 1), bool), target[:, :-1]], axis=1)
+    params, scheds = [], []
+    for sp in occupied_sp:
+        for lead in leads:
+            pre = _lead_window(starts, lead) & ~target
+            for depth in (depths if lead else [0.0]):
+                for floats in (False, True):
+                    s = np.where(occupied, sp, setback)
+                    s = np.where(pre, np.minimum(s, sp - depth), s)
+                    if floats:
+                        s = np.where(occupied & hot, max(float_sp, sp), s)
+                    scheds.append(s)
+                    params.append((sp, lead, depth, floats))
+    return np.stack(scheds).astype(float), params
+
+def schedule(forecast: pd.DataFrame, floors_list: List[dict], objective: str = "energy",
+             history: Optional[pd.DataFrame] = None, comfort=(21.0, 25.5), occupied_sp=(23.0, 24.0, 25.0),
+             leads=(0, 1, 2, 3, 4), depths=(1.0, 2.0, 3.0), setback: float = 29.0, occupied_share: float = 0.05,
+             hot_c: float = 30.0, t0: Optional[float] = None, thermal: Optional[FloorThermalModel] = None) -> Dict[str, object]:
+    """
+    Per-floor setpoint / pre-cool schedule over the forecast horizon (open_meteo.forecast_hours rows);
+    hours with t_out >= `hot_c` are the ones pre-cooling prepares for.
+    Every candidate schedule is simulated for every floor at once; per floor, the cheapest candidate
+    that keeps occupied hours inside `comfort` wins ("energy": kWh). With objective "peak" the floors'
+    picks are then revised in turn (coordinate descent) to lower the building peak kW.
+    Returns {"schedule": tidy per floor/hour table, "summary": per-floor vs baseline, "solve_s": float}.
+    """
+    t_solve = time.perf_counter()
+    tbl = room_table(floors_list)
+    thermal = thermal or FloorThermalModel(RoomEnergyModel(tbl))
+    stamps = pd.DatetimeIndex(forecast["timestamp"])
+    t_out = forecast["temp"].to_numpy(dtype=float)
+    people = expected_people(tbl, stamps, history)
+    cap = np.maximum(np.bincount(tbl["floor_idx"], weights=tbl["capacity"], minlength=len(tbl["floors"])), 1)
+    occupied = people >= occupied_share * cap[:, None]
+    hot = np.broadcast_to(t_out >= hot_c, occupied.shape)
+    sched, params = candidate_setpoints(occupied, hot, occupied_sp, leads, depths, comfort[1], setback)
+    t_start = np.full(len(tbl["floors"]), t0 if t0 is not None else occupied_sp[-1])
+    temps, hvac, total = thermal.simulate(sched, t_out, people, t_start)
+
+    lo, hi = comfort
+    violation = np.where(occupied[None], np.maximum(temps - hi, 0) + np.maximum(lo - temps, 0), 0).sum(axis=2)
+    kwh = hvac.sum(axis=2)
+    # infeasible candidates only win when nothing is feasible, and then the least uncomfortable one does
+    cost = np.where(violation > 1e-6, 1e9 + violation, kwh)
+    pick = cost.argmin(axis=0)                                                    # (F,)
+    F = len(tbl["floors"])
+    if objective == "peak":
+        for _ in range(3):
+            changed = False
+            for f in range(F):
+                others = total[pick, np.arange(F)].sum(axis=0) - total[pick[f], f]
+                peak = (others[None] + total[:, f]).max(axis=1)
+                peak = np.where(violation[:, f] > 1e-6, np.inf, peak)
+                if np.isfinite(peak).any() and peak.argmin() != pick[f] and peak.min() < peak[pick[f]] - 1e-9:
+                    pick[f], changed = peak.argmin(), True
+            if not changed: break
+    elif objective != "energy":
+        raise ValueError(f"unknown objective: {objective}")
+
+    # baseline: the model's fixed setpoint while occupied, no pre-cool, no float
+    base = params.index((min(occupied_sp, key=lambda s: abs(s - thermal.model.setpoint_cool_c)), 0, 0.0, False))
+    f_idx = np.arange(F)
+    rows = []
+    for f in f_idx:
+        k = pick[f]
+        mode = np.where(occupied[f], "occupied", np.where(sched[k, f] < setback, "precool", "setback"))
+        rows.append(pd.DataFrame({"timestamp": stamps, "floor_id": tbl["floors"][f], "t_out": t_out,
+                                  "people": people[f], "setpoint": sched[k, f], "mode": mode,
+                                  "t_in": temps[k, f], "hvac_kw": hvac[k, f], "total_kw": total[k, f]}))
+    summary = pd.DataFrame({
+        "floor_id": tbl["floors"],
+        "occupied_sp": [params[k][0] for k in pick], "precool_lead_h": [params[k][1] for k in pick],
+        "precool_depth_c": [params[k][2] for k in pick], "float_hot_hours": [params[k][3] for k in pick],
+        "hvac_kwh": kwh[pick, f_idx], "hvac_kwh_baseline": kwh[base],
+        "peak_kw": total[pick, f_idx].max(axis=1), "peak_kw_baseline": total[base].max(axis=1),
+        "comfort_violation_degC_h": violation[pick, f_idx],
+    })
+    return {"schedule": pd.concat(rows, ignore_index=True), "summary": summary,
+            "building_peak_kw": float(total[pick, f_idx].sum(axis=0).max()),
+            "building_peak_kw_baseline": float(total[base].sum(axis=0).max()),
+            "solve_s": time.perf_counter() - t_solve}
+
+def main():
+    ap = argparse.ArgumentParser(description="Forecast-driven per-floor setpoint and pre-cool schedule")
+    ap.add_argument("--floors_json", default="data/floors.json")
+    ap.add_argument("--city", default=None, help="fetch the Open-Meteo forecast for this city")
+    ap.add_argument("--weather_csv", default=None, help="offline forecast: CSV with timestamp and temp (or air_temperature)")
+    ap.add_argument("--hours", type=int, default=48)
+    ap.add_argument("--objective", choices=["energy", "peak"], default="energy")
+    ap.add_argument("--history", default=None, help="occupancy table dir (e.g. outputs/synth) for the expected occupancy profile")
+    ap.add_argument("--out", default=None, help="write the schedule CSV here")
+    args = ap.parse_args()
+    if args.city:
+        from .open_meteo import geocode_city, forecast_hours
+        lat, lon, _ = geocode_city(args.city)
+        fc = forecast_hours(lat, lon, hours=args.hours)
+    elif args.weather_csv:
+        fc = pd.read_csv(args.weather_csv, parse_dates=["timestamp"]).rename(columns={"air_temperature": "temp"})
+        fc = fc.set_index("timestamp")["temp"].resample("1h").mean().reset_index().iloc[:args.hours]
+    else:
+        raise SystemExit("give --city or --weather_csv")
+    history = None
+    if args.history:
+        from .storage import read_table
+        history = read_table(args.history, "occupancy")
+    res = schedule(fc, load_floors(args.floors_json)[1], args.objective, history)
+    print(res["summary"].to_string(index=False, float_format="%.2f"))
+    print(f"building peak {res['building_peak_kw']:.1f} kW (baseline {res['building_peak_kw_baseline']:.1f}); "
+          f"solved in {1000 * res['solve_s']:.1f} ms")
+    if args.out:
+        res["schedule"].to_csv(args.out, index=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import os, time, argparse
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterator, Optional
+from .floors import load_floors, room_table
+from .storage import detect_store, _to_ns
+from .energy_model import RoomEnergyModel
+from .snapbus import SnapshotPublisher
+from .livebus import tick_frames, _safe_write_csv
+
+SENSOR_FIELDS = ("co2", "lux", "noise", "motion", "door", "rh")
+
+def _room_matrix(df: pd.DataFrame, value: str, stamps: pd.DatetimeIndex, keys: pd.MultiIndex) -> np.ndarray:
+    """(timestamp x room) matrix of `value` in room_table order; rooms missing from a tick are 0."""
+    out = np.zeros((len(stamps), len(keys)))
+    ti = stamps.get_indexer(df["timestamp"])
+    ri = keys.get_indexer(pd.MultiIndex.from_arrays([df["floor_id"].astype(str), df["room_id"].astype(str)]))
+    ok = (ti >= 0) & (ri >= 0)
+    out[ti[ok], ri[ok]] = df[value].to_numpy(dtype=float)[ok]
+    return out
+
+class _TableSource:
+    """
+    Time-range reads of one table. A columnar store reads only the partitions and rows in range; a
+    CSV table has no index to seek in, so it is parsed once here and each range is a slice of that.
+    """
+
+    def __init__(self, root: str, table: str):
+        self.store, self.table = detect_store(root, table), table
+        self._df = self._ts = None
+        if self.store.kind == "csv":
+            df = self.store.read(table)
+            if df is not None and len(df):
+                self._df = df.sort_values("timestamp", kind="stable").reset_index(drop=True)
+                self._ts = self._df["timestamp"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+    def time_bounds(self):
+        if self.store.kind != "csv":
+            return self.store.time_bounds(self.table)
+        if self._df is None: return None
+        return pd.Timestamp(int(self._ts[0]), tz="UTC"), pd.Timestamp(int(self._ts[-1]), tz="UTC")
+
+    def read(self, start, end) -> Optional[pd.DataFrame]:
+        if self.store.kind != "csv":
+            return self.store.read(self.table, start=start, end=end)
+        if self._df is None: return None
+        i, j = np.searchsorted(self._ts, [_to_ns(start), _to_ns(end)])
+        return self._df.iloc[i:j]
+
+def iter_ticks(dataset_dir: str, tbl: dict, suffix: str = "", start=None, end=None,
+               chunk: pd.Timedelta = pd.Timedelta(days=1)) -> Iterator[tuple]:
+    """
+    Yields (timestamp, arrays) per recorded tick of a synth dataset (suffix "") or live logs
+    (suffix "_log"), one time chunk at a time. Columnar tables read only each chunk's rows; CSV
+    tables are parsed once per call and sliced by chunk (see _TableSource).
+    """
+    occ_src = _TableSource(dataset_dir, "occupancy" + suffix)
+    bounds = occ_src.time_bounds()
+    if bounds is None: return
+    sen_src = _TableSource(dataset_dir, "sensors" + suffix)
+    er_src = _TableSource(dataset_dir, "energy_room" + suffix)
+    lo = pd.Timestamp(start, tz="UTC") if start else bounds[0]
+    hi = pd.Timestamp(end, tz="UTC") if end else bounds[1] + pd.Timedelta(1, "ns")
+    keys = pd.MultiIndex.from_arrays([tbl["floor_id"].astype(str), tbl["room_id"].astype(str)])
+    t = lo
+    while t < hi:
+        t_end = min(t + chunk, hi)
+        occ = occ_src.read(t, t_end)
+        sen = sen_src.read(t, t_end)
+        er = er_src.read(t, t_end)
+        t = t_end
+        if occ is None or not len(occ): continue
+        stamps = pd.DatetimeIndex(np.unique(occ["timestamp"]))
+        if stamps.tz is None:
+            stamps = stamps.tz_localize("UTC")
+        mats = {"count": _room_matrix(occ, "count", stamps, keys).astype(np.int64)}
+        for c in SENSOR_FIELDS:
+            mats[c] = _room_matrix(sen, c, stamps, keys) if sen is not None and len(sen) else np.zeros_like(mats["count"], dtype=float)
+        mats["kw"] = _room_matrix(er, "kw", stamps, keys) if er is not None and len(er) else np.zeros_like(mats["count"], dtype=float)
+        for i, ts in enumerate(stamps):
+            yield ts, {k: v[i] for k, v in mats.items()}
+
+def replay(dataset_dir: str, floors_json: str = "data/floors.json", speedup: Optional[float] = 100.0,
+           bus_path: Optional[str] = None, csv_out: Optional[str] = None, suffix: str = "",
+           start=None, end=None, report_every: float = 5.0) -> Dict[str, float]:
+    """
+    Streams a recorded dataset through the live snapshot interface (bus and/or *_live.csv) with the
+    dataset clock running `speedup` times faster than real time, or as fast as possible when None.
+    Every `report_every` seconds prints the achieved tick rate and each acking bus consumer's lag
+    against the replay clock (see SnapshotPublisher.consumer_stats).
+    """
+    _, floors_list = load_floors(floors_json)
+    tbl = room_table(floors_list)
+    model = RoomEnergyModel(tbl)
+    bus = SnapshotPublisher(bus_path, floors_list) if bus_path else None
+    t0_data = t0_wall = None
+    ticks, last_report, last_ticks = 0, time.monotonic(), 0
+    try:
+        for ts, arrays in iter_ticks(dataset_dir, tbl, suffix, start, end):
+            if t0_data is None:
+                t0_data, t0_wall = ts, time.monotonic()
+            if speedup:
+                wait = t0_wall + (ts - t0_data).total_seconds() / speedup - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+            floor_kw, building_kw = model.rollup(arrays["kw"])
+            sim = {**arrays, "floor_kw": floor_kw, "building_kw": building_kw}
+            if bus is not None:
+                bus.publish(int(ts.value), sim, floor_kw)
+            if csv_out:
+                frames = tick_frames(tbl, ts, sim)
+                for name in ("occupancy", "sensors", "energy_room", "energy_floor", "energy_building"):
+                    _safe_write_csv(frames[name], os.path.join(csv_out, f"{name}_live.csv"))
+            ticks += 1
+            now = time.monotonic()
+            if now - last_report >= report_every:
+                rate = (ticks - last_ticks) / (now - last_report)
+                print(f"[replay] {ts.isoformat()} ticks={ticks} rate={rate:.1f}/s")
+                for c in (bus.consumer_stats() if bus else []):
+                    print(f"[replay]   {c['name']}: seq_lag={c['seq_lag']} data_lag_s={c['data_lag_s']} "
+                          f"ack_latency_s={c['ack_latency_s']}")
+                last_report, last_ticks = now, ticks
+    finally:
+        if bus is not None:
+            bus.close()
+    elapsed = time.monotonic() - t0_wall if t0_wall is not None else 0.0
+    return {"ticks": ticks, "elapsed_s": elapsed, "ticks_per_s": ticks / elapsed if elapsed else 0.0}
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay a recorded dataset through the live snapshot interface")
+    ap.add_argument("--dataset", default="outputs/synth")
+    ap.add_argument("--floors_json", default="data/floors.json")
+    ap.add_argument("--live_logs", action="store_true", help="dataset is a live dir (*_log tables)")
+    ap.add_argument("--speedup", type=float, default=100.0, help="dataset seconds per wall second; 0 = as fast as possible")
+    ap.add_argument("--bus", default=None, help="publish on this snapshot socket")
+    ap.add_argument("--csv_out", default=None, help="also rewrite *_live.csv snapshots in this dir")
+    ap.add_argument("--start", default=None)
+    ap.add_argument("--end", default=None)
+    ap.add_argument("--report_every", type=float, default=5.0)
+    args = ap.parse_args()
+    stats = replay(args.dataset, args.floors_json, args.speedup or None, args.bus, args.csv_out,
+                   "_log" if args.live_logs else "", args.start, args.end, args.report_every)
+    print(stats)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import os, json, time, tempfile
+import numpy as np
+import pandas as pd
+from typing import Optional, Tuple
+
+MAGIC = b"RINGBUF1"
+HEADER_BYTES = 4096
+_HDR = np.dtype([("magic", "S8"), ("capacity", "<i8"), ("seq", "<u8"), ("written", "<i8"),
+                 ("inflight", "<i8"), ("meta_len", "<i8")])
+
+class TornRead(RuntimeError):
+    pass
+
+class RingBuffer:
+    """
+    Fixed-capacity history of structured records in one memory-mapped file:
+      [header: magic, capacity, seq, written, inflight, meta_len | meta JSON][capacity records]
+    `written` counts records ever appended (cursor = written % capacity). `seq` is a seqlock
+    generation: odd while a write is in progress, bumped to even when it completes. Readers copy
+    under the seqlock (last) or take zero-copy views and check them afterwards (view_last + valid).
+    One writer per file; any number of readers in other processes.
+    """
+
+    def __init__(self, path: str, writable: bool = False):
+        self.path = path
+        self._mm = np.memmap(path, dtype=np.uint8, mode="r+" if writable else "r")
+        self._hdr = np.ndarray((1,), dtype=_HDR, buffer=self._mm, offset=0)
+        if bytes(self._hdr["magic"][0]) != MAGIC:
+            raise ValueError(f"{path} is not a ring buffer")
+        meta_len = int(self._hdr["meta_len"][0])
+        info = json.loads(bytes(self._mm[_HDR.itemsize:_HDR.itemsize + meta_len]).decode())
+        self.dtype = np.dtype([tuple(f) for f in info["fields"]])
+        self.meta = info["meta"]
+        self.capacity = int(self._hdr["capacity"][0])
+        self.records = np.ndarray((self.capacity,), dtype=self.dtype, buffer=self._mm, offset=HEADER_BYTES)
+
+    @classmethod
+    def create(cls, path: str, dtype, capacity: int, meta: Optional[dict] = None) -> "RingBuffer":
+        """Opens `path` for writing, (re)creating it when missing or laid out differently."""
+        dtype = np.dtype(dtype)
+        info = json.dumps({"fields": [list(f) for f in dtype.descr], "meta": meta or {}}).encode()
+        if _HDR.itemsize + len(info) > HEADER_BYTES:
+            raise ValueError("ring buffer metadata does not fit in the header")
+        if os.path.exists(path):
+            try:
+                rb = cls(path, writable=True)
+                if rb.capacity == capacity and rb.dtype == dtype and rb.meta == (meta or {}):
+                    return rb
+            except (ValueError, KeyError):
+                pass
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        hdr = np.zeros(1, dtype=_HDR)
+        hdr["magic"] = MAGIC; hdr["capacity"] = capacity; hdr["meta_len"] = len(info)
+        # build the file aside and rename it in, so readers never map a half-initialised header
+        with tempfile.NamedTemporaryFile("wb", delete=False, dir=os.path.dirname(path) or ".", suffix=".tmp") as tmp:
+            tmp.write(hdr.tobytes() + info)
+            tmp.truncate(HEADER_BYTES + capacity * dtype.itemsize)
+            tmp_path = tmp.name
+        os.replace(tmp_path, path)
+        return cls(path, writable=True)
+
+    @property
+    def written(self) -> int:
+        return int(self._hdr["written"][0])
+
+    def append(self, recs: np.ndarray):
+        recs = np.asarray(recs, dtype=self.dtype)[-self.capacity:]
+        n = len(recs)
+        if n == 0: return
+        h, cap = self._hdr, self.capacity
+        w = int(h["written"][0])
+        h["inflight"] = n
+        h["seq"] += 1
+        i = w % cap
+        k = min(n, cap - i)
+        self.records[i:i + k] = recs[:k]
+        self.records[:n - k] = recs[k:]
+        h["written"] = w + n
+        h["seq"] += 1
+        h["inflight"] = 0
+
+    def flush(self):
+        self._mm.flush()
+
+    def _snapshot(self, n: int, retries: int):
+        for _ in range(retries):
+            seq = int(self._hdr["seq"][0])
+            if seq & 1:
+                time.sleep(0)
+                continue
+            w = int(self._hdr["written"][0])
+            n_ = min(n, w, self.capacity)
+            return seq, w - n_, n_
+        raise TornRead(f"{self.path}: writer busy")
+
+    def view_last(self, n: int, retries: int = 1000) -> Tuple[np.ndarray, tuple]:
+        """
+        Last `n` records oldest-first, as a zero-copy view when they do not wrap (a copy otherwise),
+        plus a token for `valid`. Check `valid(token)` after consuming the view: a concurrent writer
+        may have overwritten it.
+        """
+        seq, start, n_ = self._snapshot(n, retries)
+        i = start % self.capacity
+        if i + n_ <= self.capacity:
+            out = self.records[i:i + n_]
+        else:
+            out = np.concatenate((self.records[i:], self.records[:i + n_ - self.capacity]))
+        return out, (seq, start)
+
+    def valid(self, token: tuple, retries: int = 1000) -> bool:
+        """True if no write has touched the records a view_last call returned."""
+        seq, start = token
+        h = self._hdr
+        for _ in range(retries):
+            s1 = int(h["seq"][0])
+            if s1 == seq:
+                return True
+            # written/inflight only count as a pair when no write began or ended around them
+            w, inflight = int(h["written"][0]), int(h["inflight"][0])
+            if s1 & 1 or int(h["seq"][0]) != s1:
+                time.sleep(0)
+                continue
+            return w + inflight - self.capacity <= start
+        return False   # writer never idle long enough to tell: treat the view as overwritten
+
+    def last(self, n: int, retries: int = 1000) -> np.ndarray:
+        """Copy of the last `n` records, retried until it is consistent with the seqlock."""
+        for _ in range(retries):
+            view, token = self.view_last(n, retries)
+            out = np.array(view, copy=True)
+            if self.valid(token):
+                return out
+        raise TornRead(f"{self.path}: could not get a consistent read")
+
+    def last_ticks(self, n: int) -> np.ndarray:
+        return self.last(n * int(self.meta.get("records_per_tick", 1)))
+
+def to_frame(rb: RingBuffer, recs: np.ndarray) -> pd.DataFrame:
+    """Records as a DataFrame in the matching *_log.csv schema (index field mapped back to ids)."""
+    df = pd.DataFrame({"timestamp": pd.to_datetime(recs["timestamp"], unit="ns", utc=True)})
+    index_field = rb.meta.get("index_field")
+    if index_field:
+        keys = np.array(rb.meta["keys"], dtype=object).reshape(len(rb.meta["keys"]), -1)
+        for j, col in enumerate(rb.meta["index_columns"]):
+            df[col] = keys[recs[index_field], j]
+    for name in rb.dtype.names:
+        if name not in ("timestamp", index_field):
+            df[name] = recs[name]
+    return df
@@ -0,0 +1,209 @@
+import io, os, time, shutil, argparse
+import pandas as pd
+from typing import Dict, List, Optional
+from .storage import ColumnarStore, CsvStore, detect_store, write_json_atomic, read_json
+from .ringbuf import RingBuffer, to_frame
+
+RESOLUTIONS = {"1min": "1min", "15min": "15min", "1h": "1h"}
+# source table -> (metric, value column, levels it feeds)
+SOURCES = {
+    "occupancy_log": ("occupancy", "count", ["room", "floor", "building"]),
+    "energy_room_log": ("energy", "kw", ["room"]),
+    "energy_floor_log": ("energy", "meter_kw", ["floor"]),
+    "energy_building_log": ("energy", "meter_kw", ["building"]),
+}
+LEVEL_KEYS = {"room": ["floor_id", "room_id"], "floor": ["floor_id"], "building": []}
+WATERMARKS = "_watermarks.json"
+
+def tile_table(metric: str, level: str, res: str) -> str:
+    return f"{metric}_{level}_{res}"
+
+def _read_csv_tail(path: str, after_ns: Optional[int], pos: Optional[dict]):
+    """
+    Rows of an append-only CSV log past `pos` ({"ino", "offset", "header"} from the previous run), and
+    the position to resume from. Starts over from the top when the file was replaced (new inode) or
+    truncated; an unterminated last line is left for the next run. Only when starting over are rows at
+    or before `after_ns` dropped (so history is not folded twice); resuming from the offset keeps every
+    row, including the rest of a tick that was half written at the last run.
+    """
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        ino = [st.st_dev, st.st_ino]
+        restart = pos is None or pos["ino"] != ino or st.st_size < pos["offset"]
+        if restart:
+            pos = {"ino": ino, "offset": 0, "header": None}
+        f.seek(pos["offset"])
+        data = f.read(st.st_size - pos["offset"])
+    end = data.rfind(b"\n") + 1
+    data = data[:end]
+    header = pos["header"]
+    if header is None and end:
+        head, _, data = data.partition(b"\n")
+        header = head.decode().strip().split(",")
+    new_pos = {"ino": ino, "offset": pos["offset"] + end, "header": header}
+    if not data.strip():
+        return None, new_pos
+    df = pd.read_csv(io.BytesIO(data), header=None, names=header, parse_dates=["timestamp"])
+    if restart and after_ns is not None:
+        df = df[(df["timestamp"] > pd.Timestamp(after_ns, tz="UTC")).to_numpy()].reset_index(drop=True)
+    return df, new_pos
+
+def _read_new(src_dir: str, table: str, after_ns: Optional[int], pos: Optional[dict] = None):
+    """
+    (rows newer than `after_ns`, CSV read position or None). CSV logs are read from the byte offset the
+    previous run stopped at, so a run costs the new rows rather than the whole history.
+    """
+    ring = os.path.join(src_dir, f"{table}.ring")
+    start = pd.Timestamp(after_ns + 1, tz="UTC") if after_ns is not None else None
+    if os.path.exists(ring):
+        rb = RingBuffer(ring)
+        recs = rb.last(rb.capacity)
+        if after_ns is not None:
+            recs = recs[recs["timestamp"] > after_ns]
+        return to_frame(rb, recs), None
+    store = detect_store(src_dir, table)
+    if not store.exists(table): return None, None
+    if isinstance(store, CsvStore):
+        return _read_csv_tail(store.path(table), after_ns, pos)
+    return store.read(table, start=start), None
+
+def _per_tick(df: pd.DataFrame, value: str, level: str) -> pd.DataFrame:
+    """Per-tick values at `level`: rows as-is when the source is at that level, else per-tick sums over rooms."""
+    keys = LEVEL_KEYS[level]
+    if level == "room" or "room_id" not in df.columns:
+        return df[["timestamp"] + keys + [value]]
+    return df.groupby(["timestamp"] + keys, as_index=False, observed=True)[value].sum()
+
+def _aggregate(ticks: pd.DataFrame, value: str, keys: List[str], res: str) -> pd.DataFrame:
+    t = ticks.assign(timestamp=ticks["timestamp"].dt.floor(RESOLUTIONS[res]))
+    g = t.groupby(["timestamp"] + keys, as_index=False, observed=True)[value]
+    out = g.agg(sum="sum", max="max", count="count")
+    for k in keys:
+        out[k] = out[k].astype(str)
+    return out
+
+def update_rollups(src_dir: str, out_dir: str, suffix: str = "_log") -> Dict[str, int]:
+    """
+    Folds rows newer than each source's watermark into partial tiles (sum, max, count per bucket)
+    appended to the columnar store at `out_dir`. A bucket that straddles two runs gets two partial
+    tiles; query_rollup merges them. CSV sources also keep their read position (inode, byte offset)
+    in the watermarks file. Returns new rows processed per source.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    tiles = ColumnarStore(out_dir)
+    wm_path = os.path.join(out_dir, WATERMARKS)
+    marks = read_json(wm_path, {})
+    positions = marks.setdefault("csv", {})
+    processed = {}
+    for base, (metric, value, levels) in SOURCES.items():
+        table = base[:-len("_log")] + suffix
+        df, pos = _read_new(src_dir, table, marks.get(table), positions.get(table))
+        if df is None or not len(df):
+            processed[table] = 0
+            if pos is not None and pos != positions.get(table):
+                positions[table] = pos
+                write_json_atomic(marks, wm_path)
+            continue
+        for level in levels:
+            ticks = _per_tick(df, value, level)
+            for res in RESOLUTIONS:
+                _finish_compaction(out_dir, tile_table(metric, level, res))
+                tiles.append(tile_table(metric, level, res), _aggregate(ticks, value, LEVEL_KEYS[level], res))
+        marks[table] = max(int(df["timestamp"].max().value), marks.get(table) or 0)
+        if pos is not None:
+            positions[table] = pos
+        processed[table] = len(df)
+        # after the tiles: a crash in between re-folds (double counts) at most this batch
+        write_json_atomic(marks, wm_path)
+    return processed
+
+def pick_resolution(start, end) -> str:
+    span = pd.Timestamp(end) - pd.Timestamp(start)
+    if span <= pd.Timedelta(hours=6): return "1min"
+    if span <= pd.Timedelta(days=3): return "15min"
+    return "1h"
+
+def query_rollup(out_dir: str, metric: str, level: str, res: Optional[str] = None,
+                 start=None, end=None) -> Optional[pd.DataFrame]:
+    """Merged tiles (timestamp, ids, sum, mean, max, count) in [start, end); never reads raw logs."""
+    if res is None:
+        res = pick_resolution(start, end) if start is not None and end is not None else "1h"
+    df = ColumnarStore(out_dir).read(tile_table(metric, level, res), start=start, end=end)
+    if df is None or not len(df): return df
+    keys = ["timestamp"] + LEVEL_KEYS[level]
+    out = df.groupby(keys, as_index=False, observed=True).agg(sum=("sum", "sum"), max=("max", "max"),
+                                                            count=("count", "sum"))
+    out["mean"] = out["sum"] / out["count"]
+    return out.sort_values(keys).reset_index(drop=True)
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _fsync_tree(root: str):
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            with open(os.path.join(dirpath, name), "rb") as f:
+                os.fsync(f.fileno())
+        _fsync_dir(dirpath)
+
+def _finish_compaction(out_dir: str, name: str):
+    """
+    Completes or discards an interrupted swap of `name`: .<name>.compact is the new copy (complete once
+    it holds _complete), .<name>.old the copy it replaces. Safe to call at any time.
+    """
+    table, new, old = (os.path.join(out_dir, n) for n in (name, f".{name}.compact", f".{name}.old"))
+    if os.path.isdir(new):
+        if os.path.exists(os.path.join(new, "_complete")) and not os.path.isdir(table):
+            os.replace(new, table)   # crashed between the two renames: the old copy is already aside
+        else:
+            shutil.rmtree(new)       # unfinished, or the old table is still in place
+    if os.path.isdir(old) and os.path.isdir(table):
+        shutil.rmtree(old)
+
+def compact(out_dir: str):
+    """
+    Rewrites every tile table with one merged tile per bucket. The merged table is built and fsynced
+    under a temp name and swapped in by rename; the old tiles are removed only after that, so a crash
+    leaves either the old tiles or the new ones (see _finish_compaction).
+    """
+    tiles = ColumnarStore(out_dir)
+    for metric in ("occupancy", "energy"):
+        for level in LEVEL_KEYS:
+            for res in RESOLUTIONS:
+                name = tile_table(metric, level, res)
+                _finish_compaction(out_dir, name)
+                if not tiles.exists(name): continue
+                merged = query_rollup(out_dir, metric, level, res)
+                if merged is None or not len(merged): continue
+                for k in LEVEL_KEYS[level]:
+                    merged[k] = merged[k].astype(str)
+                new, old = f".{name}.compact", os.path.join(out_dir, f".{name}.old")
+                tiles.append(new, merged.drop(columns=["mean"]))
+                open(os.path.join(out_dir, new, "_complete"), "w").close()
+                _fsync_tree(os.path.join(out_dir, new))
+                os.replace(os.path.join(out_dir, name), old)
+                os.replace(os.path.join(out_dir, new), os.path.join(out_dir, name))
+                _fsync_dir(out_dir)
+                shutil.rmtree(old)
+
+def main():
+    ap = argparse.ArgumentParser(description="Incrementally maintain 1min/15min/1h rollups of the history logs")
+    ap.add_argument("--src_dir", default="outputs/live")
+    ap.add_argument("--out_dir", default="outputs/live/rollups")
+    ap.add_argument("--batch", action="store_true", help="source is a synth dataset (occupancy, energy_room, ...)")
+    ap.add_argument("--every", type=float, default=None, help="keep running, updating every N seconds")
+    ap.add_argument("--compact", action="store_true", help="merge partial tiles after updating")
+    args = ap.parse_args()
+    while True:
+        print(update_rollups(args.src_dir, args.out_dir, "" if args.batch else "_log"))
+        if args.compact:
+            compact(args.out_dir)
+        if args.every is None: break
+        time.sleep(args.every)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+import os, json, time, socket, struct, selectors, threading
+from collections import deque
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+
+# frame: <u4 payload length><u1 kind><payload>; kind H = hello (JSON layout), S = snapshot (binary)
+_FRAME = struct.Struct("<IB")
+# subscriber -> publisher: b"N"<u1 len><name> once, then b"A"<u8 seq> after handling each snapshot
+_ACK = struct.Struct("<Q")
+_SNAP = struct.Struct("<4sQqII")   # magic, seq, timestamp ns, n_rooms, n_floors
+MAGIC = b"SNP1"
+ROOM_FIELDS = [("count", "<i4"), ("co2", "<f4"), ("lux", "<f4"), ("noise", "<f4"), ("motion", "u1"),
+               ("door", "u1"), ("rh", "<f4"), ("kw", "<f4")]
+
+def pack_snapshot(seq: int, ts_ns: int, sim: dict, floor_kw: np.ndarray) -> bytes:
+    n_rooms, n_floors = len(sim["count"]), len(floor_kw)
+    parts = [_SNAP.pack(MAGIC, seq, ts_ns, n_rooms, n_floors)]
+    parts += [np.ascontiguousarray(sim[name], dtype=dt).tobytes() for name, dt in ROOM_FIELDS]
+    parts.append(np.ascontiguousarray(floor_kw, dtype="<f4").tobytes())
+    return b"".join(parts)
+
+def unpack_snapshot(buf: bytes) -> dict:
+    magic, seq, ts_ns, n_rooms, n_floors = _SNAP.unpack_from(buf)
+    if magic != MAGIC:
+        raise ValueError("not a snapshot frame")
+    out, off = {"seq": seq, "timestamp_ns": ts_ns}, _SNAP.size
+    for name, dt in ROOM_FIELDS:
+        out[name] = np.frombuffer(buf, dtype=dt, count=n_rooms, offset=off)
+        off += n_rooms * np.dtype(dt).itemsize
+    out["floor_kw"] = np.frombuffer(buf, dtype="<f4", count=n_floors, offset=off)
+    return out
+
+def _frame(kind: bytes, payload: bytes) -> bytes:
+    return _FRAME.pack(len(payload), kind[0]) + payload
+
+class _Peer:
+    def __init__(self, sock):
+        self.sock = sock
+        self.partial = b""      # remainder of a frame already started on the wire
+        self.queued = None      # next whole frame; replaced by newer snapshots (latest wins)
+        self.inbox = b""
+        self.name = f"sub-{sock.fileno()}"
+        self.acked_seq = 0
+        self.acked_at = None
+
+class SnapshotPublisher:
+    """
+    Publishes per-tick snapshots to local subscribers over a Unix domain socket. New subscribers
+    get the room layout and the latest snapshot on connect. A subscriber that falls behind is sent
+    only the newest snapshot next, so it sees a gap in `seq` rather than stalling the publisher.
+    Subscribers that ack (SnapshotSubscriber.ack) show up in consumer_stats with their lag.
+    """
+
+    def __init__(self, path: str, floors_list: list):
+        self.path = path
+        self.seq = 0
+        self.hello = _frame(b"H", json.dumps({
+            "floors": [F["floor_id"] for F in floors_list],
+            "rooms": [[F["floor_id"], r["room_id"]] for F in floors_list for r in F["rooms"]],
+        }).encode())
+        self.last = None
+        self.peers: List[_Peer] = []
+        self._published = deque(maxlen=65536)   # (seq, timestamp ns, monotonic publish time)
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            os.remove(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        self._server.listen()
+        self._server.setblocking(False)
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._sel = selectors.DefaultSelector()
+        self._sel.register(self._server, selectors.EVENT_READ, "accept")
+        self._sel.register(self._wake_r, selectors.EVENT_READ, "wake")
+        self._closed = False
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    @property
+    def n_subscribers(self) -> int:
+        return len(self.peers)
+
+    def publish(self, ts_ns: int, sim: dict, floor_kw: np.ndarray) -> int:
+        self.seq += 1
+        frame = _frame(b"S", pack_snapshot(self.seq, ts_ns, sim, floor_kw))
+        with self._lock:
+            self._published.append((self.seq, ts_ns, time.monotonic()))
+            self.last = frame
+            for p in self.peers:
+                p.queued = frame
+        self._wake_w.send(b"x")
+        return self.seq
+
+    def consumer_stats(self) -> List[dict]:
+        """
+        Per acking subscriber: seq_lag (snapshots behind), data_lag_s (publish clock minus the timestamp of
+        the newest acked snapshot, i.e. lag against a replay clock) and ack_latency_s (publish -> ack wall time).
+        """
+        with self._lock:
+            if not self._published: return []
+            by_seq = {seq: (ts, t) for seq, ts, t in self._published}
+            _, head_ts, _ = self._published[-1]
+            out = []
+            for p in self.peers:
+                row = {"name": p.name, "acked_seq": p.acked_seq, "seq_lag": self.seq - p.acked_seq,
+                       "data_lag_s": None, "ack_latency_s": None}
+                if p.acked_seq in by_seq:
+                    ts, t_pub = by_seq[p.acked_seq]
+                    row["data_lag_s"] = (head_ts - ts) / 1e9
+                    row["ack_latency_s"] = p.acked_at - t_pub
+                out.append(row)
+            return out
+
+    def close(self):
+        self._closed = True
+        self._wake_w.send(b"x")
+        self._thread.join(timeout=2)
+        for p in self.peers:
+            p.sock.close()
+        self._server.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _serve(self):
+        while not self._closed:
+            for key, _ in self._sel.select(timeout=1.0):
+                if key.data == "accept":
+                    try:
+                        sock, _ = self._server.accept()
+                    except BlockingIOError:
+                        continue
+                    sock.setblocking(False)
+                    peer = _Peer(sock)
+                    with self._lock:
+                        peer.partial, peer.queued = self.hello, self.last
+                        self.peers.append(peer)
+                elif key.data == "wake":
+                    self._wake_r.recv(4096)
+                elif key.data is not None:
+                    with self._lock:
+                        self._on_readable(key.data)
+            with self._lock:
+                for p in list(self.peers):
+                    self._flush(p)
+
+    def _on_readable(self, peer: _Peer):
+        try:
+            data = peer.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._drop(peer)
+            return
+        buf = peer.inbox + data
+        while buf:
+            if buf[:1] == b"A" and len(buf) >= 1 + _ACK.size:
+                peer.acked_seq = _ACK.unpack_from(buf, 1)[0]
+                peer.acked_at = time.monotonic()
+                buf = buf[1 + _ACK.size:]
+            elif buf[:1] == b"N" and len(buf) >= 2 and len(buf) >= 2 + buf[1]:
+                peer.name = buf[2:2 + buf[1]].decode(errors="replace")
+                buf = buf[2 + buf[1]:]
+            elif buf[:1] in (b"A", b"N"):
+                break
+            else:
+                buf = b""   # unknown input: ignore it
+        peer.inbox = buf
+
+    def _flush(self, p: _Peer):
+        try:
+            while True:
+                if not p.partial:
+                    if p.queued is None: break
+                    p.partial, p.queued = p.queued, None
+                sent = p.sock.send(p.partial)
+                p.partial = p.partial[sent:]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._drop(p)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if p.partial or p.queued else 0)
+        try:
+            self._sel.modify(p.sock, events, p)
+        except KeyError:
+            self._sel.register(p.sock, events, p)
+
+    def _drop(self, p: _Peer):
+        if p in self.peers:
+            self.peers.remove(p)
+        try:
+            self._sel.unregister(p.sock)
+        except (KeyError, ValueError):
+            pass
+        p.sock.close()
+
+class SnapshotSubscriber:
+    """Client side of SnapshotPublisher; `recv` returns each snapshot once, as numpy arrays."""
+
+    def __init__(self, path: str, timeout: Optional[float] = 5.0, name: Optional[str] = None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.timeout = timeout
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        if name:
+            raw = name.encode()[:255]
+            self.sock.sendall(b"N" + bytes([len(raw)]) + raw)
+        self._buf = bytearray()
+        kind, payload = self._read_frame()
+        layout = json.loads(payload)
+        self.floors = layout["floors"]
+        self.rooms = layout["rooms"]
+        self.last_seq = 0
+        self.missed = 0
+
+    def close(self):
+        self.sock.close()
+
+    def ack(self, seq: Optional[int] = None):
+        """Tells the publisher this snapshot (default: the last received) has been fully handled."""
+        self.sock.sendall(b"A" + _ACK.pack(self.last_seq if seq is None else seq))
+
+    def _fill(self, n: int):
+        while len(self._buf) < n:
+            chunk = self.sock.recv(max(65536, n - len(self._buf)))
+            if not chunk:
+                raise ConnectionError("snapshot publisher closed the connection")
+            self._buf += chunk
+
+    def _read_frame(self):
+        # nothing is consumed until the whole frame is buffered, so a timeout mid-frame loses nothing
+        self._fill(_FRAME.size)
+        length, kind = _FRAME.unpack_from(self._buf)
+        end = _FRAME.size + length
+        self._fill(end)
+        payload = bytes(self._buf[_FRAME.size:end])
+        del self._buf[:end]
+        return bytes([kind]), payload
+
+    def recv(self, timeout: Optional[float] = None) -> dict:
+        """Next snapshot; waits up to `timeout` s, or the constructor's timeout when None."""
+        if timeout is None:
+            return self._recv()
+        self.sock.settimeout(timeout)
+        try:
+            return self._recv()
+        finally:
+            self.sock.settimeout(self.timeout)
+
+    def _recv(self) -> dict:
+        while True:
+            kind, payload = self._read_frame()
+            if kind == b"S":
+                snap = unpack_snapshot(payload)
+                if self.last_seq and snap["seq"] > self.last_seq + 1:
+                    self.missed += snap["seq"] - self.last_seq - 1
+                self.last_seq = snap["seq"]
+                return snap
+
+    def latest(self, timeout: Optional[float] = 5.0) -> dict:
+        """
+        Waits up to `timeout` s for one snapshot (None: no limit; raises TimeoutError when it runs
+        out), then drains whatever else is already buffered and returns the newest. The
+        constructor's timeout is back in place afterwards.
+        """
+        try:
+            self.sock.settimeout(timeout)
+            snap = self._recv()
+            self.sock.setblocking(False)
+            try:
+                while True:
+                    snap = self._recv()
+            except (BlockingIOError, socket.timeout):
+                pass
+        finally:
+            self.sock.settimeout(self.timeout)
+        return snap
+
+def snapshot_frames(sub: SnapshotSubscriber, snap: dict) -> Dict[str, pd.DataFrame]:
+    """A snapshot as DataFrames in the *_live.csv schemas (occupancy, sensors, energy_room/floor/building)."""
+    stamp = pd.Timestamp(snap["timestamp_ns"], tz="UTC").isoformat()
+    keys = np.array(sub.rooms, dtype=object).reshape(len(sub.rooms), 2)
+    base = {"timestamp": stamp, "floor_id": keys[:, 0], "room_id": keys[:, 1]}
+    floor_kw = snap["floor_kw"].astype(float)
+    return {
+        "occupancy": pd.DataFrame({**base, "count": snap["count"].astype(np.int64)}),
+        "sensors": pd.DataFrame({**base, **{c: snap[c].astype(float if c not in ("motion", "door") else np.int64)
+                                            for c in ("co2", "lux", "noise", "motion", "door", "rh")}}),
+        "energy_room": pd.DataFrame({**base, "kw": snap["kw"].astype(float)}),
+        "energy_floor": pd.DataFrame({"timestamp": stamp, "floor_id": sub.floors, "meter_kw": floor_kw}),
+        "energy_building": pd.DataFrame({"timestamp": [stamp], "meter_kw": [float(floor_kw.sum())]}),
+    }
@@ -0,0 +1,136 @@
+import os, json, time, hashlib, tempfile, threading
+import urllib.request, urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional
+
+def encode(obj, pretty: bool = False) -> bytes:
+    if pretty:
+        return json.dumps(obj, indent=2).encode()
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+def write_bytes_atomic(data: bytes, path: str):
+    """Temp file in the same directory, fsync, rename: readers see the old file or the new one, never a mix."""
+    with tempfile.NamedTemporaryFile("wb", delete=False, dir=os.path.dirname(path) or ".", suffix=".tmp") as tmp:
+        tmp.write(data)
+        tmp.flush()
+        os.fsync(tmp.fileno())
+        tmp_path = tmp.name
+    os.replace(tmp_path, path)
+
+class StatePublisher:
+    """
+    Holds the controller's JSON documents (e.g. "state", "merges"), persists each one atomically only
+    when its content changed, and optionally serves them read-only over HTTP on localhost:
+      GET /            names of the documents
+      GET /<name>      the latest document (compact JSON, ETag = content hash; If-None-Match -> 304)
+    Keys listed as `volatile` in update() (counters) are left out of the change hash, so they alone
+    do not trigger a write; they are still written with the next real change, or after `refresh_s`.
+    """
+
+    def __init__(self, paths: Dict[str, str], pretty: bool = False, http_port: Optional[int] = None,
+                 host: str = "127.0.0.1", refresh_s: Optional[float] = 30.0):
+        self.paths = paths
+        self.pretty = pretty
+        self.refresh_s = refresh_s
+        self._docs: Dict[str, tuple] = {}        # name -> (compact bytes, etag)
+        self._hash: Dict[str, str] = {}          # name -> hash of the non-volatile content last written
+        self._written_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.writes = self.skipped = self.requests = 0
+        for path in paths.values():
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._server = self._thread = None
+        if http_port is not None:
+            self._server = ThreadingHTTPServer((host, http_port), _handler(self))
+            self._server.daemon_threads = True
+            self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+            self._thread.start()
+
+    @property
+    def url(self) -> Optional[str]:
+        if self._server is None: return None
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def update(self, name: str, obj: dict, volatile: Iterable[str] = ()) -> bool:
+        """Publishes `obj` as document `name`; returns True when the file was rewritten."""
+        volatile = set(volatile)
+        stable = {k: v for k, v in obj.items() if k not in volatile} if volatile else obj
+        digest = hashlib.blake2b(encode(stable), digest_size=16).hexdigest()
+        body = encode(obj)
+        with self._lock:
+            self._docs[name] = (body, hashlib.blake2b(body, digest_size=16).hexdigest())
+        now = time.monotonic()
+        stale = self.refresh_s is not None and volatile and now - self._written_at.get(name, now) >= self.refresh_s
+        if digest == self._hash.get(name) and not stale:
+            self.skipped += 1
+            return False
+        path = self.paths.get(name)
+        if path:
+            write_bytes_atomic(encode(obj, True) if self.pretty else body, path)
+        self._hash[name] = digest
+        self._written_at[name] = now
+        self.writes += 1
+        return True
+
+    def get(self, name: str) -> Optional[tuple]:
+        with self._lock:
+            return self._docs.get(name)
+
+    def names(self) -> list:
+        with self._lock:
+            return sorted(self._docs)
+
+    def stats(self) -> dict:
+        return {"writes": self.writes, "skipped": self.skipped, "http_requests": self.requests}
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join(timeout=2)
+
+def _handler(pub: StatePublisher):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            pub.requests += 1
+            name = self.path.split("?", 1)[0].strip("/")
+            if not name:
+                return self._send(200, encode(pub.names()))
+            doc = pub.get(name)
+            if doc is None:
+                return self._send(404, encode({"error": f"no document {name!r}"}))
+            body, etag = doc
+            if self.headers.get("If-None-Match") == f'"{etag}"':
+                return self._send(304, b"", etag)
+            self._send(200, body, etag)
+
+        def do_HEAD(self):
+            self.do_GET()
+
+        def _refuse(self):
+            self._send(405, encode({"error": "read-only"}))
+
+        do_POST = do_PUT = do_DELETE = do_PATCH = _refuse
+
+        def _send(self, code: int, body: bytes, etag: Optional[str] = None):
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if etag:
+                self.send_header("ETag", f'"{etag}"')
+            self.end_headers()
+            if self.command != "HEAD" and code != 304:
+                self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+def fetch_state(url: str, name: str = "state", timeout: float = 1.0) -> Optional[dict]:
+    """A document from a StatePublisher endpoint, or None when the controller is not serving."""
+    try:
+        with urllib.request.urlopen(f"{url.rstrip('/')}/{name}", timeout=timeout) as r:
+            return json.loads(r.read())
+    except (urllib.error.URLError, OSError, ValueError):
+        return None
@@ -0,0 +1,255 @@
+import os, json, shutil, tempfile, argparse
+import numpy as np
+import pandas as pd
+from typing import List, Optional, Tuple
+
+NS_PER_DAY = 86_400 * 1_000_000_000
+_DTYPES = {"ts": np.int64, "cat": np.int32, "i8": np.int64, "f8": np.float64}
+
+def _to_ns(t) -> Optional[int]:
+    if t is None: return None
+    t = pd.Timestamp(t)
+    return int((t.tz_localize("UTC") if t.tzinfo is None else t).value)
+
+def _epoch_ns(col: pd.Series) -> np.ndarray:
+    if not pd.api.types.is_datetime64_any_dtype(col):
+        col = pd.to_datetime(col, utc=True, format="ISO8601")
+    elif col.dt.tz is None:
+        col = col.dt.tz_localize("UTC")
+    return col.dt.tz_convert("UTC").to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+def _column_kind(name: str, s: pd.Series) -> str:
+    if name == "timestamp": return "ts"
+    if pd.api.types.is_float_dtype(s): return "f8"
+    if pd.api.types.is_integer_dtype(s) or pd.api.types.is_bool_dtype(s): return "i8"
+    return "cat"
+
+def read_json(path: str, default=None):
+    if not os.path.exists(path): return default
+    with open(path, "r") as f:
+        return json.load(f)
+
+def write_json_atomic(obj, path: str):
+    with tempfile.NamedTemporaryFile("w", delete=False, dir=os.path.dirname(path), suffix=".tmp") as tmp:
+        json.dump(obj, tmp)
+        tmp_path = tmp.name
+    os.replace(tmp_path, path)
+
+class ColumnarStore:
+    """
+    Day-partitioned columnar tables without extra dependencies:
+      <root>/<table>/day=YYYY-MM-DD/_schema.json
+      <root>/<table>/day=YYYY-MM-DD/<column>.bin        raw little-endian values, one file per column
+      <root>/<table>/day=YYYY-MM-DD/<column>.dict.json  categories of categorical (string id) columns
+    `timestamp` is int64 epoch ns; string columns are int32 category codes. Appends add bytes to the
+    column files, timestamp last, and readers only trust the shortest column, so a reader racing a
+    writer never sees a half-written row.
+    """
+    kind = "columnar"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _table_dir(self, table: str) -> str:
+        return os.path.join(self.root, table)
+
+    def exists(self, table: str) -> bool:
+        return os.path.isdir(self._table_dir(table))
+
+    def partitions(self, table: str) -> List[Tuple[int, str]]:
+        tdir = self._table_dir(table)
+        if not os.path.isdir(tdir): return []
+        out = []
+        for name in os.listdir(tdir):
+            if name.startswith("day="):
+                day = pd.Timestamp(name[4:], tz="UTC").value // NS_PER_DAY
+                out.append((day, os.path.join(tdir, name)))
+        return sorted(out)
+
+    def drop(self, table: str):
+        shutil.rmtree(self._table_dir(table), ignore_errors=True)
+
+    def append(self, table: str, df: pd.DataFrame):
+        if df is None or not len(df): return
+        ts = _epoch_ns(df["timestamp"])
+        day = ts // NS_PER_DAY
+        days = np.unique(day)
+        for d in days:
+            m = None if len(days) == 1 else (day == d)
+            part = df if m is None else df[m]
+            pdir = os.path.join(self._table_dir(table), "day=" + pd.Timestamp(int(d) * NS_PER_DAY, tz="UTC").strftime("%Y-%m-%d"))
+            self._append_partition(pdir, part, ts if m is None else ts[m])
+
+    def _append_partition(self, pdir: str, df: pd.DataFrame, ts: np.ndarray):
+        os.makedirs(pdir, exist_ok=True)
+        schema_path = os.path.join(pdir, "_schema.json")
+        schema = read_json(schema_path)
+        if schema is None:
+            schema = {"columns": {c: _column_kind(c, df[c]) for c in df.columns}}
+            write_json_atomic(schema, schema_path)
+        missing = [c for c in schema["columns"] if c not in df.columns]
+        if missing:
+            raise ValueError(f"append to {pdir} is missing columns {missing}")
+
+        arrays = {}
+        for col, kind in schema["columns"].items():
+            if kind == "ts":
+                continue
+            if kind == "cat":
+                arrays[col] = self._encode(pdir, col, df[col])
+            else:
+                arrays[col] = df[col].to_numpy(dtype=_DTYPES[kind])
+        arrays["timestamp"] = ts.astype(np.int64)
+        for col, arr in arrays.items():
+            with open(os.path.join(pdir, f"{col}.bin"), "ab") as f:
+                f.write(np.ascontiguousarray(arr).tobytes())
+
+    def _encode(self, pdir: str, col: str, values: pd.Series) -> np.ndarray:
+        dict_path = os.path.join(pdir, f"{col}.dict.json")
+        cats = read_json(dict_path, [])
+        values = values.astype(str)
+        new = [v for v in pd.unique(values) if v not in set(cats)]
+        if new:
+            cats = cats + new
+            write_json_atomic(cats, dict_path)
+        return pd.Index(cats).get_indexer(values).astype(np.int32)
+
+    def read(self, table: str, columns: Optional[List[str]] = None, start=None, end=None) -> Optional[pd.DataFrame]:
+        """Rows with start <= timestamp < end; only day partitions in range and requested columns are touched."""
+        parts = self.partitions(table)
+        if not parts: return None
+        lo, hi = _to_ns(start), _to_ns(end)
+        pieces, kinds = [], {}
+        for day, pdir in parts:
+            if lo is not None and (day + 1) * NS_PER_DAY <= lo: continue
+            if hi is not None and day * NS_PER_DAY >= hi: continue
+            schema = read_json(os.path.join(pdir, "_schema.json"))
+            if schema is None: continue
+            cols = list(columns) if columns else list(schema["columns"])
+            need = list(dict.fromkeys(cols + ["timestamp"]))
+            kinds.update({c: schema["columns"][c] for c in need})
+            n = min(os.path.getsize(os.path.join(pdir, f"{c}.bin")) // np.dtype(_DTYPES[kinds[c]]).itemsize
+                    if os.path.exists(os.path.join(pdir, f"{c}.bin")) else 0 for c in need)
+            if n == 0: continue
+            ts = np.memmap(os.path.join(pdir, "timestamp.bin"), dtype=np.int64, mode="r", shape=(n,))
+            sel = slice(None)
+            if (lo is not None and lo > day * NS_PER_DAY) or (hi is not None and hi < (day + 1) * NS_PER_DAY):
+                m = np.ones(n, dtype=bool)
+                if lo is not None: m &= ts >= lo
+                if hi is not None: m &= ts < hi
+                sel = np.flatnonzero(m)
+            piece = {}
+            for c in cols:
+                arr = np.array(np.memmap(os.path.join(pdir, f"{c}.bin"), dtype=_DTYPES[kinds[c]], mode="r", shape=(n,))[sel])
+                if kinds[c] == "cat":
+                    arr = (arr, read_json(os.path.join(pdir, f"{c}.dict.json"), []))
+                piece[c] = arr
+            pieces.append(piece)
+        if not pieces:
+            return pd.DataFrame(columns=list(columns) if columns else None)
+
+        out = {}
+        for c in pieces[0]:
+            kind = kinds[c]
+            if kind == "cat":
+                cats = list(dict.fromkeys(v for p in pieces for v in p[c][1]))
+                index = pd.Index(cats)
+                codes = np.concatenate([index.get_indexer(p[c][1])[p[c][0]] if len(p[c][1]) else p[c][0]
+                                        for p in pieces])
+                out[c] = pd.Categorical.from_codes(codes, categories=cats)
+            else:
+                arr = np.concatenate([p[c] for p in pieces])
+                out[c] = pd.to_datetime(arr, unit="ns", utc=True) if kind == "ts" else arr
+        return pd.DataFrame(out)
+
+    def time_bounds(self, table: str) -> Optional[Tuple[pd.Timestamp, pd.Timestamp]]:
+        parts = self.partitions(table)
+        lo = hi = None
+        for _, pdir in parts:
+            path = os.path.join(pdir, "timestamp.bin")
+            n = os.path.getsize(path) // 8 if os.path.exists(path) else 0
+            if n == 0: continue
+            ts = np.memmap(path, dtype=np.int64, mode="r", shape=(n,))
+            lo = ts[0] if lo is None else lo
+            hi = ts[n - 1]
+        if lo is None: return None
+        return pd.Timestamp(int(lo), tz="UTC"), pd.Timestamp(int(hi), tz="UTC")
+
+class CsvStore:
+    """The original one-CSV-per-table layout (<root>/<table>.csv), kept for export and compatibility."""
+    kind = "csv"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, table: str) -> str:
+        return os.path.join(self.root, f"{table}.csv")
+
+    def exists(self, table: str) -> bool:
+        return os.path.exists(self.path(table))
+
+    def drop(self, table: str):
+        if os.path.exists(self.path(table)):
+            os.remove(self.path(table))
+
+    def append(self, table: str, df: pd.DataFrame):
+        path = self.path(table)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        header = not os.path.exists(path)
+        df.to_csv(path, mode="a" if not header else "w", header=header, index=False)
+
+    def read(self, table: str, columns: Optional[List[str]] = None, start=None, end=None) -> Optional[pd.DataFrame]:
+        path = self.path(table)
+        if not os.path.exists(path): return None
+        usecols = list(dict.fromkeys(list(columns) + ["timestamp"])) if columns else None
+        df = pd.read_csv(path, usecols=usecols, parse_dates=["timestamp"])
+        if start is not None or end is not None:
+            m = np.ones(len(df), dtype=bool)
+            if start is not None: m &= (df["timestamp"] >= pd.Timestamp(_to_ns(start), tz="UTC")).to_numpy()
+            if end is not None: m &= (df["timestamp"] < pd.Timestamp(_to_ns(end), tz="UTC")).to_numpy()
+            df = df[m].reset_index(drop=True)
+        return df[list(columns)] if columns else df
+
+    def time_bounds(self, table: str) -> Optional[Tuple[pd.Timestamp, pd.Timestamp]]:
+        df = self.read(table, ["timestamp"])
+        if df is None or not len(df): return None
+        return df["timestamp"].min(), df["timestamp"].max()
+
+def open_store(kind: str, root: str):
+    if kind == "csv": return CsvStore(root)
+    if kind == "columnar": return ColumnarStore(root)
+    raise ValueError(f"unknown store kind: {kind}")
+
+def detect_store(root: str, table: str):
+    """The columnar store if `table` has been written in columnar form under `root`, else CSV."""
+    col = ColumnarStore(root)
+    return col if col.exists(table) else CsvStore(root)
+
+def read_table(root: str, table: str, columns: Optional[List[str]] = None, start=None, end=None) -> Optional[pd.DataFrame]:
+    return detect_store(root, table).read(table, columns, start, end)
+
+def export_csv(store, table: str, path: str, start=None, end=None) -> int:
+    df = store.read(table, start=start, end=end)
+    if df is None: return 0
+    if "timestamp" in df.columns:
+        df["timestamp"] = df["timestamp"].dt.strftime("%Y-%m-%dT%H:%M:%S.%f") + "+00:00"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    df.to_csv(path, index=False)
+    return len(df)
+
+def main():
+    ap = argparse.ArgumentParser(description="Export columnar tables to CSV")
+    ap.add_argument("--root", required=True, help="columnar store directory, e.g. outputs/synth")
+    ap.add_argument("--out_dir", required=True)
+    ap.add_argument("--tables", nargs="*", default=None)
+    ap.add_argument("--start", default=None)
+    ap.add_argument("--end", default=None)
+    args = ap.parse_args()
+    store = ColumnarStore(args.root)
+    tables = args.tables or sorted(t for t in os.listdir(args.root) if store.exists(t))
+    for t in tables:
+        n = export_csv(store, t, os.path.join(args.out_dir, f"{t}.csv"), args.start, args.end)
+        print(f"{t}: {n} rows")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
-import os, json, argparse, math
+import os, argparse, math
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
-from .floors import load_floors
+from typing import List, Optional, Union
+from .floors import load_floors, room_table
+from .storage import open_store
+from .energy_model import RoomEnergyModel
 
 def diurnal_prob(hour: float, is_common: bool) -> float:
     peak1 = math.exp(-((hour - 11.0) ** 2) / (2 * 2.2 ** 2))
@@ -11,81 +15,213 @@ def diurnal_prob(hour: float, is_common: bool) -> float:
     scale = 0.55 if is_common else 0.45
     return max(0.0, min(0.98, base + scale * (0.55 * peak1 + 0.45 * peak2)))
 
+def diurnal_prob_array(hours: np.ndarray, is_common: np.ndarray) -> np.ndarray:
+    """Vectorized diurnal_prob: hours (T,) x is_common (R,) -> (T, R)."""
+    h = np.asarray(hours, dtype=float)[:, None]
+    peak1 = np.exp(-((h - 11.0) ** 2) / (2 * 2.2 ** 2))
+    peak2 = np.exp(-((h - 15.0) ** 2) / (2 * 2.5 ** 2))
+    base = np.where(is_common, 0.05, 0.02)
+    scale = np.where(is_common, 0.55, 0.45)
+    return np.clip(base + scale * (0.55 * peak1 + 0.45 * peak2), 0.0, 0.98)
+
 def simulate_temp(ts: pd.DatetimeIndex, t_mean=28.0, swing=6.0) -> np.ndarray:
     hours = (ts.view("int64") // 3_600_000_000_000) % 24
     diurnal = swing * np.sin((hours - 6) / 24 * 2 * np.pi)
     noise = np.random.normal(0, 0.7, size=len(ts))
     return t_mean + diurnal + noise
 
-def generate_batch(floors_json: str, out_dir: str, hours: int = 24, step_min: int = 5, start_iso: str = None):
+def ema_counts(draws: np.ndarray, prev: np.ndarray, alpha: float = 0.5) -> np.ndarray:
+    """
+    Inertia recurrence count[t] = round(alpha*count[t-1] + (1-alpha)*draw[t]), evaluated for
+    all rooms at once per step. The per-step rounding makes it non-linear, so time stays a loop.
+    """
+    out = np.empty(draws.shape, dtype=np.int64)
+    cur = np.asarray(prev, dtype=float)
+    for i in range(draws.shape[0]):
+        cur = np.rint(alpha * cur + (1.0 - alpha) * draws[i])
+        out[i] = cur
+    return out
+
+# random variables of simulate_timeline, each drawn from its own stream
+STREAMS = ("weather", "count", "co2", "lux", "noise", "door", "rh")
+
+def variable_streams(seed) -> dict:
+    """One stream per random variable from a single seed (int, SeedSequence or None)."""
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    return {k: np.random.default_rng(s) for k, s in zip(STREAMS, seed_seq.spawn(len(STREAMS)))}
+
+def spawn_streams(seed_seq: np.random.SeedSequence, n_rooms: int):
+    """Independent child streams: one for building-wide weather, one set per room (see variable_streams)."""
+    weather, *rooms = seed_seq.spawn(n_rooms + 1)
+    return np.random.default_rng(weather), [variable_streams(r) for r in rooms]
+
+def simulate_timeline(tbl: dict, ts: pd.DatetimeIndex, rng: Union[np.random.Generator, dict],
+                      prev: Optional[np.ndarray] = None, alpha: float = 0.5,
+                      room_rngs: Optional[List[np.random.Generator]] = None,
+                      model: Optional[RoomEnergyModel] = None) -> dict:
+    """
+    Whole (timesteps x rooms) occupancy, sensor and per-room energy matrices for `ts`.
+    `rng` is one Generator or a {variable: Generator} dict (variable_streams). With a dict, every
+    variable consumes its own stream in time order, so simulating a timeline in consecutive chunks
+    draws exactly the values of one call over the whole of it.
+    With `room_rngs`, column j is drawn from room j's own streams (see spawn_streams), so a room's
+    series does not depend on how many other rooms are simulated alongside it.
+    """
+    T, R = len(ts), len(tbl["room_id"])
+
+    def stream(g, name):
+        return g[name] if isinstance(g, dict) else g
+
+    def draw(name, method, *params):
+        if room_rngs is None:
+            return getattr(stream(rng, name), method)(*params, size=(T, R))
+        cols = [np.broadcast_to(np.asarray(p), (T, R)) for p in params]
+        return np.stack([getattr(stream(g, name), method)(*(c[:, j] for c in cols), size=T)
+                         for j, g in enumerate(room_rngs)], axis=1).reshape(T, R)
+
+    utc = ts.tz_convert(None)
+    hl = np.asarray(utc.hour + utc.minute / 60.0, dtype=float)
+    T_out = 28.0 + 6.0 * np.sin((hl - 6) / 24 * 2 * np.pi) + stream(rng, "weather").normal(0, 0.4, size=T)
+
+    p = diurnal_prob_array(hl, tbl["is_common"])
+    draws = draw("count", "binomial", tbl["capacity"], p)
+    prev = np.zeros(R) if prev is None else prev
+    cnt = ema_counts(draws, prev, alpha)
+
+    occupied = cnt > 0
+    daytime = ((utc.hour >= 7) & (utc.hour <= 18))[:, None]
+    co2 = np.clip(draw("co2", "normal", 450 + 35 * cnt, 40), 400, 2000)
+    lux = np.clip(draw("lux", "normal", np.where(daytime, 700.0, 120.0), 80), 0, 1500)
+    noise = np.clip(35 + 3 * np.sqrt(np.maximum(cnt, 0)) + draw("noise", "normal", 0, 2), 30, 85)
+    motion = occupied.astype(np.int64)
+    door = (draw("door", "random") < np.where(occupied, 0.1, 0.02)).astype(np.int64)
+    rh = np.clip(draw("rh", "normal", 50, 6), 30, 70)
+
+    energy = (model or RoomEnergyModel(tbl)).evaluate(cnt, lux, door, T_out)
+    return {"count": cnt, "co2": co2, "lux": lux, "noise": noise, "motion": motion,
+            "door": door, "rh": rh, "t_out": T_out, **energy}
+
+def timeline_frames(tbl: dict, ts: pd.DatetimeIndex, sim: dict, iso: bool = True) -> dict:
+    """
+    Long-format DataFrames (timestamp-major, floors.json room order) in the batch CSV schemas.
+    `iso=False` keeps timestamps as datetimes for typed (columnar) sinks.
+    """
+    T, R = sim["count"].shape
+    stamps = np.array([t.isoformat() for t in ts], dtype=object) if iso else ts
+    key = {"timestamp": np.repeat(stamps, R), "floor_id": np.tile(tbl["floor_id"], T),
+           "room_id": np.tile(tbl["room_id"], T)}
+    occ_df = pd.DataFrame({**key, "count": sim["count"].ravel()})
+    sen_df = pd.DataFrame({**key, **{c: sim[c].ravel() for c in ("co2", "lux", "noise", "motion", "door", "rh")}})
+    er_df = pd.DataFrame({**key, "kw": sim["kw"].ravel()})
+
+    F = len(tbl["floors"])
+    ef_df = pd.DataFrame({"timestamp": np.repeat(stamps, F), "floor_id": np.tile(tbl["floors"], T),
+                          "meter_kw": sim["floor_kw"].ravel()})
+    eb_df = pd.DataFrame({"timestamp": stamps, "meter_kw": sim["building_kw"]})
+    frames = {"occupancy": occ_df, "sensors": sen_df, "energy_room": er_df,
+              "energy_floor": ef_df, "energy_building": eb_df}
+    if "t_out" in sim and np.ndim(sim["t_out"]):
+        frames["weather_synth"] = pd.DataFrame({"timestamp": stamps, "air_temperature": sim["t_out"]})
+    return frames
+
+def time_chunks(start: pd.Timestamp, periods: int, step_min: int, chunk_periods: int):
+    """Yields consecutive DatetimeIndex chunks covering `periods` steps from `start`."""
+    for i0 in range(0, periods, chunk_periods):
+        yield pd.date_range(start=start + pd.Timedelta(minutes=step_min * i0),
+                            periods=min(chunk_periods, periods - i0), freq=f"{step_min}min", tz="UTC")
+
+def generate_batch(floors_json: str, out_dir: str, hours: int = 24, step_min: int = 5, start_iso: str = None,
+                   seed: Optional[int] = None, chunk_hours: Optional[float] = None,
+                   seed_seq: Optional[np.random.SeedSequence] = None, store: str = "csv"):
+    """
+    Writes the batch CSVs. With `chunk_hours` the timeline is generated and appended one chunk
+    at a time (inertia carried across chunk boundaries), so peak memory is bounded by the chunk
+    size rather than `hours`. Every random variable draws from its own stream in time order, so seeded
+    output is the same whatever `chunk_hours` is.
+    With `seed_seq`, weather and every room draw from their own spawned streams instead of `seed`.
+    `store` selects the output backend (see storage.open_store); "columnar" writes typed day partitions.
+    """
     os.makedirs(out_dir, exist_ok=True)
     idx, floors_list = load_floors(floors_json)
+    tbl = room_table(floors_list)
+    model = RoomEnergyModel(tbl)
+    if seed_seq is not None:
+        rng, room_rngs = spawn_streams(seed_seq, len(tbl["room_id"]))
+    else:
+        rng, room_rngs = variable_streams(seed), None
 
     start = pd.Timestamp(start_iso, tz="UTC") if start_iso else pd.Timestamp(datetime.now(timezone.utc))
-    ts = pd.date_range(start=start, periods=int(hours*60/step_min), freq=f"{step_min}min", tz="UTC")
-
-    prev = {k: 0 for k in idx.keys()}
-    occ_rows, sen_rows, er_rows = [], [], []
-
-    for t in ts:
-        hl = t.tz_convert(None).hour + t.tz_convert(None).minute/60.0
-        T_out = 28.0 + 6.0 * math.sin((hl - 6) / 24 * 2 * math.pi) + np.random.normal(0, 0.4)
-
-        for F in floors_list:
-            fid = F["floor_id"]
-            for r in F["rooms"]:
-                rid = r["room_id"]
-                cap = int(r["capacity"])
-                p = diurnal_prob(hl, r.get("is_common", False))
-                draw = np.random.binomial(cap, p)
-                cnt = int(round(0.5*prev[(fid, rid)] + 0.5*draw))
-                prev[(fid, rid)] = cnt
-
-                co2 = float(np.clip(np.random.normal(450 + 35*cnt, 40), 400, 2000))
-                daytime = 7 <= t.tz_convert(None).hour <= 18
-                lux = float(np.clip(np.random.normal(700 if daytime else 120, 80), 0, 1500))
-                noise = float(np.clip(35 + 3 * (max(cnt,0) ** 0.5) + np.random.normal(0,2), 30, 85))
-                motion = int(cnt > 0)
-                door = int(np.random.rand() < (0.1 if cnt > 0 else 0.02))
-                rh = float(np.clip(np.random.normal(50, 6), 30, 70))
-
-                occ_rows.append({"timestamp": t.isoformat(), "floor_id": fid, "room_id": rid, "count": cnt})
-                sen_rows.append({"timestamp": t.isoformat(), "floor_id": fid, "room_id": rid,
-                                 "co2":co2, "lux":lux, "noise":noise, "motion":motion, "door":door, "rh":rh})
-
-                # per-room energy (kW)
-                area = r["area_m2"]
-                ambient_kw = 0.02 * area
-                ppl_kw = 0.001 * 120.0 * cnt
-                cooling_kw = max(T_out - 24.0, 0.0) * 0.01 * area * (1.0 if cnt > 0 else 0.3)
-                lighting_kw = 0.008 * area * (0.5 if (lux >= 600 and cnt > 0) else 1.0)
-                door_penalty_kw = 0.1 if (door == 1 and cnt > 0) else 0.0
-                room_kw = ambient_kw + ppl_kw + cooling_kw + lighting_kw + door_penalty_kw
-
-                er_rows.append({"timestamp": t.isoformat(), "floor_id": fid, "room_id": rid, "kw": room_kw})
-
-    occ_df = pd.DataFrame(occ_rows)
-    sen_df = pd.DataFrame(sen_rows)
-    er_df  = pd.DataFrame(er_rows)
-    ef_df  = er_df.groupby(["timestamp","floor_id"], as_index=False)["kw"].sum().rename(columns={"kw":"meter_kw"})
-    eb_df  = er_df.groupby(["timestamp"], as_index=False)["kw"].sum().rename(columns={"kw":"meter_kw"})
-
-    occ_df.to_csv(os.path.join(out_dir, "occupancy.csv"), index=False)
-    sen_df.to_csv(os.path.join(out_dir, "sensors.csv"), index=False)
-    er_df.to_csv(os.path.join(out_dir, "energy_room.csv"), index=False)
-    ef_df.to_csv(os.path.join(out_dir, "energy_floor.csv"), index=False)
-    eb_df.to_csv(os.path.join(out_dir, "energy_building.csv"), index=False)
+    periods = int(hours*60/step_min)
+    chunk = max(1, int(chunk_hours*60/step_min)) if chunk_hours else max(periods, 1)
+
+    sink = open_store(store, out_dir)
+    prev = None
+    for i, ts in enumerate(time_chunks(start, periods, step_min, chunk)):
+        sim = simulate_timeline(tbl, ts, rng, prev, room_rngs=room_rngs, model=model)
+        prev = sim["count"][-1]
+        for name, df in timeline_frames(tbl, ts, sim, iso=sink.kind == "csv").items():
+            if i == 0: sink.drop(name)
+            sink.append(name, df)
     print(f"Wrote synthetic batch to {out_dir}")
 
+def _run_job(job: dict):
+    generate_batch(job["floors_json"], job["out_dir"], job["hours"], job["step_min"], job["start"],
+                   chunk_hours=job["chunk_hours"], seed_seq=job["seed_seq"], store=job["store"])
+    return job["out_dir"]
+
+def generate_many(floors_jsons: List[str], out_dir: str, starts: List[Optional[str]], hours: int = 24,
+                  step_min: int = 5, seed: Optional[int] = None, workers: int = 1,
+                  chunk_hours: Optional[float] = None, store: str = "csv") -> List[str]:
+    """
+    Fans (building x start) jobs out to a process pool, writing to out_dir/<building>/<start>/.
+    Job (b, r) draws from SeedSequence(seed, spawn_key=(b, r)) and its spawned per-room children,
+    so every job's output is identical whatever the worker count or completion order.
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+        print(f"No --seed given; using {seed}")
+    now = pd.Timestamp(datetime.now(timezone.utc)).isoformat()
+    starts = [s or now for s in (starts or [None])]
+    stems = [os.path.splitext(os.path.basename(p))[0] for p in floors_jsons]
+
+    jobs = []
+    for b, path in enumerate(floors_jsons):
+        name = stems[b] if stems.count(stems[b]) == 1 else f"{stems[b]}_{b}"
+        for r, start in enumerate(starts):
+            label = pd.Timestamp(start).strftime("%Y%m%dT%H%M")
+            jobs.append({"floors_json": path, "out_dir": os.path.join(out_dir, name, label), "hours": hours,
+                         "step_min": step_min, "start": start, "chunk_hours": chunk_hours, "store": store,
+                         "seed_seq": np.random.SeedSequence(seed, spawn_key=(b, r))})
+
+    if workers <= 1:
+        return [_run_job(j) for j in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run_job, jobs))
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--floors_json", default="data/floors.json")
+    ap.add_argument("--floors_json", nargs="+", default=["data/floors.json"],
+                    help="one or more building definitions; several imply multi-building mode")
     ap.add_argument("--out_dir", default="outputs/synth")
     ap.add_argument("--hours", type=int, default=24)
     ap.add_argument("--step_min", type=int, default=5)
     ap.add_argument("--start", type=str, default=None)
+    ap.add_argument("--starts", nargs="+", default=None,
+                    help="several range starts (each --hours long); implies multi-building mode")
+    ap.add_argument("--seed", type=int, default=None, help="seed for a reproducible dataset")
+    ap.add_argument("--chunk_hours", type=float, default=None,
+                    help="stream the timeline to disk in chunks of this many hours (bounded memory)")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="process pool size for multi-building mode (output does not depend on it)")
+    ap.add_argument("--store", choices=["csv", "columnar"], default="csv",
+                    help="output backend; columnar writes typed day-partitioned tables (export with src.storage)")
     args = ap.parse_args()
-    generate_batch(args.floors_json, args.out_dir, args.hours, args.step_min, args.start)
+    if len(args.floors_json) > 1 or args.starts or args.workers:
+        generate_many(args.floors_json, args.out_dir, args.starts or [args.start], args.hours, args.step_min,
+                      args.seed, args.workers or 1, args.chunk_hours, args.store)
+    else:
+        generate_batch(args.floors_json[0], args.out_dir, args.hours, args.step_min, args.start, args.seed,
+                       args.chunk_hours, store=args.store)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,180 @@
+import os, json, itertools, argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+from .floors import load_floors, room_table
+from .energy_model import RoomEnergyModel
+from .merge_policy import MergePlanner
+from .policy import load_rules, DEFAULT_RULES
+from .storage import read_table
+from .replay import iter_ticks
+from .batch_policy import _split
+
+# control -> share of the model's cooling / lighting load
+CONTROL_DEFAULTS = {"setpoint_cool_c": 24.0, "eco_cooling_share": 0.6, "off_cooling_share": 0.0,
+                    "vent_boost_share": 0.1, "solver": "greedy", "thresholds": {}, "rules_path": DEFAULT_RULES}
+
+def _t_out(dataset_dir: str, stamps: pd.DatetimeIndex, model: RoomEnergyModel, a: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Outdoor temperature per tick from the nearest weather_synth row (within one weather step: its ticks
+    need not line up with the occupancy ticks), else recovered from the recorded room kW.
+    """
+    pad = pd.Timedelta(1, "h")
+    w = read_table(dataset_dir, "weather_synth", start=stamps[0] - pad, end=stamps[-1] + pad)
+    if w is not None and len(w):
+        s = pd.Series(w["air_temperature"].to_numpy(), index=pd.DatetimeIndex(w["timestamp"])).sort_index()
+        s = s[~s.index.duplicated()]
+        step = s.index.to_series().diff().median() if len(s) > 1 else pad
+        t = s.reindex(stamps, method="nearest", tolerance=step)
+        if t.notna().any():
+            return t.ffill().bfill().to_numpy(dtype=float)
+    # older datasets: cooling is whatever the other terms don't explain (clipped at the setpoint)
+    no_cooling = model.room_kw(a["count"], a["lux"], a["door"], np.full(len(stamps), -np.inf))
+    occupied = a["count"] > 0
+    per_degc = (model.cooling_kw_per_degC * np.where(occupied, 1.0, model.vacant_cooling_share)).sum(axis=1)
+    over = np.maximum((a["kw"] - no_cooling).sum(axis=1), 0.0) / np.maximum(per_degc, 1e-9)
+    return model.setpoint_cool_c + over
+
+def _control_shares(rules, cmd: np.ndarray, flags: np.ndarray, occupied: np.ndarray, model: RoomEnergyModel, cfg: dict):
+    """(lighting_share, cooling_share) for decided commands; devices without a command run uncontrolled."""
+    dev, com = rules.devices, rules.commands
+    bit = {name: 1 << i for i, (name, _) in enumerate(rules.payloads)}
+    lc, lf = cmd[:, dev.index("lights")], flags[:, dev.index("lights")]
+    hc, hf = cmd[:, dev.index("hvac")], flags[:, dev.index("hvac")]
+    light = np.where(lc == com.index("off"), 0.0, np.where(lf & bit.get("dim", 0), model.dim_factor, 1.0))
+    light = np.where(lc < 0, 1.0, light)
+    cool = np.select([hc == com.index("off"), hc == com.index("eco"), hc == com.index("comfort")],
+                     [cfg["off_cooling_share"], cfg["eco_cooling_share"],
+                      1.0 + np.where(hf & bit.get("vent_boost", 0), cfg["vent_boost_share"], 0.0)],
+                     np.where(occupied, 1.0, model.vacant_cooling_share))
+    return light, cool
+
+def _simulate_chunk(job: dict) -> dict:
+    """Baseline and controlled kW for one config over [start_ns, end_ns)."""
+    cfg = {**CONTROL_DEFAULTS, **job["config"]}
+    _, floors_list = load_floors(job["floors_json"])
+    tbl = room_table(floors_list)
+    keys = list(zip(tbl["floor_id"].tolist(), tbl["room_id"].tolist()))
+    base_model = RoomEnergyModel(tbl)
+    model = RoomEnergyModel(tbl, setpoint_cool_c=cfg["setpoint_cool_c"])
+    rules = load_rules(cfg["rules_path"], cfg["thresholds"])
+    planner = MergePlanner(floors_list, solver=cfg["solver"])
+
+    stamps, rows, assigned, active = [], [], [], []
+    for ts, a in iter_ticks(job["dataset_dir"], tbl, start=job["start_ns"], end=job["end_ns"]):
+        counts_by_floor = {fid: {} for fid in tbl["floors"]}
+        for (fid, rid), c in zip(keys, a["count"].tolist()):
+            counts_by_floor[fid][rid] = c
+        plan = planner.plan(counts_by_floor)["assignments"]
+        stamps.append(ts)
+        rows.append(a)
+        assigned.append([plan[fid][rid]["assigned"] for fid, rid in keys])
+        active.append([plan[fid][rid]["active"] for fid, rid in keys])
+    if not stamps:
+        return {}
+    stamps = pd.DatetimeIndex(stamps)
+    a = {k: np.vstack([r[k] for r in rows]) for k in ("count", "co2", "lux", "door", "kw")}
+    t_out = _t_out(job["dataset_dir"], stamps, base_model, a)
+    base_kw = base_model.room_kw(a["count"], a["lux"], a["door"], t_out)
+
+    # policy world: people moved per the merge plan, then every room/device follows the rules
+    count = np.asarray(assigned, dtype=np.int64)
+    T, R = count.shape
+    cmd, flags = rules.decide(rules.condition_values({
+        "count": count.ravel(), "co2": a["co2"].ravel(), "lux": a["lux"].ravel(), "door": a["door"].ravel(),
+        "active": np.asarray(active, dtype=bool).ravel()}))
+    light, cool = _control_shares(rules, cmd, flags, count.ravel() > 0, model, cfg)
+    policy_kw = model.room_kw(count, a["lux"], a["door"], t_out, light.reshape(T, R), cool.reshape(T, R))
+    return {"timestamp": stamps, "base_kw": base_kw, "policy_kw": policy_kw}
+
+def _summarize(tbl: dict, parts: List[dict]) -> Dict[str, pd.DataFrame]:
+    parts = [p for p in parts if p]
+    stamps = pd.DatetimeIndex(np.concatenate([p["timestamp"] for p in parts]))
+    base = np.vstack([p["base_kw"] for p in parts])
+    pol = np.vstack([p["policy_kw"] for p in parts])
+    step_h = stamps.to_series().diff().median().total_seconds() / 3600 if len(stamps) > 1 else 0.0
+    model = RoomEnergyModel(tbl)
+
+    def table(b, p, ids):
+        df = pd.DataFrame({**ids, "kwh_base": b.sum(axis=0) * step_h, "kwh_policy": p.sum(axis=0) * step_h,
+                           "peak_kw_base": b.max(axis=0), "peak_kw_policy": p.max(axis=0)})
+        df["kwh_saved"] = df["kwh_base"] - df["kwh_policy"]
+        df["peak_kw_saved"] = df["peak_kw_base"] - df["peak_kw_policy"]
+        return df
+
+    fb, fp = model.rollup(base)[0], model.rollup(pol)[0]
+    return {"room": table(base, pol, {"floor_id": tbl["floor_id"], "room_id": tbl["room_id"]}),
+            "floor": table(fb, fp, {"floor_id": tbl["floors"]}),
+            "building": table(base.sum(axis=1, keepdims=True), pol.sum(axis=1, keepdims=True), {}),
+            "hours": len(stamps) * step_h}
+
+def simulate(dataset_dir: str, floors_json: str = "data/floors.json", config: Optional[dict] = None,
+             workers: int = 1) -> Dict[str, pd.DataFrame]:
+    """
+    Replays a batch dataset through RoomEnergyModel twice: as recorded (baseline) and with the merge
+    plan and rule-derived lighting/HVAC states applied (policy). Returns kWh and peak kW for both, and
+    the savings, per room, floor and building. `config` overrides CONTROL_DEFAULTS (setpoint, control
+    shares, solver, rule thresholds).
+    """
+    return sweep(dataset_dir, [config or {}], floors_json, workers)[0]
+
+def sweep(dataset_dir: str, configs: List[dict], floors_json: str = "data/floors.json",
+          workers: int = 1) -> List[Dict[str, pd.DataFrame]]:
+    """simulate() for every config; (config x time chunk) jobs share one process pool."""
+    tbl = room_table(load_floors(floors_json)[1])
+    chunks = _split(dataset_dir, workers * 2 if workers > 1 else 1)
+    jobs = [{"dataset_dir": dataset_dir, "floors_json": floors_json, "config": cfg, "start_ns": lo, "end_ns": hi}
+            for cfg in configs for lo, hi in chunks]
+    if workers <= 1:
+        parts = [_simulate_chunk(j) for j in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_simulate_chunk, jobs))
+    n = len(chunks)
+    return [_summarize(tbl, parts[i * n:(i + 1) * n]) for i in range(len(configs))]
+
+def grid(**axes) -> List[dict]:
+    """Cartesian product of parameter lists; threshold names (dim_lux, vent_co2, ...) go under "thresholds"."""
+    names = [k for k, v in axes.items() if v]
+    out = []
+    for values in itertools.product(*(axes[k] for k in names)):
+        cfg = {"thresholds": {}}
+        for k, v in zip(names, values):
+            if k in CONTROL_DEFAULTS:
+                cfg[k] = v
+            else:
+                cfg["thresholds"][k] = v
+        out.append(cfg)
+    return out or [{}]
+
+def main():
+    ap = argparse.ArgumentParser(description="What-if energy savings of the merge and control policies")
+    ap.add_argument("--dataset", default="outputs/synth")
+    ap.add_argument("--floors_json", default="data/floors.json")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--configs", default=None, help="JSON file with a list of config dicts (overrides the grid flags)")
+    ap.add_argument("--setpoint_cool_c", type=float, nargs="*", default=None)
+    ap.add_argument("--eco_cooling_share", type=float, nargs="*", default=None)
+    ap.add_argument("--dim_lux", type=float, nargs="*", default=None)
+    ap.add_argument("--vent_co2", type=float, nargs="*", default=None)
+    ap.add_argument("--solver", nargs="*", default=None, choices=["greedy", "optimal"])
+    ap.add_argument("--out", default=None, help="write the per-config building summary CSV here")
+    args = ap.parse_args()
+    if args.configs:
+        with open(args.configs) as f:
+            configs = json.load(f)
+    else:
+        configs = grid(setpoint_cool_c=args.setpoint_cool_c, eco_cooling_share=args.eco_cooling_share,
+                       dim_lux=args.dim_lux, vent_co2=args.vent_co2, solver=args.solver)
+    results = sweep(args.dataset, configs, args.floors_json, args.workers)
+    summary = pd.DataFrame([{"config": json.dumps(c, sort_keys=True), "hours": r["hours"], **r["building"].iloc[0].to_dict()}
+                            for c, r in zip(configs, results)])
+    print(summary.to_string(index=False, float_format="%.1f"))
+    if len(results) == 1:
+        print(results[0]["floor"].to_string(index=False, float_format="%.1f"))
+    if args.out:
+        summary.to_csv(args.out, index=False)
+
+if __name__ == "__main__":
+    main()
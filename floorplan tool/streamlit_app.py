@@ -5,11 +5,18 @@ import streamlit as st
 import plotly.graph_objects as go
 import plotly.express as px
 
-from src.floors import load_floors, rooms_by_floor
-from src.merge_policy import suggest_merges_to_common
+from src.floors import load_floors, rooms_by_floor, floors_hash
+from src.merge_policy import MergePlanner, ZonePlanCache
 from src.policy import derive_commands
 from src.open_meteo import geocode_city, forecast_hours, outline_bullets
 from src.hf_llm import summarize
+from src.storage import detect_store, read_table
+from src.ringbuf import RingBuffer, to_frame
+from src.snapbus import SnapshotSubscriber, snapshot_frames
+from src.rollups import query_rollup
+from src.batch_policy import evaluate_timeline, day_kpis
+from src.precool import schedule as precool_schedule
+from src.stateapi import fetch_state
 
 # ------------------------------------------------------------
 # Site configuration and theme
@@ -41,11 +48,31 @@ st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 FLOORS_JSON = "data/floors.json"
 BATCH_DIR = "outputs/synth"
 LIVE_DIR = "outputs/live"
+ROLLUP_DIR = os.path.join(LIVE_DIR, "rollups")
+LIVE_BUS = os.getenv("LIVE_BUS_SOCKET", os.path.join(LIVE_DIR, "bus.sock"))
+CONTROLLER_URL = os.getenv("CONTROLLER_URL", "http://127.0.0.1:8765")   # hvac_controller --http_port 8765
 
 def _read_csv(path):
     return pd.read_csv(path, parse_dates=["timestamp"]) if os.path.exists(path) else None
 
+def _bus_snapshots():
+    # latest tick straight from the live generator's snapshot bus, when it runs with bus_path
+    if not os.path.exists(LIVE_BUS): return None
+    try:
+        sub = SnapshotSubscriber(LIVE_BUS, timeout=2.0)
+        try:
+            fr = snapshot_frames(sub, sub.latest(timeout=2.0))
+        finally:
+            sub.close()
+    except (OSError, ConnectionError):
+        return None
+    for df in fr.values():
+        df["timestamp"] = pd.to_datetime(df["timestamp"])
+    return fr["occupancy"], fr["sensors"], fr["energy_room"], fr["energy_floor"], fr["energy_building"]
+
 def _live_snapshots():
+    snaps = _bus_snapshots()
+    if snaps is not None: return snaps
     occ = _read_csv(os.path.join(LIVE_DIR, "occupancy_live.csv"))
     sen = _read_csv(os.path.join(LIVE_DIR, "sensors_live.csv"))
     er  = _read_csv(os.path.join(LIVE_DIR, "energy_room_live.csv"))
@@ -54,11 +81,12 @@ def _live_snapshots():
     return occ, sen, er, ef, eb
 
 def _batch_dataset():
-    occ = _read_csv(os.path.join(BATCH_DIR, "occupancy.csv"))
-    sen = _read_csv(os.path.join(BATCH_DIR, "sensors.csv"))
-    er  = _read_csv(os.path.join(BATCH_DIR, "energy_room.csv"))
-    ef  = _read_csv(os.path.join(BATCH_DIR, "energy_floor.csv"))
-    eb  = _read_csv(os.path.join(BATCH_DIR, "energy_building.csv"))
+    # columnar tables when synth ran with --store columnar, CSVs otherwise
+    occ = read_table(BATCH_DIR, "occupancy")
+    sen = read_table(BATCH_DIR, "sensors")
+    er  = read_table(BATCH_DIR, "energy_room")
+    ef  = read_table(BATCH_DIR, "energy_floor")
+    eb  = read_table(BATCH_DIR, "energy_building")
     return occ, sen, er, ef, eb
 
 def _file_mtime(path):
@@ -87,6 +115,7 @@ do_refresh = st.sidebar.button("Refresh data")
 # Weather options
 city = st.sidebar.text_input("Weather city", value="Bengaluru")
 hrs = st.sidebar.slider("Forecast horizon (hours)", 12, 72, 36, step=6)
+merge_solver = st.sidebar.radio("Merge solver", ["greedy", "optimal"], index=0, horizontal=True)
 
 # Batch assist
 if mode == "Batch" and st.sidebar.button("Generate 24h synthetic batch"):
@@ -170,7 +199,15 @@ energy_room_snapshot = {}
 for _, r in er_now.iterrows():
     energy_room_snapshot.setdefault(r["floor_id"], {})[r["room_id"]] = float(r["kw"])
 
-merge_plan = suggest_merges_to_common(floors_list, counts_by_floor)
+# the planner persists across reruns and re-plans only zones whose counts changed
+@st.cache_resource
+def _plan_cache():
+    return ZonePlanCache(maxsize=4096)
+
+planner = st.session_state.get("merge_planner")
+if planner is None or planner.solver != merge_solver or planner.floors_hash != floors_hash(FLOORS_JSON):
+    planner = st.session_state["merge_planner"] = MergePlanner.from_json(FLOORS_JSON, merge_solver, cache=_plan_cache())
+merge_plan = planner.plan(counts_by_floor)
 commands = derive_commands(floors_list, counts_by_floor, merge_plan["assignments"], sensors_by_floor)
 
 # ------------------------------------------------------------
@@ -236,18 +273,39 @@ with tab1:
 with tab2:
     st.markdown("<div class='card'>", unsafe_allow_html=True)
     if mode == "Live":
-        def tail_csv(path, n=400):
-            p = os.path.join(LIVE_DIR, path)
-            if not os.path.exists(p): return None
-            df = pd.read_csv(p, parse_dates=["timestamp"])
-            return df.tail(n)
-        occ_hist = tail_csv("occupancy_log.csv")
-        ef_hist  = tail_csv("energy_floor_log.csv")
-        eb_hist  = tail_csv("energy_building_log.csv")
+        def tail_log(table, n=400, window=pd.Timedelta(hours=1)):
+            ring = os.path.join(LIVE_DIR, f"{table}.ring")
+            if os.path.exists(ring):
+                rb = RingBuffer(ring)
+                return to_frame(rb, rb.last(n))
+            store = detect_store(LIVE_DIR, table)
+            if not store.exists(table): return None
+            # columnar logs only read the trailing window; CSV logs are read in full
+            bounds = store.time_bounds(table) if store.kind == "columnar" else None
+            df = store.read(table, start=bounds[1] - window if bounds else None)
+            return df.tail(n) if df is not None else None
+        spans = {"24h": pd.Timedelta(hours=24), "7d": pd.Timedelta(days=7), "30d": pd.Timedelta(days=30)}
+        window = "Recent ticks"
+        if os.path.isdir(ROLLUP_DIR):
+            window = st.radio("Window", ["Recent ticks"] + list(spans), horizontal=True)
+        if window == "Recent ticks":
+            occ_hist = tail_log("occupancy_log")
+            ef_hist  = tail_log("energy_floor_log")
+            eb_hist  = tail_log("energy_building_log")
+        else:
+            # long ranges come from the pre-aggregated tiles (python -m src.rollups), never the raw logs
+            end = pd.Timestamp.now(tz="UTC")
+            start = end - spans[window]
+            def tiles(metric, level, value):
+                df = query_rollup(ROLLUP_DIR, metric, level, start=start, end=end)
+                return df.rename(columns={"mean": value}) if df is not None and len(df) else None
+            occ_hist = tiles("occupancy", "building", "count")
+            ef_hist  = tiles("energy", "floor", "meter_kw")
+            eb_hist  = tiles("energy", "building", "meter_kw")
     else:
         occ_hist = occ.groupby("timestamp", as_index=False)["count"].sum()
-        ef_hist  = _read_csv(os.path.join(BATCH_DIR, "energy_floor.csv"))
-        eb_hist  = _read_csv(os.path.join(BATCH_DIR, "energy_building.csv"))
+        ef_hist  = ef
+        eb_hist  = eb
         if ef_hist is not None: ef_hist = ef_hist.tail(400)
         if eb_hist is not None: eb_hist = eb_hist.tail(400)
 
@@ -284,6 +342,32 @@ with tab3:
         st.dataframe(dfc.sort_values(["floor_id","room_id"]), use_container_width=True, height=320)
     else:
         st.caption("No commands.")
+
+    # running controller (hvac_controller --http_port): what it actually sent, without reading its files
+    ctl = fetch_state(CONTROLLER_URL, timeout=0.5)
+    if ctl is not None:
+        st.subheader("Controller")
+        m = ctl.get("command_metrics") or {}
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Commands sent", m.get("sent", 0))
+        c2.metric("Suppressed", f"{100 * m.get('suppression_ratio', 0.0):.0f}%")
+        c3.metric("Merge suggestions", len(ctl.get("merge_plan", {}).get("suggestions", [])))
+        if ctl.get("last_commands"):
+            st.dataframe(pd.DataFrame(ctl["last_commands"]), use_container_width=True, height=200)
+
+    if mode == "Batch":
+        # whole-timeline policy run; cached next to the dataset, so only the first view pays for it
+        st.subheader("Day KPIs (whole timeline)")
+        kpis = day_kpis(evaluate_timeline(BATCH_DIR, FLOORS_JSON, merge_solver, workers=os.cpu_count() or 1))
+        if kpis:
+            fig_saved = px.bar(kpis["saved_by_hour"], x="hour", y="saved_area_m2", title="Saved area per hour (m², mean)")
+            fig_saved.update_layout(margin=dict(l=0,r=0,t=40,b=0))
+            st.plotly_chart(fig_saved, use_container_width=True)
+            c1, c2 = st.columns(2)
+            c1.markdown("Commands per device")
+            c1.dataframe(kpis["commands"], use_container_width=True, height=260)
+            c2.markdown("HVAC eco hours per room")
+            c2.dataframe(kpis["eco_hours"], use_container_width=True, height=260)
     st.markdown("</div>", unsafe_allow_html=True)
 
 # Weather
@@ -300,6 +384,14 @@ with tab4:
             figw.update_layout(legend=dict(orientation="h", y=1.02, x=1, xanchor="right", yanchor="bottom"))
             st.plotly_chart(figw, use_container_width=True)
             for b in bullets: st.write("- " + b)
+            pc = precool_schedule(fc, floors_list, objective="peak")
+            st.subheader("Pre-cool schedule")
+            st.caption(f"Building peak {pc['building_peak_kw']:.0f} kW vs {pc['building_peak_kw_baseline']:.0f} kW "
+                       f"at a fixed setpoint (solved in {1000 * pc['solve_s']:.0f} ms)")
+            figp = px.line(pc["schedule"], x="timestamp", y="setpoint", color="floor_id", line_shape="hv",
+                           title="Setpoint per floor")
+            st.plotly_chart(figp, use_container_width=True)
+            st.dataframe(pc["summary"], use_container_width=True)
         except Exception as e:
             st.error(str(e))
     st.markdown("</div>", unsafe_allow_html=True)
@@ -0,0 +1,18 @@
+import os
+import pytest
+from src.hvac_controller import Controller
+
+FLOORS = os.path.join(os.path.dirname(__file__), "..", "data", "floors.json")
+
+@pytest.mark.parametrize("stabilize", [True, False])
+def test_note_is_resent_when_the_door_opens_again(stabilize):
+    ctl = Controller(FLOORS, resync_every=None, plan_cache_size=0, stabilize=stabilize)
+    rid = ctl.tbl["room_id"][0]
+    counts = {r: 0 for r in ctl.tbl["room_id"].tolist()}
+    counts[rid] = 3
+    notes = []
+    for t, door in enumerate([1, 0, 1, 1]):
+        _, changes = ctl.decide(counts, {rid: {"door": door}}, now=1000.0 + 10 * t)
+        notes.append([c for c in changes if c[1] == rid and c[2] == "advice"])
+    assert [len(n) for n in notes] == [1, 0, 1, 0]
+    assert notes[2][0][3] == "note" and notes[2][0][4] == notes[0][0][4]
@@ -0,0 +1,13 @@
+import asyncio
+from src.hvac_runtime import InputSlots
+
+def test_count_bursts_do_not_drop_a_pending_sensors_update():
+    async def run():
+        slots, stats = InputSlots(), {"coalesced": 0}
+        slots.offer(("sensors", {"R1": {"door": 1}}, None, 0.0), stats)
+        for i in range(20):
+            slots.offer(("counts", {"R1": i}, None, float(i)), stats)
+        return await slots.take(1.0), stats, await slots.take(0.01)
+    batch, stats, empty = asyncio.run(run())
+    assert {item[0]: item[1] for item in batch} == {"sensors": {"R1": {"door": 1}}, "counts": {"R1": 19}}
+    assert stats["coalesced"] == 19 and empty == []
@@ -0,0 +1,20 @@
+import os
+from src.floors import load_floors
+from src.merge_policy import MergePlanner, ZonePlanCache
+
+FLOORS = os.path.join(os.path.dirname(__file__), "..", "data", "floors.json")
+
+def test_bucketed_cache_keeps_vacant_rooms_empty():
+    floors_list = load_floors(FLOORS)[1]
+    vacant = {F["floor_id"]: {r["room_id"]: 0 for r in F["rooms"]} for F in floors_list}
+    plan = MergePlanner(floors_list, cache=ZonePlanCache(64, [2, 5, 10])).plan(vacant)
+    assert plan["saved_area_m2"] == 0.0 and plan["suggestions"] == []
+    assert all(a["assigned"] == 0 for f in plan["assignments"].values() for a in f.values())
+
+def test_bucketed_plan_reports_actual_headcounts():
+    floors_list = load_floors(FLOORS)[1]
+    counts = {F["floor_id"]: {r["room_id"]: 1 for r in F["rooms"]} for F in floors_list}
+    plan = MergePlanner(floors_list, cache=ZonePlanCache(64, [2, 5, 10])).plan(counts)
+    assigned = sum(a["assigned"] for f in plan["assignments"].values() for a in f.values())
+    assert assigned == sum(len(F["rooms"]) for F in floors_list)
+    assert all(sum(m["count"] for m in s["moves"]) == 1 for s in plan["suggestions"])
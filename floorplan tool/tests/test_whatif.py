@@ -0,0 +1,36 @@
+import os
+import numpy as np
+import pandas as pd
+from src.floors import load_floors, room_table
+from src.energy_model import RoomEnergyModel
+from src.whatif import _t_out
+
+FLOORS = os.path.join(os.path.dirname(__file__), "..", "data", "floors.json")
+
+def _inputs(T=12):
+    tbl = room_table(load_floors(FLOORS)[1])
+    model = RoomEnergyModel(tbl)
+    R = len(tbl["room_id"])
+    stamps = pd.date_range("2025-09-18 14:07:06", periods=T, freq="5min", tz="UTC")
+    rng = np.random.default_rng(0)
+    a = {"count": rng.integers(0, 5, (T, R)), "lux": rng.uniform(100, 600, (T, R)), "door": np.zeros((T, R))}
+    a["kw"] = model.room_kw(a["count"], a["lux"], a["door"], np.full(T, 30.0))
+    return stamps, model, a
+
+def test_t_out_matches_unaligned_weather_ticks(tmp_path):
+    stamps, model, a = _inputs()
+    weather = pd.date_range(stamps[0] - pd.Timedelta(32, "min") - pd.Timedelta(14, "s"), periods=30, freq="5min", tz="UTC")
+    temps = np.linspace(25.0, 35.0, len(weather))
+    pd.DataFrame({"timestamp": weather, "air_temperature": temps}).to_csv(tmp_path / "weather_synth.csv", index=False)
+    t = _t_out(str(tmp_path), stamps, model, a)
+    assert not np.isnan(t).any()
+    nearest = [temps[np.abs(weather - ts).argmin()] for ts in stamps]
+    np.testing.assert_allclose(t, nearest)
+
+def test_t_out_falls_back_to_kw_recovery_when_no_weather_tick_is_close(tmp_path):
+    stamps, model, a = _inputs()
+    weather = pd.date_range(stamps[0] - pd.Timedelta(50, "min"), periods=6, freq="5min", tz="UTC")
+    pd.DataFrame({"timestamp": weather, "air_temperature": 99.0}).to_csv(tmp_path / "weather_synth.csv", index=False)
+    t = _t_out(str(tmp_path), stamps, model, a)
+    np.testing.assert_allclose(t, _t_out(str(tmp_path / "missing"), stamps, model, a))
+    assert not np.isnan(t).any() and (t < 99.0).all()